@@ -0,0 +1 @@
+# Mulns, SuperSR benchmarks
@@ -0,0 +1,75 @@
+'''Images/sec, padding overhead and retraces of bucketed vs per-image inference.
+
+    python -m benchmarks.buckets --model EDSR_baseline --scale 2 --out buckets.json
+
+    Full images of Set5 + Set14 (mixed sizes) are super-resolved one by one
+    (`multiple` 1, batch size 1), and with shape buckets of several granularities.
+'''
+import argparse
+import time
+
+import numpy as np
+
+from .utils import TRAIN_DIR, VALID_DIR, image_paths, run_isolated, dump
+
+
+def load_images(downscale):
+    from PIL import Image
+    return [
+        np.asarray(Image.open(p).convert("RGB"))[::downscale, ::downscale] / 255.
+        for p in image_paths(VALID_DIR) + image_paths(TRAIN_DIR)
+    ]
+
+
+def bench_buckets(model_name, scale, multiple, batch_size, downscale, nb_runs):
+    from src import model as sr_models
+
+    sr = getattr(sr_models, model_name)(scale, "bench").create_model()
+    images = load_images(downscale)
+    if sr.channel == 1:
+        images = [x.mean(-1, keepdims=True) for x in images]
+
+    # The first pass includes tracing, the following ones are steady state.
+    _, stats = sr.predict_images(images, multiple=multiple,
+                                 batch_size=batch_size)
+    times = []
+    for _ in range(nb_runs):
+        _, steady = sr.predict_images(images, multiple=multiple,
+                                      batch_size=batch_size)
+        times.append(steady["seconds"])
+    stats.update({
+        "model": model_name,
+        "scale": scale,
+        "multiple": multiple,
+        "batch_size": batch_size,
+        "first_pass_s": stats.pop("seconds"),
+        "images_per_s": len(images) / float(np.median(times)),
+        "retraces_after_first_pass": sr.nb_traces - stats["nb_traces"],
+    })
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--model", default="EDSR_baseline")
+    parser.add_argument("--scale", type=int, default=2)
+    parser.add_argument("--multiples", nargs="+", type=int,
+                        default=[16, 64, 128])
+    parser.add_argument("--batch_size", type=int, default=4)
+    # Feed images downscaled by this factor, to keep full-image batches small.
+    parser.add_argument("--downscale", type=int, default=2)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--out", default="buckets.json")
+    args = parser.parse_args()
+
+    configs = [(1, 1)] + [(m, args.batch_size) for m in args.multiples]
+    results = {"timestamp": time.strftime("%Y-%m-%d %H:%M:%S"), "runs": []}
+    for multiple, batch_size in configs:
+        results["runs"].append(
+            run_isolated(bench_buckets, args.model, args.scale, multiple,
+                         batch_size, args.downscale, args.runs))
+    dump(results, args.out)
+
+
+if __name__ == "__main__":
+    main()
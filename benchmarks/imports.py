@@ -0,0 +1,63 @@
+'''Wall time of fresh interpreters importing parts of the package.
+
+    python -m benchmarks.imports --out imports.json
+
+    Each statement runs in a new process (median of `--runs`), thus it includes
+    interpreter startup, measured by "pass" as reference.
+'''
+import subprocess
+import argparse
+import tempfile
+import sys
+import time
+import os
+
+import numpy as np
+
+from .utils import ROOT, dump
+
+STATEMENTS = [
+    "pass",
+    "import tensorflow",
+    "import src",
+    "import src.model",
+    "from src.model import get_model; get_model('edsr_baseline', 4)",
+    "from src.write2tfrec import load_tfrecord",
+    "from src.preprocess import degrade_image",
+]
+
+
+def import_time(statement, nb_runs):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [ROOT] + ([env["PYTHONPATH"]] if env.get("PYTHONPATH") else []))
+    # Run in a temporary directory, `BaseSRModel` creates ./weights.
+    times = []
+    with tempfile.TemporaryDirectory() as cwd:
+        for _ in range(nb_runs):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, "-c", statement],
+                           cwd=cwd,
+                           env=env,
+                           check=True)
+            times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--statements", nargs="+", default=STATEMENTS)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--out", default="imports.json")
+    args = parser.parse_args()
+
+    results = {
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "seconds": {s: import_time(s, args.runs)
+                    for s in args.statements}
+    }
+    dump(results, args.out)
+
+
+if __name__ == "__main__":
+    main()
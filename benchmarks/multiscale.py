@@ -0,0 +1,81 @@
+'''Training cost of `EDSR_multiscale` on (2, 3, 4) vs an `EDSR_baseline` run per scale.
+
+    python -m benchmarks.multiscale --out multiscale.json
+    python -m benchmarks.multiscale --scales 2 4 --steps 20 --batch_size 16
+
+    Both train `steps` steps of `batch_size` hr-patches per scale, cropped on the fly
+    from Image/set14 and degraded by bicubic in the input pipeline. Runs per scale read
+    and crop each patch once per scale, the multi-scale run once for all scales. Each
+    run is in its own process, `train_s` is the wall time of `model.fit` after a
+    warm-up step (tracing), input pipeline included.
+'''
+import argparse
+import time
+
+from .utils import TRAIN_DIR, image_paths, peak_rss_mb, run_isolated, dump
+
+
+def _train_time(model, dst, nb_steps):
+    from tensorflow.python.keras.optimizer_v2.adam import Adam
+
+    model.compile(optimizer=Adam(1e-4), loss="mse")
+    model.fit(dst, steps_per_epoch=1, verbose=0)
+    start = time.perf_counter()
+    model.fit(dst, steps_per_epoch=nb_steps, verbose=0)
+    return time.perf_counter() - start
+
+
+def bench_multiscale(scales, multiscale, batch_size, patch_size, nb_steps):
+    from src.data_utils import random_patch_dataset
+    from src.preprocess import degrade_batch, degrade_multiscale
+    from src import model as sr_models
+
+    dst = random_patch_dataset(image_paths(TRAIN_DIR), patch_size,
+                               seed=0).batch(batch_size)
+    if multiscale:
+        sr = sr_models.EDSR_multiscale(scales, "bench").create_model()
+        dst = dst.map(lambda hr: degrade_multiscale(hr, scales, method=2))
+    else:
+        sr = sr_models.EDSR_baseline(scales[0], "bench").create_model()
+        dst = dst.map(lambda hr: degrade_batch(hr, scales[0], method=2))
+    train_s = _train_time(sr.model, dst.prefetch(2), nb_steps)
+    return {
+        "scales": scales,
+        "train_s": train_s,
+        "patches_read": (nb_steps + 1) * batch_size,
+        "nb_params": sr.model.count_params(),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--scales", nargs="+", type=int, default=[2, 3, 4])
+    parser.add_argument("--batch_size", type=int, default=8)
+    parser.add_argument("--patch_size", type=int, default=96)
+    parser.add_argument("--steps", type=int, default=10)
+    parser.add_argument("--out", default="multiscale.json")
+    args = parser.parse_args()
+
+    bench = lambda scales, multiscale: run_isolated(
+        bench_multiscale, scales, multiscale, args.batch_size,
+        args.patch_size, args.steps)
+    separate = [bench([s], False) for s in args.scales]
+    joint = bench(args.scales, True)
+    results = {
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "separate": separate,
+        "multiscale": joint,
+        "total": {
+            key: {
+                "separate": sum(run[key] for run in separate),
+                "multiscale": joint[key]
+            }
+            for key in ("train_s", "patches_read", "nb_params")
+        },
+    }
+    dump(results, args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+'''Step time and PSNR of float32 vs bfloat16 / XLA modes of `BaseSRModel`.
+
+    python -m benchmarks.precision --model EDSR_baseline --scale 2 --out precision.json
+'''
+import argparse
+
+import numpy as np
+
+from .utils import (TRAIN_DIR, VALID_DIR, patch_batches, timed, percentiles,
+                    run_isolated, dump)
+
+MODES = {
+    "float32": dict(precision="float32", jit_compile=False),
+    "float32_xla": dict(precision="float32", jit_compile=True),
+    "mixed_bfloat16": dict(precision="mixed_bfloat16", jit_compile=False),
+    "mixed_bfloat16_xla": dict(precision="mixed_bfloat16", jit_compile=True),
+}
+
+
+def bench_mode(model_name, scale, mode, nb_steps, batch_size, patch_size):
+    import tensorflow as tf
+    from tensorflow.python.keras.optimizer_v2.adam import Adam
+    from src import model as sr_models
+    from src.model.utils import psnr_tf
+    from src.model.common import jit_scope
+
+    tf.random.set_seed(0)
+    sr = getattr(sr_models, model_name)(scale, "bench", **MODES[mode])
+    sr.create_model()
+    sr.model.compile(optimizer=Adam(1e-4), loss="mse", metrics=[psnr_tf])
+
+    kwargs = dict(batch_size=batch_size,
+                  patch_size=patch_size,
+                  scale=scale,
+                  pre_upsample=sr.pre_upsample,
+                  channel=sr.channel)
+    train = patch_batches(TRAIN_DIR, nb_steps, **kwargs)
+    valid = patch_batches(VALID_DIR, 4, seed=1, **kwargs)
+
+    it = iter(train * 2)
+    with jit_scope(sr.jit_compile):
+        step_times = timed(lambda: sr.model.train_on_batch(*next(it)),
+                           nb_runs=nb_steps - 2)
+    infer_times = timed(lambda: sr._forward(valid[0][0]), nb_runs=10)
+    psnr = np.mean([
+        float(np.mean(psnr_tf(hr, np.clip(sr._forward(lr), 0., 1.))))
+        for lr, hr in valid
+    ])
+    return {
+        "mode": mode,
+        "train_step_s": percentiles(step_times),
+        "inference_batch_s": percentiles(infer_times),
+        "val_psnr": psnr,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--model", default="EDSR_baseline")
+    parser.add_argument("--scale", type=int, default=2)
+    parser.add_argument("--steps", type=int, default=50)
+    parser.add_argument("--batch_size", type=int, default=16)
+    parser.add_argument("--patch_size", type=int, default=48)
+    parser.add_argument("--modes", nargs="+", default=list(MODES))
+    parser.add_argument("--out", default="precision.json")
+    args = parser.parse_args()
+
+    results = {
+        "model": args.model,
+        "scale": args.scale,
+        "batch_size": args.batch_size,
+        "patch_size": args.patch_size,
+        "modes": [
+            run_isolated(bench_mode, args.model, args.scale, m, args.steps,
+                         args.batch_size, args.patch_size) for m in args.modes
+        ]
+    }
+    dump(results, args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+'''PSNR drop of int8 (and float16) TFLite models vs keras float32, on Set5/Set14.
+
+    python -m benchmarks.quantization --out quantization.json
+    python -m benchmarks.quantization --models EDSR_baseline --scales 2 --weights_dir ./weights
+
+    Activation ranges are calibrated with patches of `load_tfrecord`, written from
+    Set14. Models are randomly initialized unless `<weights_dir>/<model>_X<scale>.h5`
+    exists, thus report trained models for meaningful numbers. Runs on CPU only.
+'''
+import argparse
+import tempfile
+import time
+import os
+
+from .utils import TRAIN_DIR, VALID_DIR, image_paths, timed, run_isolated, dump
+
+MODELS = ["SRCNN_915", "EDSR_baseline"]
+SCALES = [2, 3, 4]
+TEST_SETS = {"set5": VALID_DIR, "set14": TRAIN_DIR}
+
+
+def bench_quantization(model_name, scale, weights_dir, nb_samples, tile_size,
+                       modes):
+    os.environ["CUDA_VISIBLE_DEVICES"] = "-1"
+    import numpy as np
+    from src import model as sr_models
+    from src.model.export import export_tflite
+    from src.model.quantize import (representative_dataset, quantize_int8,
+                                    tflite_predict_fn)
+    from src.write2tfrec import write_dst_tfrec
+
+    sr = getattr(sr_models, model_name)(scale, "quant")
+    weights_path = os.path.join(weights_dir,
+                                "%s_X%d.h5" % (model_name, scale))
+    sr.create_model(load_weights=os.path.exists(weights_path),
+                    weights_path=weights_path)
+
+    # Calibration lr-patches have the same shape as tiles.
+    patch_size = tile_size * scale
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tfrec = write_dst_tfrec(image_paths(TRAIN_DIR), nb_samples // 10 + 1,
+                                patch_size, os.path.join(tmp_dir, "calib.tfrec"),
+                                seed=0)
+        shape = (tile_size, ) * 2
+
+        tflites = {}
+        for mode in modes:
+            path = os.path.join(tmp_dir, "%s.tflite" % mode)
+            if mode == "int8":
+                quantize_int8(sr, path,
+                              representative_dataset(sr, tfrec, patch_size,
+                                                     nb_samples=nb_samples),
+                              shape=shape)
+            else:
+                export_tflite(sr, path, mode=mode, shape=shape)
+            tflites[mode] = path
+
+        result = {
+            "model": model_name,
+            "scale": scale,
+            "trained": os.path.exists(weights_path),
+            "size_mb": {m: os.path.getsize(p) / 2.**20
+                        for m, p in tflites.items()},
+        }
+        overlap = sr.receptive_field()
+        for name, test_dir in TEST_SETS.items():
+            ref = sr.evaluate(test_dir, tile_size=tile_size)
+            metrics = {"keras": {"psnr": ref["psnr"], "ssim": ref["ssim"]}}
+            for mode, path in tflites.items():
+                predict = tflite_predict_fn(path, scale, tile_size, overlap)
+                res = sr.evaluate(test_dir, predict_fn=predict)
+                lr = np.random.rand(tile_size, tile_size, sr.channel)
+                metrics[mode] = {
+                    "psnr": res["psnr"],
+                    "ssim": res["ssim"],
+                    "psnr_drop": ref["psnr"] - res["psnr"],
+                    "tile_latency_s": float(
+                        np.median(timed(lambda: predict(lr), nb_runs=5))),
+                }
+            result[name] = metrics
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--models", nargs="+", default=MODELS)
+    parser.add_argument("--scales", nargs="+", type=int, default=SCALES)
+    parser.add_argument("--weights_dir", default="./weights")
+    parser.add_argument("--samples", type=int, default=200)
+    # Hr-patches of tile_size * scale have to fit in the smallest Set14 image.
+    parser.add_argument("--tile_size", type=int, default=48)
+    parser.add_argument("--modes", nargs="+", default=["float32", "int8"])
+    parser.add_argument("--out", default="quantization.json")
+    args = parser.parse_args()
+
+    results = {"timestamp": time.strftime("%Y-%m-%d %H:%M:%S"), "models": []}
+    for model_name in args.models:
+        for scale in args.scales:
+            results["models"].append(
+                run_isolated(bench_quantization, model_name, scale,
+                             args.weights_dir, args.samples, args.tile_size,
+                             args.modes))
+    dump(results, args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+'''Peak memory vs step time of EDSR training with gradient checkpointing every k blocks.
+
+    python -m benchmarks.recompute --out recompute.json
+    python -m benchmarks.recompute --model EDSR_baseline --ks 0 1 4 16 --batch_size 16
+
+    k = 0 keeps all activations (fused residual stack without recomputation). Each k
+    runs in its own process on pre-generated random batches, `train_peak_mb` is the
+    growth of peak RSS during training steps over the built model, i.e. activations,
+    gradients and optimizer state.
+'''
+import argparse
+import time
+
+import numpy as np
+
+from .utils import timed, percentiles, peak_rss_mb, run_isolated, dump
+
+
+def bench_recompute(model_name, scale, k, batch_size, patch_size, nb_steps):
+    from tensorflow.python.keras.optimizer_v2.adam import Adam
+    from src import model as sr_models
+
+    sr = getattr(sr_models, model_name)(scale,
+                                        "bench",
+                                        fused=True,
+                                        checkpoint_every=k or None)
+    sr.create_model()
+    sr.model.compile(optimizer=Adam(1e-4), loss="mse")
+    rng = np.random.RandomState(0)
+    lr = rng.rand(batch_size, patch_size // scale, patch_size // scale,
+                  3).astype(np.float32)
+    hr = rng.rand(batch_size, patch_size, patch_size, 3).astype(np.float32)
+
+    base_mb = peak_rss_mb()
+    times = timed(lambda: sr.model.train_on_batch(lr, hr), nb_runs=nb_steps)
+    return {
+        "model": model_name,
+        "checkpoint_every": k,
+        "batch_size": batch_size,
+        "patch_size": patch_size,
+        "step_s": percentiles(times),
+        "peak_rss_mb": peak_rss_mb(),
+        "train_peak_mb": peak_rss_mb() - base_mb,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--model", default="EDSR")
+    parser.add_argument("--scale", type=int, default=2)
+    parser.add_argument("--ks", nargs="+", type=int, default=[0, 1, 2, 4, 8])
+    parser.add_argument("--batch_size", type=int, default=8)
+    parser.add_argument("--patch_size", type=int, default=96)
+    parser.add_argument("--steps", type=int, default=5)
+    parser.add_argument("--out", default="recompute.json")
+    args = parser.parse_args()
+
+    results = {"timestamp": time.strftime("%Y-%m-%d %H:%M:%S"), "runs": []}
+    for k in args.ks:
+        results["runs"].append(
+            run_isolated(bench_recompute, args.model, args.scale, k,
+                         args.batch_size, args.patch_size, args.steps))
+    dump(results, args.out)
+
+
+if __name__ == "__main__":
+    main()
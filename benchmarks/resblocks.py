@@ -0,0 +1,91 @@
+'''Latency and memory traffic of EDSR residual blocks, `_ResBlock` stack vs fused `ResidualStack`.
+
+    python -m benchmarks.resblocks --out resblocks.json
+
+    Memory traffic is estimated from the inference graph at a fixed input shape, as
+    the bytes of all tensors produced by ops (each is written once and read at least
+    once). Each (model, variant) runs in its own process, outputs of fused models are
+    compared with the unfused ones with the same weights.
+'''
+import argparse
+import tempfile
+import time
+import os
+
+import numpy as np
+
+from .utils import timed, percentiles, peak_rss_mb, run_isolated, dump
+
+MODELS = ["EDSR_baseline", "EDSR"]
+
+
+def graph_traffic(model, shape):
+    '''Number of ops and MB of tensors produced by them, in inference graph on `shape`.'''
+    import tensorflow as tf
+    fn = tf.function(lambda x: model(x, training=False)).get_concrete_function(
+        tf.TensorSpec(shape, tf.float32))
+    nb_ops, nbytes = 0, 0
+    for op in fn.graph.get_operations():
+        if op.type in ("Const", "Placeholder", "ReadVariableOp", "Identity",
+                       "NoOp"):
+            continue
+        nb_ops += 1
+        for t in op.outputs:
+            if t.shape.is_fully_defined():
+                nbytes += t.shape.num_elements() * t.dtype.size
+    return nb_ops, nbytes / 2.**20
+
+
+def bench_resblocks(model_name, scale, fused, weights_path, resolutions,
+                    nb_runs):
+    from src import model as sr_models
+
+    sr = getattr(sr_models, model_name)(scale, "bench", fused=fused)
+    sr.create_model(load_weights=fused, weights_path=weights_path)
+    if not fused:
+        sr.model.save_weights(weights_path)
+
+    result = {"model": model_name, "fused": fused, "latency": {},
+              "nb_ops": {}, "traffic_mb": {}}
+    for res in resolutions:
+        key = "%dx%d" % (res, res)
+        x = np.random.RandomState(0).rand(1, res, res, 3).astype(np.float32)
+        result["latency"][key] = percentiles(
+            timed(lambda: sr._forward(x), nb_runs))
+        result["nb_ops"][key], result["traffic_mb"][key] = graph_traffic(
+            sr.model, x.shape)
+        np.save(weights_path + "_%s_%d.npy" % (key, fused), sr._forward(x))
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--models", nargs="+", default=MODELS)
+    parser.add_argument("--scale", type=int, default=2)
+    parser.add_argument("--resolutions", nargs="+", type=int,
+                        default=[64, 128, 256])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--out", default="resblocks.json")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        results = {"timestamp": time.strftime("%Y-%m-%d %H:%M:%S"), "runs": []}
+        for model_name in args.models:
+            weights_path = os.path.join(tmp_dir, "%s.h5" % model_name)
+            # Unfused first, it writes the weights loaded by the fused one.
+            for fused in (False, True):
+                results["runs"].append(
+                    run_isolated(bench_resblocks, model_name, args.scale, fused,
+                                 weights_path, args.resolutions, args.runs))
+            run = results["runs"][-1]
+            run["max_abs_diff"] = max(
+                float(np.abs(
+                    np.load(weights_path + "_%dx%d_1.npy" % (r, r)) -
+                    np.load(weights_path + "_%dx%d_0.npy" % (r, r))).max())
+                for r in args.resolutions)
+    dump(results, args.out)
+
+
+if __name__ == "__main__":
+    main()
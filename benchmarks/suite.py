@@ -0,0 +1,172 @@
+'''Throughput, latency and memory of all registered models, and of the data pipeline.
+
+    python -m benchmarks.suite --out bench.json
+    python -m benchmarks.suite --models EDSR_baseline --scales 2 --out bench.json
+
+    Each (model, scale) runs in its own process, thus `peak_rss_mb` is the peak
+    memory of building, training and running that model only. FLOPs are counted
+    per lr input resolution (thus include the hr-space convs of `pre_upsample`
+    models), and PSNR on Set5 is reported for models with trained weights in
+    `--weights_dir` only.
+'''
+import argparse
+import tempfile
+import time
+import os
+
+import numpy as np
+
+from .utils import (TRAIN_DIR, VALID_DIR, image_paths, patch_batches, timed,
+                    percentiles, model_flops, peak_rss_mb, run_isolated, dump)
+
+MODELS = [
+    "SRCNN_915", "SRCNN_955", "FSRCNN", "FSRCNN_s", "ESPCN", "CARN", "EDSR",
+    "EDSR_baseline"
+]
+SCALES = [2, 3, 4]
+
+
+def bench_model(model_name, scale, nb_steps, train_batch, patch_size,
+                resolutions, batch_sizes, nb_runs, weights_dir):
+    import tensorflow as tf
+    from tensorflow.python.keras.optimizer_v2.adam import Adam
+    from src import model as sr_models
+
+    sr = getattr(sr_models, model_name)(scale, "bench").create_model()
+    sr.model.compile(optimizer=Adam(1e-4), loss="mse")
+    ratio = 1 if sr.pre_upsample else scale
+
+    # Training steps/sec on pre-generated batches (pipeline excluded).
+    train = patch_batches(TRAIN_DIR,
+                          nb_steps,
+                          train_batch,
+                          patch_size,
+                          scale,
+                          pre_upsample=sr.pre_upsample,
+                          channel=sr.channel)
+    it = iter(train * 2)
+    step_times = timed(lambda: sr.model.train_on_batch(*next(it)),
+                       nb_runs=nb_steps - 2)
+
+    # Inference latency and FLOPs of one image per (lr) input resolution.
+    latency, gflops = {}, {}
+    for res in resolutions:
+        x = np.random.rand(1, res * scale // ratio, res * scale // ratio,
+                           sr.channel).astype(np.float32)
+        latency["%dx%d" % (res, res)] = percentiles(
+            timed(lambda: sr._forward(x), nb_runs))
+        gflops["%dx%d" % (res, res)] = model_flops(sr.model, x.shape) / 1e9
+
+    # Images/sec per batch size at the smallest resolution.
+    res = min(resolutions)
+    throughput = {}
+    for bs in batch_sizes:
+        x = np.random.rand(bs, res * scale // ratio, res * scale // ratio,
+                           sr.channel).astype(np.float32)
+        times = timed(lambda: sr._forward(x), nb_runs)
+        throughput[str(bs)] = bs / float(np.median(times))
+
+    weights_path = os.path.join(weights_dir, "%s_X%d.h5" % (model_name, scale))
+    psnr = None
+    if os.path.exists(weights_path):
+        sr.model.load_weights(weights_path)
+        psnr = sr.evaluate(VALID_DIR)["psnr"]
+
+    return {
+        "model": model_name,
+        "scale": scale,
+        "nb_params": int(sr.model.count_params()),
+        "train_steps_per_s": 1. / float(np.median(step_times)),
+        "train_batch": [train_batch, patch_size],
+        "latency_s": latency,
+        "gflops": gflops,
+        "images_per_s": throughput,
+        "peak_rss_mb": peak_rss_mb(),
+        "set5_psnr": psnr,
+    }
+
+
+def _throughput(dst, nb_batches):
+    it = iter(dst)
+    next(it)
+    start, n = time.perf_counter(), 0
+    for _ in range(nb_batches):
+        n += int(next(it)[0].shape[0])
+    return n / (time.perf_counter() - start)
+
+
+def bench_pipeline(scale, patch_size, batch_size, nb_batches):
+    import tensorflow as tf
+    from src.write2tfrec import write_dst_tfrec, load_tfrecord, load_raw
+    from src.preprocess import degrade_image, degrade_batch
+
+    AUTOTUNE = tf.data.experimental.AUTOTUNE
+    paths = image_paths(TRAIN_DIR)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        example = os.path.join(tmp_dir, "patches")
+        raw = os.path.join(tmp_dir, "raw")
+        write_dst_tfrec(paths, 200, patch_size, example, nb_shards=4, seed=0)
+        write_dst_tfrec(paths, 200, patch_size, raw, nb_shards=4, seed=0,
+                        fmt="raw")
+
+        def per_sample(hr):
+            return degrade_image(hr, scale, method=2)
+
+        def batched(hr):
+            return degrade_batch(hr, scale, method=2)
+
+        tfrec = load_tfrecord(patch_size, example + "-*").repeat()
+        rawdst = load_raw(patch_size, raw + "-*").repeat()
+        pipelines = {
+            "load_tfrecord":
+            tfrec.batch(batch_size).map(lambda hr: (hr, hr)),
+            "load_raw":
+            rawdst.batch(batch_size).map(lambda hr: (hr, hr)),
+            "load_tfrecord+degrade_image":
+            tfrec.map(per_sample, num_parallel_calls=AUTOTUNE).batch(batch_size),
+            "load_tfrecord+degrade_batch":
+            tfrec.batch(batch_size).map(batched, num_parallel_calls=AUTOTUNE),
+            "load_raw+degrade_batch":
+            rawdst.batch(batch_size).map(batched, num_parallel_calls=AUTOTUNE),
+        }
+        return {
+            name: _throughput(dst.prefetch(AUTOTUNE), nb_batches)
+            for name, dst in pipelines.items()
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--models", nargs="+", default=MODELS)
+    parser.add_argument("--scales", nargs="+", type=int, default=SCALES)
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--train_batch", type=int, default=16)
+    parser.add_argument("--patch_size", type=int, default=48)
+    parser.add_argument("--resolutions", nargs="+", type=int,
+                        default=[64, 128, 256])
+    parser.add_argument("--batch_sizes", nargs="+", type=int,
+                        default=[1, 4, 16])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--weights_dir", default="./weights")
+    parser.add_argument("--pipeline_batches", type=int, default=100)
+    parser.add_argument("--no_pipeline", action="store_true")
+    parser.add_argument("--out", default="bench.json")
+    args = parser.parse_args()
+
+    results = {"timestamp": time.strftime("%Y-%m-%d %H:%M:%S"), "models": []}
+    for model_name in args.models:
+        for scale in args.scales:
+            results["models"].append(
+                run_isolated(bench_model, model_name, scale, args.steps,
+                             args.train_batch, args.patch_size,
+                             args.resolutions, args.batch_sizes, args.runs,
+                             args.weights_dir))
+    if not args.no_pipeline:
+        results["pipeline_patches_per_s"] = run_isolated(
+            bench_pipeline, max(args.scales), args.patch_size,
+            args.train_batch, args.pipeline_batches)
+    dump(results, args.out)
+
+
+if __name__ == "__main__":
+    main()
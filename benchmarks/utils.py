@@ -0,0 +1,125 @@
+import multiprocessing
+import queue as queue_module
+import traceback
+import resource
+import glob
+import json
+import time
+import os
+
+import numpy as np
+import tensorflow as tf
+
+from src.data_utils import random_patch_dataset, rgb2ycbcr
+from src.preprocess import degrade_batch
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TRAIN_DIR = os.path.join(ROOT, "Image", "set14")
+VALID_DIR = os.path.join(ROOT, "Image", "set5")
+
+
+def image_paths(image_dir):
+    return sorted(glob.glob(os.path.join(image_dir, "*")))
+
+
+def patch_batches(image_dir, nb_batches, batch_size, patch_size, scale,
+                  pre_upsample=False, channel=3, seed=0):
+    '''Fixed list of (lr, hr) batches, bicubic degradation, Y channel if `channel` is 1.'''
+
+    def to_channel(lr, hr):
+        # As `cli.train` feeds 1-channel models.
+        if channel == 1:
+            lr, hr = rgb2ycbcr(lr)[..., :1], rgb2ycbcr(hr)[..., :1]
+        return lr, hr
+
+    dst = random_patch_dataset(image_paths(image_dir), patch_size, seed=seed)
+    dst = dst.batch(batch_size).map(lambda hr: to_channel(*degrade_batch(
+        hr, scale, method=2, restore_shape=pre_upsample)))
+    batches = [(lr.numpy(), hr.numpy()) for lr, hr in dst.take(nb_batches)]
+    return batches
+
+
+def model_flops(model, shape):
+    '''Floating point operations of one forward pass on inputs of `shape`.'''
+    fn = tf.function(lambda x: model(x, training=False)).get_concrete_function(
+        tf.TensorSpec(shape, tf.float32))
+    options = tf.compat.v1.profiler.ProfileOptionBuilder.float_operation()
+    options["output"] = "none"
+    return tf.compat.v1.profiler.profile(fn.graph,
+                                         options=options).total_float_ops
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+def percentiles(times, qs=(50, 99)):
+    return {"p%d" % q: float(np.percentile(times, q)) for q in qs}
+
+
+def timed(fn, nb_runs, nb_warmup=2):
+    '''Run `fn` and return wall times of each run in seconds.'''
+    for _ in range(nb_warmup):
+        fn()
+    times = []
+    for _ in range(nb_runs):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def _run_isolated(queue, fn, args):
+    try:
+        queue.put((True, fn(*args)))
+    except BaseException:
+        # Exceptions may not be picklable, pass the traceback.
+        queue.put((False, traceback.format_exc()))
+
+
+def run_isolated(fn, *args, timeout=None, poll=5.):
+    '''Run `fn(*args)` in a fresh process, so global TF state (XLA, policies)
+    and peak memory of one benchmark don't leak into another.
+
+    Errors of `fn` are raised as `RuntimeError` with the traceback of the child,
+    so are the death of the child (e.g. OOM-killed) and running beyond `timeout`
+    seconds, instead of waiting forever.'''
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_run_isolated, args=(queue, fn, args))
+    proc.start()
+    start = time.perf_counter()
+    try:
+        while True:
+            try:
+                ok, result = queue.get(timeout=poll)
+                break
+            except queue_module.Empty:
+                pass
+            if proc.exitcode is not None:
+                # The result may still be in the pipe when the child has just exited.
+                try:
+                    ok, result = queue.get(timeout=poll)
+                    break
+                except queue_module.Empty:
+                    raise RuntimeError("%s%s exited with code %d without result." %
+                                       (fn.__name__, args, proc.exitcode))
+            if timeout is not None and time.perf_counter() - start > timeout:
+                raise RuntimeError("%s%s timed out after %ds." %
+                                   (fn.__name__, args, timeout))
+    finally:
+        proc.join(poll)
+        if proc.is_alive():
+            proc.terminate()
+            proc.join()
+    if not ok:
+        raise RuntimeError("%s%s failed in child process:\n%s" %
+                           (fn.__name__, args, result))
+    return result
+
+
+def dump(results, path):
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
@@ -1,5 +1,25 @@
 # Mulns, SuperSR package
-from . import data_utils
-from . import preprocess
-from . import write2tfrec
-from . import wn
\ No newline at end of file
+# Submodules are imported lazily on first access (e.g. `src.preprocess`), thus
+# `import src` doesn't pay for importing tensorflow, PIL and tqdm.
+import importlib
+import sys
+
+_SUBMODULES = [
+    "data_utils", "preprocess", "write2tfrec", "wn", "accumulate", "model"
+]
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module("." + name, __name__)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_SUBMODULES))
+
+
+if sys.version_info < (3, 7):
+    # XXX No module `__getattr__` (PEP 562) before python 3.7, import eagerly.
+    for _name in _SUBMODULES:
+        globals()[_name] = __getattr__(_name)
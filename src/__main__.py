@@ -0,0 +1,5 @@
+# `python -m src {write,train,eval,upscale}`, see `cli`.
+from .cli import main
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+import tensorflow as tf
+from tensorflow.python.distribute import distribution_strategy_context
+from tensorflow.python.distribute import reduce_util
+from tensorflow.python.framework import smart_cond
+from tensorflow.python.keras.optimizer_v2 import optimizer_v2
+
+# -----------------------------------------------------------------------
+# Wrapping follows `LossScaleOptimizer` of keras mixed precision (TF 2.0).
+# -----------------------------------------------------------------------
+
+
+class _UnwrapPreventer(object):
+    '''Keeps `call_for_each_replica` from unwrapping mirrored variables in its args.'''
+
+    def __init__(self, value):
+        self.value = value
+
+
+class GradientAccumulation(optimizer_v2.OptimizerV2):
+    '''Apply `optimizer` once every `nb_steps` calls, on the mean of accumulated gradients.
+
+        A logical batch is fed as `nb_steps` micro-batches (one keras step each), thus
+        memory of a step only depends on the micro-batch size. Gradients of keras losses
+        are means over micro-batches, their mean over `nb_steps` is the gradient of the
+        logical batch. The wrapped optimizer (e.g. `Adam`, `AdamWithWeightnorm`) sees one
+        update per logical batch, so its `iterations`, moments and learning rate are per
+        logical step.
+
+        `lr`, `iterations` and weights are those of the wrapped optimizer, thus
+        `LearningRateScheduler` and checkpoints work as without accumulation. Accumulators
+        are not part of weights, they are zero at boundaries of logical steps.
+    '''
+
+    def __init__(self, optimizer, nb_steps, name="GradientAccumulation"):
+        if not isinstance(optimizer, optimizer_v2.OptimizerV2):
+            raise ValueError('"optimizer" must be an instance of OptimizerV2, but '
+                             'got: %s' % optimizer)
+        assert nb_steps >= 1, "Number of accumulation steps should be positive"
+        super(GradientAccumulation, self).__init__(name)
+        self._optimizer = optimizer
+        self.nb_steps = nb_steps
+        self._track_trackable(self._optimizer, "inner_optimizer")
+        self._micro_step = None
+
+    @property
+    def inner_optimizer(self):
+        return self._optimizer
+
+    def apply_gradients(self, grads_and_vars, name=None):
+        if distribution_strategy_context.in_cross_replica_context():
+            raise ValueError("apply_gradients() must be called in a replica context.")
+        grads_and_vars = tuple(
+            (g, v) for g, v in grads_and_vars if g is not None)
+        return distribution_strategy_context.get_replica_context().merge_call(
+            self._accumulate_cross_replica, args=(grads_and_vars, name))
+
+    def _accumulate_cross_replica(self, distribution, grads_and_vars, name):
+        variables = [v for _, v in grads_and_vars]
+        with tf.init_scope():
+            if self._micro_step is None:
+                self._micro_step = self.add_weight(
+                    "micro_step", [],
+                    tf.int64,
+                    initializer="zeros",
+                    trainable=False,
+                    aggregation=tf.VariableAggregation.ONLY_FIRST_REPLICA)
+            for var in variables:
+                self.add_slot(var, "accum")
+
+        # The same reduction as `OptimizerV2`, losses are scaled by replicas.
+        grads = distribution.extended.batch_reduce_to(reduce_util.ReduceOp.SUM,
+                                                      grads_and_vars)
+        accumulate = [
+            distribution.extended.update(self.get_slot(v, "accum"),
+                                         lambda a, g: a.assign_add(g),
+                                         args=(g, ),
+                                         group=False)
+            for g, v in zip(grads, variables)
+        ]
+        with tf.control_dependencies(tf.nest.flatten(accumulate)):
+            micro_step = distribution.extended.update(
+                self._micro_step, lambda s: s.assign_add(1), group=False)
+        micro_step = tf.nest.flatten(micro_step)[0]
+
+        def apply_fn():
+            # Each replica passes the reduced sum, which the wrapped optimizer sums again.
+            scale = 1. / (self.nb_steps * distribution.num_replicas_in_sync)
+            applied = distribution.extended.call_for_each_replica(
+                self._apply_accumulated,
+                args=(_UnwrapPreventer(variables), scale, name))
+            with tf.control_dependencies(tf.nest.flatten(applied)):
+                resets = [
+                    distribution.extended.update(
+                        self.get_slot(v, "accum"),
+                        lambda a: a.assign(tf.zeros_like(a)),
+                        group=False) for v in variables
+                ]
+            return tf.group(tf.nest.flatten(resets))
+
+        # XXX Called in cross-replica context, strategies don't support a cond in
+        # replica context with a branch that calls `merge_call`.
+        return smart_cond.smart_cond(
+            tf.equal(micro_step % self.nb_steps, 0), apply_fn, tf.no_op)
+
+    def _apply_accumulated(self, wrapped_vars, scale, name):
+        variables = wrapped_vars.value
+        grads = [
+            self.get_slot(v, "accum").read_value() * tf.cast(scale, v.dtype)
+            for v in variables
+        ]
+        return self._optimizer.apply_gradients(zip(grads, variables), name)
+
+    def get_config(self):
+        return {
+            "optimizer": tf.keras.optimizers.serialize(self._optimizer),
+            "nb_steps": self.nb_steps,
+        }
+
+    @classmethod
+    def from_config(cls, config, custom_objects=None):
+        config = dict(config)
+        config["optimizer"] = tf.keras.optimizers.deserialize(
+            config["optimizer"], custom_objects=custom_objects)
+        return cls(**config)
+
+    # Delegations to the wrapped optimizer.
+
+    @property
+    def iterations(self):
+        return self._optimizer.iterations
+
+    @iterations.setter
+    def iterations(self, variable):
+        self._optimizer.iterations = variable
+
+    @property
+    def weights(self):
+        return self._optimizer.weights
+
+    def get_weights(self):
+        return self._optimizer.get_weights()
+
+    def set_weights(self, weights):
+        return self._optimizer.set_weights(weights)
+
+    @property
+    def learning_rate(self):
+        return self._optimizer.learning_rate
+
+    @learning_rate.setter
+    def learning_rate(self, lr):
+        self._optimizer.learning_rate = lr
+
+    @property
+    def lr(self):
+        return self._optimizer.lr
+
+    @lr.setter
+    def lr(self, lr):
+        self._optimizer.lr = lr
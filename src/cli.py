@@ -0,0 +1,325 @@
+'''Command-line entry points of SuperSR, for batch jobs without notebooks.
+
+    python -m src write   --config x2.json
+    python -m src train   --config x2.json --batch_size 32 --precision mixed_bfloat16
+    python -m src eval    --config x2.json --images ./Image/set5 --ensemble 8
+    python -m src upscale --config x2.json --inputs ./lr --out_dir ./sr
+
+    Options are read from a JSON config, shared keys at top level and per-command
+    sections ("write", "train", "eval", "upscale") overriding them, e.g.
+
+        {"model": "EDSR_baseline", "scale": 2, "patch_size": 96,
+         "write": {"images": "./Image/set14", "out": "./cache/set14", "nb_shards": 8},
+         "train": {"train_tfrec": "./cache/set14-*-of-*.tfrec",
+                   "valid_tfrec": "./cache/set5.tfrec", "nb_epochs": 300}}
+
+    Flags override the config. Run `python -m src <command> -h` for all options.
+'''
+import argparse
+import glob
+import json
+import os
+
+# AUTOTUNE of tf.data, without importing tensorflow for `-h`.
+AUTOTUNE = -1
+
+
+def _bool(value):
+    if isinstance(value, bool):
+        return value
+    if value.lower() in ("1", "true", "yes"):
+        return True
+    if value.lower() in ("0", "false", "no"):
+        return False
+    raise argparse.ArgumentTypeError("Expect a boolean, got %s." % value)
+
+
+# Options of commands, name -> (type, default, help).
+MODEL_OPTIONS = {
+    "model": (str, "EDSR_baseline", "Name of registered model, see `model.list_models`."),
+    "scale": (int, 2, "Super-resolution ratio factor."),
+    "model_name": (str, None, "Name of weights and logs, `model` by default."),
+    "channel": (int, None, "Number of channels, default of the model by default."),
+    "precision": (str, "float32", "Mixed-precision policy, e.g. mixed_bfloat16."),
+    "jit_compile": (_bool, False, "Compile with XLA."),
+    "weights_path": (str, None, "Weights of the model, ./weights/<model_name>_X<scale>.h5 by default."),
+}
+
+DEGRADE_OPTIONS = {
+    "method": (int, 2, "Downsampling method, -1: gaussian, 0: bilinear, 1: nearest, 2: bicubic."),
+    "kernel_sigma": (float, None, "Sigma of gaussian kernel, if method is -1."),
+    "noise_level": (float, None, "Std of additive gaussian noise in (0, 255)."),
+}
+
+COMMANDS = {
+    "write": dict({
+        "images": (str, None, "Directory or glob pattern of hr-images."),
+        "out": (str, None, "Path (prefix of shards) of tfrecord files."),
+        "patch_size": (int, 48, "Size of hr-patches."),
+        "patch_per_image": (int, 10, "Number of patches cropped per image."),
+        "nb_shards": (int, 1, "Number of files to write."),
+        "nb_workers": (int, 1, "Number of worker processes."),
+        "seed": (int, None, "Random seed of cropping."),
+        "fmt": (str, "example", "On-disk format, example or raw."),
+        "degradations": (json.loads, None,
+                         "JSON list of degradations to precompute, e.g. "
+                         "'[{\"scale\": 2, \"method\": 2}]'."),
+    }),
+    "train": dict(MODEL_OPTIONS, **DEGRADE_OPTIONS, **{
+        "train_tfrec": (str, None, "Tfrecord file or glob pattern of shards for training."),
+        "valid_tfrec": (str, None, "Tfrecord file or glob pattern of shards for validation."),
+        "patch_size": (int, 48, "Size of hr-patches in records."),
+        "paired": (_bool, False, "Load lr-patches precomputed by `write --degradations`."),
+        "nb_epochs": (int, 100, "Number of epochs."),
+        "steps_per_epoch": (int, 1000, "Number of steps per epoch."),
+        "batch_size": (int, 16, "Global batch size."),
+        "accumulation_steps": (int, 1, "Number of micro-batches per optimizer update."),
+        "shuffle_buffer": (int, 1000, "Number of patches shuffled."),
+        "shard_seed": (int, 0, "Random seed of the order of shards, the same on all workers."),
+        "cycle_length": (int, 4, "Number of shards read concurrently."),
+        "nb_parallel_calls": (int, AUTOTUNE, "Number of batches degraded in parallel (-1: AUTOTUNE)."),
+        "prefetch": (int, AUTOTUNE, "Number of batches prefetched (-1: AUTOTUNE)."),
+        "use_wn": (_bool, False, "Train with Adam with weight-normalization."),
+        "load_weights": (_bool, False, "Start from `weights_path`."),
+        "resume": (_bool, False, "Resume from the latest checkpoint in ./checkpoints/<model_name>_X<scale>."),
+        "keep_last": (int, 3, "Number of latest checkpoints kept, besides the best one."),
+        "histogram_freq": (int, 0, "Epochs between weight histograms."),
+        "profile": (_bool, False, "Profile training steps."),
+    }),
+    "eval": dict(MODEL_OPTIONS, **DEGRADE_OPTIONS, **{
+        "images": (str, None, "Directory or glob pattern of test images."),
+        "tile_size": (int, None, "Size of tiles, derived from receptive field by default."),
+        "batch_size": (int, 4, "Number of tiles per forward pass."),
+        "ensemble": (int, 1, "Number of geometric transforms averaged, 1, 2, 4 or 8."),
+        "nb_workers": (int, 4, "Number of threads to prepare images."),
+        "out": (str, None, "Path of JSON results."),
+    }),
+    "upscale": dict(MODEL_OPTIONS, **{
+        "inputs": (str, None, "Lr-image, directory or glob pattern of lr-images."),
+        "out_dir": (str, None, "Directory of sr-images (png)."),
+        "tile_size": (int, None, "Size of tiles, whole images are fed by default."),
+        "batch_size": (int, 4, "Number of images (or tiles) per forward pass."),
+        "ensemble": (int, 1, "Number of geometric transforms averaged, 1, 2, 4 or 8."),
+        "nb_workers": (int, 4, "Number of decoding threads."),
+        "queue_size": (int, 8, "Max number of images waiting between stages."),
+    }),
+}
+
+REQUIRED = {
+    "write": ["images", "out"],
+    "train": ["train_tfrec", "valid_tfrec"],
+    "eval": ["images"],
+    "upscale": ["inputs", "out_dir"],
+}
+
+
+def load_config(command, path=None, overrides=None):
+    '''Options of `command`, defaults updated by the config file and `overrides`.
+
+        Params:
+            command: String.
+                One of `COMMANDS`.
+            path: String or None.
+                Path to JSON config.
+            overrides: Dict or None.
+                Options given by flags.
+
+        Return:
+            Dict of all options of `command`.
+    '''
+    options = COMMANDS[command]
+    config = {name: default for name, (_, default, _) in options.items()}
+    if path is not None:
+        with open(path) as f:
+            data = json.load(f)
+        # Top-level keys may belong to other commands, but not to none of them.
+        known = set(COMMANDS).union(*COMMANDS.values())
+        unknown = set(data) - known
+        section = data.get(command, {})
+        unknown |= set(section) - set(options)
+        if unknown:
+            raise ValueError("Unknown options %s of %s in %s." %
+                             (sorted(unknown), command, path))
+        config.update({k: v for k, v in data.items() if k in options})
+        config.update(section)
+    config.update(overrides or {})
+    missing = [name for name in REQUIRED[command] if config[name] is None]
+    if missing:
+        raise ValueError("Options %s of %s are required." % (missing, command))
+    return config
+
+
+def _paths(pattern):
+    paths = sorted(glob.glob(os.path.join(pattern, "*") if os.path.
+                             isdir(pattern) else pattern))
+    if not paths:
+        raise ValueError("No image found in %s." % pattern)
+    return paths
+
+
+def _degrade_kwargs(config):
+    kwargs = {"method": config["method"]}
+    if config["kernel_sigma"] is not None:
+        kwargs["kernel_sigma"] = config["kernel_sigma"]
+    return kwargs
+
+
+def create_model(config, load_weights=True):
+    '''Create the model of `config`, with weights loaded if `load_weights`.'''
+    from .model import get_model
+    kwargs = {
+        "precision": config["precision"],
+        "jit_compile": config["jit_compile"]
+    }
+    if config["channel"] is not None:
+        kwargs["channel"] = config["channel"]
+    sr = get_model(config["model"], config["scale"], config["model_name"],
+                   **kwargs)
+    if config["weights_path"] is not None:
+        sr.weights_path = config["weights_path"]
+    return sr.create_model(load_weights=load_weights)
+
+
+def write(config):
+    from .write2tfrec import write_dst_tfrec
+    os.makedirs(os.path.dirname(os.path.abspath(config["out"])), exist_ok=True)
+    return write_dst_tfrec(_paths(config["images"]),
+                           config["patch_per_image"],
+                           config["patch_size"],
+                           config["out"],
+                           nb_shards=config["nb_shards"],
+                           nb_workers=config["nb_workers"],
+                           seed=config["seed"],
+                           fmt=config["fmt"],
+                           degradations=config["degradations"])
+
+
+def train(config):
+    from .write2tfrec import load_tfrecord, load_paired_tfrecord
+    from .preprocess import degrade_batch
+    from .data_utils import rgb2ycbcr
+    sr = create_model(config, load_weights=config["load_weights"])
+    scale, patch_size = config["scale"], config["patch_size"]
+    degrade_kwargs = _degrade_kwargs(config)
+
+    def to_channel(lr, hr):
+        if sr.channel == 1:
+            lr, hr = rgb2ycbcr(lr)[..., :1], rgb2ycbcr(hr)[..., :1]
+        return lr, hr
+
+    if config["paired"]:
+        load = lambda path, shuffle: load_paired_tfrecord(
+            patch_size,
+            path,
+            scale,
+            restore_shape=sr.pre_upsample,
+            noise_level=config["noise_level"],
+            shuffle_files=shuffle,
+            cycle_length=config["cycle_length"],
+            seed=config["shard_seed"],
+            **degrade_kwargs).map(to_channel,
+                                  num_parallel_calls=config["nb_parallel_calls"])
+        batch_preprocess = None
+    else:
+        load = lambda path, shuffle: load_tfrecord(patch_size,
+                                                   path,
+                                                   shuffle,
+                                                   cycle_length=config["cycle_length"],
+                                                   seed=config["shard_seed"])
+        batch_preprocess = lambda hr: to_channel(*degrade_batch(
+            hr,
+            scale,
+            restore_shape=sr.pre_upsample,
+            noise_level=config["noise_level"],
+            **degrade_kwargs))
+
+    trdst = load(config["train_tfrec"], True).shuffle(
+        config["shuffle_buffer"]).repeat()
+    valdst = load(config["valid_tfrec"], False)
+    return sr.fit(trdst,
+                  valdst,
+                  config["nb_epochs"],
+                  config["steps_per_epoch"],
+                  batch_size=config["batch_size"],
+                  accumulation_steps=config["accumulation_steps"],
+                  use_wn=config["use_wn"],
+                  batch_preprocess=batch_preprocess,
+                  histogram_freq=config["histogram_freq"],
+                  profile=config["profile"],
+                  keep_last=config["keep_last"],
+                  resume=config["resume"],
+                  prefetch=config["prefetch"],
+                  nb_parallel_calls=config["nb_parallel_calls"])
+
+
+def evaluate(config):
+    sr = create_model(config)
+    kwargs = _degrade_kwargs(config)
+    if config["noise_level"] is not None:
+        kwargs["noise_level"] = config["noise_level"]
+    results = sr.evaluate(_paths(config["images"]),
+                          nb_workers=config["nb_workers"],
+                          tile_size=config["tile_size"],
+                          batch_size=config["batch_size"],
+                          ensemble=config["ensemble"],
+                          **kwargs)
+    print("%s: PSNR %.4f dB, SSIM %.4f" %
+          (sr.model_name, results["psnr"], results["ssim"]))
+    if config["out"] is not None:
+        with open(config["out"], "w") as f:
+            json.dump(results, f, indent=2)
+    return results
+
+
+def upscale(config):
+    from PIL import Image
+    import numpy as np
+    sr = create_model(config)
+    paths = _paths(config["inputs"])
+    os.makedirs(config["out_dir"], exist_ok=True)
+
+    def sink(index, frame):
+        name = os.path.splitext(os.path.basename(paths[index]))[0] + ".png"
+        Image.fromarray(np.squeeze(frame, -1) if frame.shape[-1] == 1 else
+                        frame).save(os.path.join(config["out_dir"], name))
+
+    return sr.upscale_sequence(paths,
+                               sink,
+                               batch_size=config["batch_size"],
+                               nb_workers=config["nb_workers"],
+                               queue_size=config["queue_size"],
+                               tile_size=config["tile_size"],
+                               ensemble=config["ensemble"])
+
+
+RUNNERS = {"write": write, "train": train, "eval": evaluate, "upscale": upscale}
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m src",
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+    for command, options in COMMANDS.items():
+        sub = commands.add_parser(command)
+        sub.add_argument("--config", help="Path to JSON config.")
+        for name, (type_, default, help_) in options.items():
+            # Only given flags override the config.
+            sub.add_argument("--" + name,
+                             type=type_,
+                             default=argparse.SUPPRESS,
+                             help="%s (default: %s)" % (help_, default))
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = vars(parser.parse_args(argv))
+    command, path = args.pop("command"), args.pop("config", None)
+    try:
+        config = load_config(command, path, args)
+    except ValueError as e:
+        parser.error(str(e))
+    return RUNNERS[command](config)
@@ -2,12 +2,17 @@ import tensorflow as tf
 from tqdm import tqdm
 from PIL import Image
 import numpy as np
+import collections
 import itertools
+import threading
+import tempfile
 import operator
 import random
 import math
 import os
 
+AUTOTUNE = tf.data.experimental.AUTOTUNE
+
 
 def modcrop(image, scale):
     '''Crop image wrt super-resolution scale factor.
@@ -48,3 +53,152 @@ def rgb2ycbcr(image):
     final_img = tf.concat((Y, Cb, Cr), axis=-1)
 
     return final_img
+
+
+def ycbcr2rgb(image):
+    '''Convert YCbCr image to RGB color space, inverse of `rgb2ycbcr`.
+
+        Only available on normalized image (value range in 0 to 1)
+    '''
+    # Inverse of the matrix of `rgb2ycbcr`.
+    M = np.linalg.inv([[0.257, 0.504, 0.098], [-0.148, -0.291, 0.439],
+                       [0.439, -0.368, -0.071]])
+    image = tf.convert_to_tensor(image, tf.float32)
+    offset = tf.constant([16 / 255., 128 / 255., 128 / 255.])
+    return tf.tensordot(image - offset, tf.constant(M.T, tf.float32), 1)
+
+
+def merge_y(sr_y, lr_cbcr):
+    '''RGB image of super-resolved Y channel, with CbCr of the lr-image upsampled by bicubic.
+
+        Models of one channel super-resolve Y of color images only, as in SRCNN.
+
+        Params:
+            sr_y: Numpy array in shape of (H, W, 1) or (N, H, W, 1), in 0--1.
+            lr_cbcr: Numpy array of CbCr channels of the lr-image (`rgb2ycbcr`), in
+                shape of (h, w, 2) or (N, h, w, 2).
+
+        Return:
+            Numpy array of RGB image(s), in 0--1.
+    '''
+    cbcr = tf.image.resize(lr_cbcr,
+                           sr_y.shape[-3:-1],
+                           method=tf.image.ResizeMethod.BICUBIC)
+    rgb = ycbcr2rgb(tf.concat([tf.cast(sr_y, tf.float32), cbcr], axis=-1))
+    return np.clip(rgb.numpy(), 0., 1.)
+
+
+class ImageCache(object):
+    '''LRU cache of decoded images in uint8 RGB.
+
+        Each image is decoded once and kept in memory, until the total size of cached
+        images exceeds `budget` bytes, then the least recently used ones are evicted.
+        If `mmap_dir` is given, decoded images are saved as `.npy` files and cached
+        as memory-mapped arrays, thus evicted images are re-opened instead of decoded
+        again, and corpora larger than RAM are supported.
+
+        Attributes:
+            paths: List of string, paths of images.
+            budget: Int, memory budget of cache in bytes.
+            mmap_dir: String or None, directory to save decoded images.
+    '''
+
+    def __init__(self, paths, budget=2 * 1024**3, mmap_dir=None):
+        self.paths = list(paths)
+        self.budget = budget
+        self.mmap_dir = mmap_dir
+        if mmap_dir is not None:
+            os.makedirs(mmap_dir, exist_ok=True)
+        self._cache = collections.OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.paths)
+
+    def _decode(self, index):
+        path = self.paths[index]
+        if self.mmap_dir is not None:
+            npy_path = os.path.join(self.mmap_dir, "%06d.npy" % index)
+            if not os.path.isfile(npy_path):
+                # Threads may decode the same image, each writes its own file and
+                # replaces atomically, thus arrays mapped by others stay intact.
+                fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=self.mmap_dir)
+                with os.fdopen(fd, "wb") as f:
+                    np.save(f, np.asarray(Image.open(path).convert("RGB")))
+                os.replace(tmp_path, npy_path)
+            return np.load(npy_path, mmap_mode="r")
+        return np.asarray(Image.open(path).convert("RGB"))
+
+    def __getitem__(self, index):
+        with self._lock:
+            if index in self._cache:
+                self._cache.move_to_end(index)
+                return self._cache[index]
+
+        # Decode without holding the lock, other threads keep sampling.
+        img = self._decode(index)
+
+        with self._lock:
+            if index not in self._cache:
+                self._cache[index] = img
+                self._nbytes += img.nbytes
+            while self._nbytes > self.budget and len(self._cache) > 1:
+                _, evicted = self._cache.popitem(last=False)
+                self._nbytes -= evicted.nbytes
+        return img
+
+    def random_patch(self, patch_size, rng=np.random):
+        '''Crop a patch in shape of `patch_size` from a randomly chosen image.'''
+        H, W = patch_size
+        index = rng.randint(len(self))
+        img = self[index]
+        h, w = img.shape[:2]
+        if h < H or w < W:
+            raise ValueError("Image %s in shape of %s is smaller than patch." %
+                             (self.paths[index], (h, w)))
+        y, x = rng.randint(0, h - H + 1), rng.randint(0, w - W + 1)
+        return np.ascontiguousarray(img[y:y + H, x:x + W])
+
+
+def random_patch_dataset(paths,
+                         patch_size,
+                         budget=2 * 1024**3,
+                         mmap_dir=None,
+                         seed=None,
+                         num_parallel_calls=AUTOTUNE):
+    '''Infinite dataset of hr-patches randomly cropped on the fly.
+
+        Images are decoded once into an `ImageCache`, fresh patches are cropped every
+        step in parallel. Thus one can change `patch_size` without rewriting tfrecord files,
+        and each epoch sees different patches.
+
+        Params:
+            paths: List of string.
+                Image paths to be loaded and cropped.
+            patch_size: Int or Tuple of integers.
+                Size of patch, e.g. (48, 48).
+            budget: Int.
+                Memory budget of cached images in bytes.
+            mmap_dir: String or None.
+                Directory to save decoded images for memory-mapping, see `ImageCache`.
+            seed: Int or None.
+                Random seed of cropping.
+            num_parallel_calls: Int.
+                Number of patches cropped in parallel.
+
+        Return:
+            TF-Dataset contains Hr-patches in uint8, already repeated.
+    '''
+    H, W = patch_size if isinstance(patch_size, tuple) else (patch_size, ) * 2
+    cache = ImageCache(paths, budget, mmap_dir)
+    rng = np.random.RandomState(seed)
+
+    def _sample(_):
+        patch = tf.numpy_function(lambda: cache.random_patch((H, W), rng), [],
+                                  tf.uint8)
+        patch.set_shape([H, W, 3])
+        return patch
+
+    return tf.data.Dataset.from_tensors(0).repeat().map(
+        _sample, num_parallel_calls=num_parallel_calls)
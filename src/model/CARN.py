@@ -0,0 +1,73 @@
+from tensorflow.python import keras
+from tensorflow.python.keras import layers
+from .common import BaseSRModel
+from .utils import SubpixelLayer, MeanShift
+
+
+def _residual_block(x, F):
+    y = layers.Conv2D(F, (3, 3), padding="same", activation='relu')(x)
+    y = layers.Conv2D(F, (3, 3), padding="same")(y)
+    return layers.ReLU()(layers.Add()([x, y]))
+
+
+def _cascade(x, F, nb_units, unit):
+    # Outputs of all previous units are concatenated and fused by 1x1 conv.
+    concat = x
+    for _ in range(nb_units):
+        concat = layers.Concatenate()([concat, unit(x)])
+        x = layers.Conv2D(F, (1, 1), padding="same", activation='relu')(concat)
+    return x
+
+
+def CARN_func(inp, scale, F, nb_blocks, nb_res, channel=3):
+    # MeanShift is kept in float32 under mixed precision.
+    x = MeanShift(-1, dtype="float32")(inp)
+    x = layers.Conv2D(F, (3, 3), padding="same")(x)
+    # Global cascading of local cascading blocks of residual blocks.
+    x = _cascade(x, F, nb_blocks,
+                 lambda y: _cascade(y, F, nb_res, lambda z: _residual_block(z, F)))
+    if scale == 2 or scale == 3:
+        x = SubpixelLayer(scale=scale, out_channel=F, kernel_size=3,
+                          activation='relu')(x)
+    elif scale == 4:
+        x = SubpixelLayer(scale=2, out_channel=F, kernel_size=3, activation='relu')(x)
+        x = SubpixelLayer(scale=2, out_channel=F, kernel_size=3, activation='relu')(x)
+    else:
+        raise ValueError("Wrong value of scale factor.")
+    out = layers.Conv2D(channel, (3, 3), padding="same")(x)
+    out = MeanShift(1, dtype="float32")(out)
+    return out
+
+
+class CARN(BaseSRModel):
+    """
+    CARN, see https://arxiv.org/abs/1803.08664
+    Cascading residual network, a light-weight EDSR-like model in lr-space, whose
+    intermediate features are cascaded (concatenated and fused by 1x1 convs).
+    """
+
+    def __init__(self, scale, model_name, channel=3, **kwargs):
+        super(CARN, self).__init__(scale, model_name, channel, **kwargs)
+
+        self.F = 64
+        self.nb_blocks = 3
+        self.nb_res = 3
+
+    def receptive_field(self):
+        # head, two convs per residual block and the upsampling tail (in lr pixels).
+        return 2 * self.nb_blocks * self.nb_res + 3
+
+    def create_model(self, load_weights=False, weights_path=None):
+        with self.scope():
+            inp = super(CARN, self).create_model()
+            out = CARN_func(inp, scale=self.scale, F=self.F, nb_blocks=self.nb_blocks,
+                            nb_res=self.nb_res, channel=self.channel)
+            model = keras.Model(inp, out)
+
+            if load_weights:
+                weights_path = self.weights_path if weights_path is None else weights_path
+                model.load_weights(weights_path)
+                print("loaded model %s from %s" % (self.model_name, weights_path))
+
+        self.model = model
+        return self
@@ -1,6 +1,8 @@
+import h5py
 import tensorflow as tf
 from tensorflow import keras
 from tensorflow.python.keras import layers
+from tensorflow.python.keras.utils import tf_utils
 from .common import BaseSRModel
 from .utils import SubpixelLayer, MeanShift
 
@@ -12,22 +14,114 @@ class _ResBlock(keras.Model):
         self.conv1 = layers.Conv2D(
             F, (3, 3), padding="same", activation='relu')
         self.conv2 = layers.Conv2D(F, (3, 3), padding="same")
-        self.scale = layers.Lambda(lambda x: scale_f * x, name="scale")
+        self.scale_f = scale_f
         self.add = layers.Add(name="add")
 
     def call(self, inputs):
-        x1 = self.scale(self.conv2(self.conv1(inputs)))
+        x1 = self.conv2(self.conv1(inputs)) * self.scale_f
         return self.add([inputs, x1])
 
 
-def EDSR_func(inp, scale, F, nb_res, res_scale_f):
-    x = MeanShift(-1)(inp)
-    x = layers.Conv2D(F, (3, 3), padding="same")(inp)
+class ResidualStack(layers.Layer):
+    '''`nb_res` residual blocks of EDSR in one layer, x = x + res_scale * conv2(relu(conv1(x))).
+
+        Weights are created in the same order as a stack of `_ResBlock`, thus
+        `set_weights(get_weights())` converts between them. At inference, `res_scale`
+        is folded into kernel and bias of conv2 (a pass over weights instead of over
+        feature maps), and the residual add is the only elementwise op left per block.
+
+        If `checkpoint_every` is k, training keeps only the inputs of every k blocks for
+        backprop, and recomputes activations inside a group from them (gradient
+        checkpointing): activation memory of the stack is about 1/k plus one group,
+        for an extra forward pass of the stack per step.
+    '''
+
+    def __init__(self, F, nb_res, res_scale_f, checkpoint_every=None, **kwargs):
+        super(ResidualStack, self).__init__(**kwargs)
+        self.F = F
+        self.nb_res = nb_res
+        self.res_scale_f = res_scale_f
+        self.checkpoint_every = checkpoint_every
+
+    def build(self, input_shape):
+        channels = int(input_shape[-1])
+        self.convs = []
+        for i in range(self.nb_res):
+            block = []
+            for j, fan_in in enumerate([channels, self.F]):
+                block.append((self.add_weight("res%d_conv%d_kernel" % (i, j + 1),
+                                              (3, 3, fan_in, self.F),
+                                              initializer="glorot_uniform"),
+                              self.add_weight("res%d_conv%d_bias" % (i, j + 1),
+                                              (self.F, ),
+                                              initializer="zeros")))
+            self.convs.append(block)
+        super(ResidualStack, self).build(input_shape)
+
+    def call(self, inputs, training=None):
+        # `training` may be the symbolic learning phase, branches are python only.
+        return tf_utils.smart_cond(
+            False if training is None else training,
+            lambda: self._train(inputs),
+            lambda: self._blocks(inputs, self.convs, fold=True))
+
+    def _train(self, x):
+        if not self.checkpoint_every:
+            return self._blocks(x, self.convs, fold=False)
+        for i in range(0, self.nb_res, self.checkpoint_every):
+            convs = self.convs[i:i + self.checkpoint_every]
+            x = tf.recompute_grad(
+                lambda x, convs=convs: self._blocks(x, convs, fold=False))(x)
+        return x
+
+    def _blocks(self, x, convs, fold):
+        fold = fold and self.res_scale_f != 1.
+        for (k1, b1), (k2, b2) in convs:
+            k1, b1, k2, b2 = [tf.cast(w, x.dtype) for w in (k1, b1, k2, b2)]
+            if fold:
+                k2, b2 = k2 * self.res_scale_f, b2 * self.res_scale_f
+            h = tf.nn.relu(tf.nn.bias_add(tf.nn.conv2d(x, k1, 1, "SAME"), b1))
+            h = tf.nn.bias_add(tf.nn.conv2d(h, k2, 1, "SAME"), b2)
+            if not fold and self.res_scale_f != 1.:
+                h = h * self.res_scale_f
+            x = x + h
+        return x
+
+    def compute_output_shape(self, input_shape):
+        return input_shape[:-1].concatenate(self.F)
+
+    def get_config(self):
+        config = super(ResidualStack, self).get_config()
+        config.update({
+            "F": self.F,
+            "nb_res": self.nb_res,
+            "res_scale_f": self.res_scale_f,
+            "checkpoint_every": self.checkpoint_every
+        })
+        return config
+
+
+def EDSR_func(inp, scale, F, nb_res, res_scale_f, fused=False,
+              checkpoint_every=None, shift_input=False, channel=3):
+    # XXX The head conv takes the raw input unless `shift_input`, as weights trained
+    # so far expect. MeanShift is kept in float32 under mixed precision.
+    x = MeanShift(-1, dtype="float32")(inp) if shift_input else inp
+    x = layers.Conv2D(F, (3, 3), padding="same")(x)
     conv1 = x
-    for i in range(nb_res):
-        x = _ResBlock(F, res_scale_f, name="res%d" % i)(x)
+    if fused or checkpoint_every:
+        x = ResidualStack(F, nb_res, res_scale_f, checkpoint_every,
+                          name="res_stack")(x)
+    else:
+        for i in range(nb_res):
+            x = _ResBlock(F, res_scale_f, name="res%d" % i)(x)
     x = layers.Conv2D(F, (3, 3), padding="same")(x)
     x = layers.Add()([conv1, x])
+    out = _upsample_tail(x, scale, F, channel)
+    out = MeanShift(1, dtype="float32")(out)
+    return out
+
+
+def _upsample_tail(x, scale, F, channel=3):
     if scale == 2 or scale == 3:
         x = SubpixelLayer(scale=scale, out_channel=F, kernel_size=3)(x)
     elif scale == 4:
@@ -35,38 +129,196 @@ def EDSR_func(inp, scale, F, nb_res, res_scale_f):
         x = SubpixelLayer(scale=2, out_channel=F, kernel_size=3)(x)
     else:
         raise ValueError("Wrong value of scale factor.")
-    out = layers.Conv2D(3, (3, 3), padding="same")(x)
-    out = MeanShift(1)(out)
-    return out
+    return layers.Conv2D(channel, (3, 3), padding="same")(x)
+
+
+def EDSR_multiscale_func(inps, scales, F, nb_res, res_scale_f, fused=False,
+                         checkpoint_every=None, channel=3):
+    # Head conv and residual body are shared by all scales, as a nested model
+    # applied to the input of each scale.
+    feat = layers.Input((None, None, F))
+    if fused or checkpoint_every:
+        x = ResidualStack(F, nb_res, res_scale_f, checkpoint_every,
+                          name="res_stack")(feat)
+    else:
+        x = feat
+        for i in range(nb_res):
+            x = _ResBlock(F, res_scale_f, name="res%d" % i)(x)
+    x = layers.Conv2D(F, (3, 3), padding="same")(x)
+    body = keras.Model(feat, layers.Add()([feat, x]), name="body")
+    head = layers.Conv2D(F, (3, 3), padding="same", name="head")
+
+    outs = []
+    for inp, scale in zip(inps, scales):
+        x = head(MeanShift(-1, dtype="float32")(inp))
+        out = _upsample_tail(body(x), scale, F, channel)
+        outs.append(MeanShift(1, dtype="float32", name="sr_x%d" % scale)(out))
+    return outs
 
 
 class EDSR(BaseSRModel):
-    def __init__(self, scale, model_name, channel=3):
-        super(EDSR, self).__init__(scale, model_name, channel)
+    '''EDSR, residual blocks run as one `ResidualStack` layer if `fused`.
+
+        Weights (`.h5`) of either variant can be loaded into the other one.
+        With `checkpoint_every` k (implies `fused`), training recomputes activations
+        of residual blocks in groups of k instead of keeping them, for larger batches
+        or patches in the same memory. See `python -m benchmarks.recompute`.
+
+        If `shift_input`, the mean of DIV2K is subtracted from inputs before the head
+        conv (as the original EDSR). Off by default, weights trained without it give
+        wrong outputs with it, retrain models to turn it on.
+    '''
+
+    def __init__(self,
+                 scale,
+                 model_name,
+                 channel=3,
+                 fused=False,
+                 checkpoint_every=None,
+                 shift_input=False,
+                 **kwargs):
+        super(EDSR, self).__init__(scale, model_name, channel, **kwargs)
 
         self.F = 256
         self.nb_resblock = 32
         self.res_scale_f = 0.1
+        self.checkpoint_every = checkpoint_every
+        self.fused = fused or bool(checkpoint_every)
+        self.shift_input = shift_input
+
+    def receptive_field(self):
+        # head and body-tail convs, two convs per residual block and the
+        # upsampling tail (counted in lr pixels, rounded up).
+        return 2 * self.nb_resblock + 4
 
     def create_model(self, load_weights=False, weights_path=None):
-        inp = super(EDSR, self).create_model()
-        out = EDSR_func(inp, scale=self.scale, F=self.F,
-                        nb_res=self.nb_resblock, res_scale_f=self.res_scale_f)
-        model = keras.Model(inp, out)
+        with self.scope():
+            inp = super(EDSR, self).create_model()
+            out = EDSR_func(inp, scale=self.scale, F=self.F,
+                            nb_res=self.nb_resblock, res_scale_f=self.res_scale_f,
+                            fused=self.fused, checkpoint_every=self.checkpoint_every,
+                            shift_input=self.shift_input, channel=self.channel)
+            model = keras.Model(inp, out)
 
-        if load_weights:
-            weights_path = self.weights_path if weights_path is None else weights_path
-            model.load_weights(weights_path)
-            print("loaded model %s from %s" % (self.model_name, weights_path))
+            if load_weights:
+                weights_path = self.weights_path if weights_path is None else weights_path
+                self._load_weights(model, weights_path)
+                print("loaded model %s from %s" % (self.model_name, weights_path))
 
         self.model = model
         return self
 
+    def _load_weights(self, model, weights_path):
+        if not weights_path.endswith(".h5") or self.fused == _is_fused_h5(
+                weights_path):
+            model.load_weights(weights_path)
+            return
+        # Weights of the other variant, load them into it and copy in order.
+        inp = layers.Input(self.inp_shape)
+        other = keras.Model(
+            inp,
+            EDSR_func(inp, scale=self.scale, F=self.F, nb_res=self.nb_resblock,
+                      res_scale_f=self.res_scale_f, fused=not self.fused,
+                      shift_input=self.shift_input, channel=self.channel))
+        other.load_weights(weights_path)
+        model.set_weights(other.get_weights())
+
+
+def _is_fused_h5(weights_path):
+    # Layer names are saved in h5 files of `save_weights`.
+    with h5py.File(weights_path, "r") as f:
+        names = [
+            n.decode("utf8") if isinstance(n, bytes) else n
+            for n in f.attrs["layer_names"]
+        ]
+    return "res_stack" in names
+
 
 class EDSR_baseline(EDSR):
-    def __init__(self, scale, model_name, channel=3):
-        super(EDSR_baseline, self).__init__(scale, model_name, channel)
+    def __init__(self, scale, model_name, channel=3, **kwargs):
+        super(EDSR_baseline, self).__init__(scale, model_name, channel, **kwargs)
 
         self.F = 64
         self.nb_resblock = 16
         self.res_scale_f = 1.0
+
+
+class EDSR_multiscale(BaseSRModel):
+    '''EDSR body shared by several scales, with an upsampling tail per scale (as MDSR).
+
+        The model maps inputs "lr_x%d" to outputs "sr_x%d" of each of `scales`, and is
+        trained on all of them in one run: `fit` with `batch_preprocess` wrapping
+        `preprocess.degrade_multiscale` reads, decodes and shuffles hr-patches once, and
+        each step updates the shared body with losses of all scales (summed). Hr-patches
+        should be divisible by all scales, e.g. 96 for (2, 3, 4).
+        Validation PSNR is logged per output, the best checkpoint is kept by "val_loss".
+
+        Use `for_scale()` to predict, evaluate or export one scale.
+        See `python -m benchmarks.multiscale` for the cost against runs per scale.
+    '''
+
+    def __init__(self,
+                 scales,
+                 model_name,
+                 channel=3,
+                 fused=False,
+                 checkpoint_every=None,
+                 **kwargs):
+        scales = sorted(scales) if isinstance(scales, (list, tuple)) else [scales]
+        super(EDSR_multiscale, self).__init__(scales[-1], model_name, channel,
+                                              **kwargs)
+        self.scales = scales
+        self.model_name = "%s_X%s" % (model_name, "".join(map(str, scales)))
+        self.weights_path = "./weights/%s.h5" % self.model_name
+        self.ckpt_dir = "./checkpoints/%s" % self.model_name
+        self.ckpt_monitor = ("val_loss", "min")
+
+        self.F = 64
+        self.nb_resblock = 16
+        self.res_scale_f = 1.0
+        self.checkpoint_every = checkpoint_every
+        self.fused = fused or bool(checkpoint_every)
+
+    def receptive_field(self):
+        return 2 * self.nb_resblock + 4
+
+    def create_model(self, load_weights=False, weights_path=None):
+        with self.scope():
+            inps = [layers.Input(self.inp_shape, name="lr_x%d" % s) for s in self.scales]
+            outs = EDSR_multiscale_func(inps, self.scales, F=self.F,
+                                        nb_res=self.nb_resblock,
+                                        res_scale_f=self.res_scale_f,
+                                        fused=self.fused,
+                                        checkpoint_every=self.checkpoint_every,
+                                        channel=self.channel)
+            model = keras.Model(inps, outs)
+
+            if load_weights:
+                weights_path = self.weights_path if weights_path is None else weights_path
+                model.load_weights(weights_path)
+                print("loaded model %s from %s" % (self.model_name, weights_path))
+
+        self.model = model
+        return self
+
+    def for_scale(self, scale):
+        '''Single-scale model of `scale`, sharing layers (thus weights) with this one.'''
+        if scale not in self.scales:
+            raise ValueError("Scale %d is not one of %s." % (scale, self.scales))
+        return _SingleScale(self, scale)
+
+
+class _SingleScale(BaseSRModel):
+    def __init__(self, parent, scale):
+        super(_SingleScale, self).__init__(scale,
+                                           parent.model_name,
+                                           parent.channel,
+                                           strategy=parent.strategy,
+                                           precision=parent.precision,
+                                           jit_compile=parent.jit_compile)
+        self.parent = parent
+        i = parent.scales.index(scale)
+        self.model = keras.Model(parent.model.inputs[i], parent.model.outputs[i])
+
+    def receptive_field(self):
+        return self.parent.receptive_field()
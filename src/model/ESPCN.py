@@ -0,0 +1,48 @@
+from .common import BaseSRModel
+from .utils import SubpixelLayer
+from tensorflow.python.keras import layers
+from tensorflow.python import keras
+
+
+class ESPCN(BaseSRModel):
+    """
+    ESPCN, see https://arxiv.org/abs/1609.05158
+    Three convolutions on the lr-image, the last one is upsampled by sub-pixel shuffling.
+    """
+
+    def __init__(self, scale, model_name, channel=1, **kwargs):
+
+        super(ESPCN, self).__init__(scale, model_name, channel, **kwargs)
+
+        self.f1 = 5
+        self.f2 = 3
+        self.f3 = 3
+
+        self.n1 = 64
+        self.n2 = 32
+
+    def receptive_field(self):
+        return self.f1 // 2 + self.f2 // 2 + self.f3 // 2
+
+    def create_model(self, load_weights=False, weights_path=None):
+        with self.scope():
+            inp = super(ESPCN, self).create_model()
+
+            x = layers.Conv2D(self.n1, (self.f1, self.f1), activation='tanh',
+                              padding='same', name='level1')(inp)
+            x = layers.Conv2D(self.n2, (self.f2, self.f2), activation='tanh',
+                              padding='same', name='level2')(x)
+
+            out = SubpixelLayer(scale=self.scale, out_channel=self.channel,
+                                kernel_size=self.f3, name='subpixel')(x)
+            out = self.float32_output(out)
+
+            model = keras.Model(inp, out)
+
+            if load_weights:
+                weights_path = self.weights_path if weights_path is None else weights_path
+                model.load_weights(weights_path)
+                print("loaded model %s from %s" % (self.model_name, weights_path))
+
+        self.model = model
+        return self
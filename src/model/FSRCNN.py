@@ -0,0 +1,65 @@
+from .common import BaseSRModel
+from tensorflow.python.keras import layers
+from tensorflow.python import keras
+
+
+class FSRCNN(BaseSRModel):
+    """
+    FSRCNN(d, s, m), see https://arxiv.org/abs/1608.00367
+    Feature extraction, shrinking, mapping and expanding run on the lr-image,
+    which is upsampled by a deconvolution at the end.
+    """
+
+    def __init__(self, scale, model_name, channel=1, **kwargs):
+
+        super(FSRCNN, self).__init__(scale, model_name, channel, **kwargs)
+
+        self.d = 56
+        self.s = 12
+        self.m = 4
+
+    def receptive_field(self):
+        # 5x5 extraction, m 3x3 mappings and the 9x9 deconvolution (in lr pixels).
+        return 2 + self.m + -(-4 // self.scale)
+
+    def create_model(self, load_weights=False, weights_path=None):
+        with self.scope():
+            inp = super(FSRCNN, self).create_model()
+
+            x = layers.Conv2D(self.d, (5, 5), padding='same', name='extract')(inp)
+            x = layers.PReLU(shared_axes=[1, 2])(x)
+            x = layers.Conv2D(self.s, (1, 1), padding='same', name='shrink')(x)
+            x = layers.PReLU(shared_axes=[1, 2])(x)
+            for i in range(self.m):
+                x = layers.Conv2D(self.s, (3, 3), padding='same', name='map%d' % i)(x)
+                x = layers.PReLU(shared_axes=[1, 2])(x)
+            x = layers.Conv2D(self.d, (1, 1), padding='same', name='expand')(x)
+            x = layers.PReLU(shared_axes=[1, 2])(x)
+
+            out = layers.Conv2DTranspose(self.channel, (9, 9), strides=self.scale,
+                                         padding='same', name='deconv')(x)
+            out = self.float32_output(out)
+
+            model = keras.Model(inp, out)
+
+            if load_weights:
+                weights_path = self.weights_path if weights_path is None else weights_path
+                model.load_weights(weights_path)
+                print("loaded model %s from %s" % (self.model_name, weights_path))
+
+        self.model = model
+        return self
+
+
+class FSRCNN_s(FSRCNN):
+    """
+    FSRCNN-s, the smaller FSRCNN(32, 5, 1) for real-time use.
+    """
+
+    def __init__(self, scale, model_name, channel=1, **kwargs):
+
+        super(FSRCNN_s, self).__init__(scale, model_name, channel, **kwargs)
+
+        self.d = 32
+        self.s = 5
+        self.m = 1
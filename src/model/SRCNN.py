@@ -8,9 +8,9 @@ class SRCNN_915(BaseSRModel):
     Using 9-1-5 model.
     """
 
-    def __init__(self, scale, model_name, channel=1):
+    def __init__(self, scale, model_name, channel=1, **kwargs):
 
-        super(SRCNN_915, self).__init__(scale, model_name, channel)
+        super(SRCNN_915, self).__init__(scale, model_name, channel, **kwargs)
 
         self.f1 = 9
         self.f2 = 1
@@ -18,6 +18,10 @@ class SRCNN_915(BaseSRModel):
 
         self.n1 = 64
         self.n2 = 32
+        self.pre_upsample = True
+
+    def receptive_field(self):
+        return self.f1 // 2 + self.f2 // 2 + self.f3 // 2
 
     def create_model(self, load_weights=False, weights_path=None):
         '''
@@ -26,22 +30,24 @@ class SRCNN_915(BaseSRModel):
         You can change it to `valid` if needed, don't forget to modify the labels' size.
         '''
 
-        inp = super(SRCNN_915, self).create_model()
+        with self.scope():
+            inp = super(SRCNN_915, self).create_model()
 
-        x = layers.Convolution2D(self.n1, (self.f1, self.f1),
-                                 activation='relu', padding='same', name='level1')(inp)
-        x = layers.Convolution2D(self.n2, (self.f2, self.f2),
-                                 activation='relu', padding='same', name='level2')(x)
+            x = layers.Convolution2D(self.n1, (self.f1, self.f1),
+                                     activation='relu', padding='same', name='level1')(inp)
+            x = layers.Convolution2D(self.n2, (self.f2, self.f2),
+                                     activation='relu', padding='same', name='level2')(x)
 
-        out = layers.Convolution2D(self.channel, (self.f3, self.f3),
-                                   padding='same', name='output')(x)
+            out = layers.Convolution2D(self.channel, (self.f3, self.f3),
+                                       padding='same', name='output')(x)
+            out = self.float32_output(out)
 
-        model = keras.Model(inp, out)
+            model = keras.Model(inp, out)
 
-        if load_weights:
-            weights_path = self.weights_path if weights_path is None else weights_path
-            model.load_weights(weights_path)
-            print("loaded model %s from %s" % (self.model_name, weights_path))
+            if load_weights:
+                weights_path = self.weights_path if weights_path is None else weights_path
+                model.load_weights(weights_path)
+                print("loaded model %s from %s" % (self.model_name, weights_path))
 
         self.model = model
         return self
@@ -51,18 +57,13 @@ class SRCNN_915(BaseSRModel):
         return 1e-5
 
 
-class SRCNN_955(BaseSRModel):
+class SRCNN_955(SRCNN_915):
     """
     Using 9-5-5 model.
     """
 
-    def __init__(self, scale, model_name, channel=1):
+    def __init__(self, scale, model_name, channel=1, **kwargs):
 
-        super(SRCNN_955, self).__init__(scale, model_name, channel)
+        super(SRCNN_955, self).__init__(scale, model_name, channel, **kwargs)
 
-        self.f1 = 9
         self.f2 = 5
-        self.f3 = 5
-
-        self.n1 = 64
-        self.n2 = 32
@@ -1,5 +1,106 @@
-from . import common
-from . import utils
-from .EDSR import EDSR, EDSR_baseline
-from .SRCNN import SRCNN_915, SRCNN_955
-from .common import BaseSRModel
\ No newline at end of file
+# Models are imported lazily on first access, e.g. `src.model.EDSR` or
+# `get_model("edsr", 4)` only imports `EDSR.py` (and `common.py`).
+import importlib
+import types
+import sys
+
+_SUBMODULES = ["common", "utils", "inference", "export", "quantize", "stream",
+               "profiling", "checkpoint"]
+
+# Registry of model classes, name -> class or module (imported on demand).
+_MODELS = {
+    "SRCNN_915": ".SRCNN",
+    "SRCNN_955": ".SRCNN",
+    "FSRCNN": ".FSRCNN",
+    "FSRCNN_s": ".FSRCNN",
+    "ESPCN": ".ESPCN",
+    "CARN": ".CARN",
+    "EDSR": ".EDSR",
+    "EDSR_baseline": ".EDSR",
+    "EDSR_multiscale": ".EDSR",
+}
+
+
+def register_model(cls, name=None):
+    '''Register a model class (subclass of `BaseSRModel`) for `get_model`.
+
+        Can be used as decorator of customized models.
+    '''
+    _MODELS[name or cls.__name__] = cls
+    return cls
+
+
+def list_models():
+    '''Names of registered models.'''
+    return list(_MODELS)
+
+
+def get_model(name, scale, model_name=None, **kwargs):
+    '''Create a registered model by name, importing only its module.
+
+        Params:
+            name: String.
+                Name of the model class, case-insensitive, e.g. "edsr_baseline".
+            scale: Int.
+                Super-resolution ratio factor (list of them for "EDSR_multiscale").
+            model_name: String or None.
+                Name of this model (used for weights and logs), `name` by default.
+            **kwargs: Dict.
+                Other params of the model, e.g. `channel`, `precision`.
+
+        Return:
+            Instance of the model, call `create_model()` to build it.
+    '''
+    names = {key.lower(): key for key in _MODELS}
+    if name.lower() not in names:
+        raise ValueError("Unknown model %s, one of %s." % (name, list(_MODELS)))
+    key = names[name.lower()]
+    return _load(key)(scale, key if model_name is None else model_name,
+                      **kwargs)
+
+
+def _load(name):
+    cls = _MODELS[name]
+    if isinstance(cls, str):
+        module = importlib.import_module(cls, __name__)
+        # Importing `.EDSR` binds the module as attribute `EDSR` of this
+        # package, rebind names of all models in it to the classes.
+        for key, value in _MODELS.items():
+            if value == cls:
+                globals()[key] = getattr(module, key)
+        cls = getattr(module, name)
+    return cls
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module("." + name, __name__)
+    if name == "BaseSRModel":
+        return importlib.import_module(".common", __name__).BaseSRModel
+    if name in _MODELS:
+        return _load(name)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+def __dir__():
+    return sorted(
+        set(globals()) | set(_SUBMODULES) | set(_MODELS) | {"BaseSRModel"})
+
+
+class _Package(types.ModuleType):
+    def __setattr__(self, name, value):
+        # Once a submodule is loaded (`import src.model.EDSR`, `from src.model.EDSR
+        # import ...`), the import system binds it as attribute of this package,
+        # keep names of models bound to their classes instead.
+        if (isinstance(value, types.ModuleType) and name in _MODELS
+                and value.__name__ == "%s.%s" % (self.__name__, name)):
+            value = getattr(value, name)
+        super(_Package, self).__setattr__(name, value)
+
+
+sys.modules[__name__].__class__ = _Package
+
+if sys.version_info < (3, 7):
+    # XXX No module `__getattr__` (PEP 562) before python 3.7, import eagerly.
+    for _name in _SUBMODULES + list(_MODELS) + ["BaseSRModel"]:
+        globals()[_name] = __getattr__(_name)
@@ -0,0 +1,394 @@
+from tensorflow.python.keras import callbacks
+from tensorflow.python.keras import backend as K
+from tensorflow.python.keras import __version__ as keras_version
+from tensorflow.python.keras.saving import hdf5_format
+from concurrent.futures import ThreadPoolExecutor
+import tensorflow as tf
+import numpy as np
+import tempfile
+import h5py
+import shutil
+import json
+import os
+
+INDEX = "checkpoints.json"
+
+
+def _dump_json(obj, path):
+    # Write then rename, thus readers never see a partial file.
+    with open(path + ".tmp", "w") as f:
+        json.dump(obj, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def read_index(ckpt_dir):
+    '''Index of checkpoints in `ckpt_dir`, empty if there is none.
+
+        Return:
+            Dict, `checkpoints` (list of `epoch`, `path` and `metric`, in order of
+            epochs) and `best` (path of the best checkpoint, or None).
+    '''
+    path = os.path.join(ckpt_dir, INDEX)
+    if not os.path.exists(path):
+        return {"checkpoints": [], "best": None}
+    with open(path) as f:
+        return json.load(f)
+
+
+def latest_checkpoint(ckpt_dir):
+    '''Path and epoch (0-based) of the latest checkpoint in `ckpt_dir`, or (None, None).'''
+    checkpoints = read_index(ckpt_dir)["checkpoints"]
+    if not checkpoints:
+        return None, None
+    latest = checkpoints[-1]
+    return os.path.join(ckpt_dir, latest["path"]), latest["epoch"]
+
+
+def is_chief(strategy=None):
+    '''Whether this worker writes checkpoints (always, if not multi-worker).'''
+    strategy = tf.distribute.get_strategy() if strategy is None else strategy
+    try:
+        return strategy.extended.should_checkpoint
+    except NotImplementedError:
+        # Default (single device) strategy.
+        return True
+
+
+def build_optimizer(model, strategy=None):
+    '''Create slot variables of the optimizer of compiled `model`, by applying zero gradients.
+
+        Keras creates them lazily on the first step, thus optimizer weights can't be set
+        before. Zero gradients leave weights of Adam (and `AdamWithWeightnorm`) unchanged.
+    '''
+    strategy = tf.distribute.get_strategy() if strategy is None else strategy
+    # Optimizer wrapped by `GradientAccumulation`, which holds the weights.
+    optimizer = getattr(model.optimizer, "inner_optimizer", model.optimizer)
+    variables = model.trainable_variables
+    zeros = [tf.zeros_like(v) for v in variables]
+    # XXX `run` is named `experimental_run_v2` before TF 2.2.
+    run = getattr(strategy, "run", None) or strategy.experimental_run_v2
+    run(lambda: optimizer.apply_gradients(zip(zeros, variables)))
+
+
+def restore_checkpoint(model, path, strategy=None):
+    '''Restore weights and optimizer state of compiled `model` from a checkpoint.
+
+        Raise `ValueError` if the checkpoint doesn't match the model (or its optimizer),
+        e.g. written by another architecture under the same `ckpt_dir`.
+
+        Return:
+            Epoch (0-based) the checkpoint was saved at.
+    '''
+    weights, opt_weights, epoch = _read_checkpoint(model, path)
+    build_optimizer(model, strategy)
+    _set_checkpoint(model, path, weights, opt_weights)
+    return epoch
+
+
+def resume_checkpoint(model, ckpt_dir, strategy=None):
+    '''Restore compiled `model` from the latest checkpoint in `ckpt_dir`, if any.
+
+        With multiple workers, only the chief reads `ckpt_dir` (it's the only one
+        writing there, other workers may have no or stale copies of it), and its
+        epoch, weights and optimizer state are broadcast to all workers, thus they
+        resume at the same epoch from the same state. A checkpoint not matching the
+        model raises `ValueError` on all workers.
+
+        Return:
+            Epoch (0-based) the checkpoint was saved at, or None if there is none.
+    '''
+    strategy = tf.distribute.get_strategy() if strategy is None else strategy
+    path, _ = latest_checkpoint(ckpt_dir) if is_chief(strategy) else (None, None)
+    checkpoint, error = None, None
+    if path is not None:
+        try:
+            checkpoint = _read_checkpoint(model, path)
+        except ValueError as e:
+            error = e
+    # -1 if there is no checkpoint, -2 if it doesn't match the model.
+    epoch = -2 if error is not None else -1 if checkpoint is None else checkpoint[2]
+    epoch = int(_broadcast(strategy, [np.float32(epoch)])[0])
+    if epoch == -1:
+        return None
+    if epoch == -2:
+        raise error or ValueError(
+            "Checkpoint of the chief worker doesn't match the model.")
+
+    # Optimizer weights are created on all workers (in sync), before they're set.
+    build_optimizer(model, strategy)
+    if checkpoint is not None:
+        try:
+            _set_checkpoint(model, path, checkpoint[0], checkpoint[1])
+        except ValueError as e:
+            error = e
+    nb_weights = len(model.weights)
+    values = _broadcast(strategy, [np.float32(error is None)] +
+                        model.get_weights() + model.optimizer.get_weights())
+    if not values[0]:
+        raise error or ValueError(
+            "Checkpoint of the chief worker doesn't match the optimizer.")
+    if not is_chief(strategy):
+        model.set_weights(values[1:nb_weights + 1])
+        model.optimizer.set_weights(values[nb_weights + 1:])
+    return epoch
+
+
+def _read_checkpoint(model, path):
+    with np.load(path) as data:
+        weights = [data["w_%d" % i] for i in range(int(data["nb_weights"]))]
+        opt_weights = [
+            data["o_%d" % i] for i in range(int(data["nb_opt_weights"]))
+        ]
+        epoch = int(data["epoch"])
+    _check_shapes(path, "weights", [w.shape for w in weights],
+                  [tuple(w.shape) for w in model.weights])
+    return weights, opt_weights, epoch
+
+
+def _set_checkpoint(model, path, weights, opt_weights):
+    # Optimizer weights are built, see `build_optimizer`.
+    if opt_weights:
+        _check_shapes(path, "optimizer weights", [w.shape for w in opt_weights],
+                      [tuple(w.shape) for w in model.optimizer.weights])
+        model.optimizer.set_weights(opt_weights)
+    model.set_weights(weights)
+
+
+def _broadcast(strategy, values):
+    # Values (numpy arrays) of the first replica of the chief worker, on all workers.
+    try:
+        if not strategy.extended.experimental_between_graph:
+            return values
+    except NotImplementedError:
+        # Default (single device) strategy.
+        return values
+
+    chief = is_chief(strategy)
+    nb_local = len(strategy.extended.worker_devices)
+
+    def first_replica():
+        ctx = tf.distribute.get_replica_context()
+        # XXX Replica ids are local to each worker in TF 2.0, global later on.
+        first = tf.logical_and(
+            chief, tf.equal(ctx.replica_id_in_sync_group % nb_local, 0))
+        return ctx.all_reduce(
+            tf.distribute.ReduceOp.SUM,
+            [tf.where(first, v, tf.zeros_like(v)) for v in values])
+
+    run = getattr(strategy, "run", None) or strategy.experimental_run_v2
+    return [
+        strategy.experimental_local_results(v)[0].numpy()
+        for v in run(first_replica)
+    ]
+
+
+def _check_shapes(path, name, saved, expected):
+    if len(saved) != len(expected) or any(
+            tuple(a) != tuple(b) for a, b in zip(saved, expected)):
+        raise ValueError(
+            "Checkpoint %s doesn't match the model: %d %s of shapes %s, "
+            "expected %d of shapes %s." %
+            (path, len(saved), name, saved, len(expected), expected))
+
+
+def _snapshot(model):
+    # Values of `model.weights` and of weights of each layer (as `save_weights` orders
+    # them), read at once, thus each variable is copied only once.
+    layers = [(layer.name, layer.trainable_weights + layer.non_trainable_weights)
+              for layer in model.layers]
+    variables = list(model.weights)
+    unique, index = [], {}
+    for v in variables + [w for _, weights in layers for w in weights]:
+        if id(v) not in index:
+            index[id(v)] = len(unique)
+            unique.append(v)
+    values = K.batch_get_value(unique)
+    return [values[index[id(v)]] for v in variables], [
+        (name, [w.name for w in weights], [values[index[id(w)]] for w in weights])
+        for name, weights in layers
+    ]
+
+
+def _save_weights(path, layers):
+    # Same layout as `hdf5_format.save_weights_to_hdf5_group`, from snapshot values.
+    with h5py.File(path + ".tmp", "w") as f:
+        hdf5_format.save_attributes_to_hdf5_group(
+            f, "layer_names", [name.encode("utf8") for name, _, _ in layers])
+        f.attrs["backend"] = K.backend().encode("utf8")
+        f.attrs["keras_version"] = str(keras_version).encode("utf8")
+        for name, weight_names, values in layers:
+            g = f.create_group(name)
+            weight_names = [n.encode("utf8") for n in weight_names]
+            hdf5_format.save_attributes_to_hdf5_group(g, "weight_names",
+                                                      weight_names)
+            for weight_name, value in zip(weight_names, values):
+                param = g.create_dataset(weight_name, value.shape, dtype=value.dtype)
+                if not value.shape:
+                    param[()] = value
+                else:
+                    param[:] = value
+    os.replace(path + ".tmp", path)
+
+
+class AsyncCheckpoint(callbacks.Callback):
+    '''Non-blocking checkpointing of weights and optimizer state, with retention.
+
+        At the end of each epoch, weights and optimizer state are copied to host memory
+        (`get_weights`), and written to `ckpt_dir/ckpt-<epoch>.npz` by a background
+        thread while training goes on. At most one snapshot is pending, thus memory is
+        bounded by two copies of the weights.
+
+        The last `keep_last` checkpoints and the best one by `monitor` are kept, others
+        are deleted. Resume with `resume_checkpoint(model, ckpt_dir)` and `initial_epoch`
+        of the next epoch, see `BaseSRModel.fit`. Weights of each epoch are also written
+        to `weights_path` (as `save_weights` does) by the same thread.
+
+        With multiple workers only the chief writes to `ckpt_dir` and `weights_path`,
+        other workers take the same snapshots (in lockstep) into a temporary directory
+        removed at the end, as `ModelCheckpoint` does.
+
+        Attributes:
+            best: Best value of `monitor` so far (across resumed runs).
+            chief: Whether this worker writes checkpoints, see `is_chief`.
+    '''
+
+    def __init__(self,
+                 ckpt_dir,
+                 weights_path=None,
+                 keep_last=3,
+                 monitor="val_psnr_tf",
+                 mode="max",
+                 verbose=1,
+                 strategy=None,
+                 resume=False):
+        '''
+            Params:
+                ckpt_dir: String.
+                    Directory of checkpoints and their index `checkpoints.json`.
+                weights_path: String or None.
+                    If given, weights are also saved to it (`.h5`, overwritten) at the
+                    end of each epoch, to be loaded by `load_weights`.
+                keep_last: Int.
+                    Number of latest checkpoints to keep, at least 1.
+                monitor: String.
+                    Metric of logs the best checkpoint is picked by. Only the latest ones
+                    are kept if it's not in logs.
+                mode: String.
+                    "max" or "min", whether larger `monitor` is better.
+                verbose: Int.
+                    Print written checkpoints if 1.
+                strategy: `tf.distribute` strategy the model is trained with, to tell
+                    the chief worker. Default strategy by default.
+                resume: Whether training resumes from checkpoints in `ckpt_dir`, thus
+                    continues their index (and best metric). Otherwise a new index is
+                    started, and checkpoints of the previous run are deleted once the
+                    first new one is written.
+        '''
+        super(AsyncCheckpoint, self).__init__()
+        assert mode in ("max", "min"), "Mode should be max or min"
+        assert keep_last >= 1, "The latest checkpoint is needed to resume"
+        self.ckpt_dir = ckpt_dir
+        self.weights_path = weights_path
+        self.keep_last = keep_last
+        self.monitor = monitor
+        self.mode = mode
+        self.verbose = verbose
+        self.chief = is_chief(strategy)
+        # Directory written by this worker, temporary ones are made at train begin.
+        self._dir = ckpt_dir if self.chief else None
+        if self.chief:
+            os.makedirs(ckpt_dir, exist_ok=True)
+        # Only touched by the writer thread after construction.
+        self._index = {"checkpoints": [], "best": None}
+        self._stale = []
+        if self.chief and resume:
+            self._index = read_index(ckpt_dir)
+        elif self.chief:
+            self._stale = [c["path"] for c in read_index(ckpt_dir)["checkpoints"]]
+        self.best = None
+        for ckpt in self._index["checkpoints"]:
+            if ckpt["path"] == self._index["best"]:
+                self.best = ckpt["metric"]
+        self._executor = None
+        self._pending = None
+
+    def _better(self, value):
+        if value is None:
+            return False
+        if self.best is None:
+            return True
+        return value > self.best if self.mode == "max" else value < self.best
+
+    def on_train_begin(self, logs=None):
+        if not self.chief:
+            self._dir = tempfile.mkdtemp()
+        self._executor = ThreadPoolExecutor(1)
+
+    def on_epoch_end(self, epoch, logs=None):
+        metric = (logs or {}).get(self.monitor)
+        metric = None if metric is None else float(metric)
+        is_best = self._better(metric)
+        if is_best:
+            self.best = metric
+        # Snapshot on this thread, the model is updated again by the next step.
+        weights, layers = _snapshot(self.model)
+        opt_weights = self.model.optimizer.get_weights()
+        # Raise errors of the last write here, and bound memory to one pending write.
+        self.wait()
+        self._pending = self._executor.submit(self._write, epoch, metric,
+                                              is_best, weights, opt_weights,
+                                              layers)
+
+    def wait(self):
+        '''Block until the pending checkpoint is written.'''
+        if self._pending is not None:
+            pending, self._pending = self._pending, None
+            pending.result()
+
+    def on_train_end(self, logs=None):
+        try:
+            self.wait()
+        finally:
+            self._executor.shutdown()
+        if not self.chief:
+            shutil.rmtree(self._dir, ignore_errors=True)
+
+    def _write(self, epoch, metric, is_best, weights, opt_weights, layers):
+        if self.weights_path is not None and self.chief:
+            _save_weights(self.weights_path, layers)
+            if self.verbose:
+                print("\nEpoch %05d: saved model to %s" %
+                      (epoch + 1, self.weights_path))
+
+        name = "ckpt-%04d.npz" % (epoch + 1)
+        path = os.path.join(self._dir, name)
+        arrays = {"w_%d" % i: w for i, w in enumerate(weights)}
+        arrays.update({"o_%d" % i: w for i, w in enumerate(opt_weights)})
+        # `np.savez` appends `.npz` to names without it.
+        with open(path + ".tmp", "wb") as f:
+            np.savez(f,
+                     epoch=epoch,
+                     nb_weights=len(weights),
+                     nb_opt_weights=len(opt_weights),
+                     **arrays)
+        os.replace(path + ".tmp", path)
+
+        checkpoints = [
+            c for c in self._index["checkpoints"] if c["path"] != name
+        ] + [{"epoch": epoch, "path": name, "metric": metric}]
+        best = name if is_best else self._index["best"]
+        kept = set(c["path"] for c in checkpoints[-self.keep_last:]) | {best}
+        self._index = {
+            "checkpoints": [c for c in checkpoints if c["path"] in kept],
+            "best": best
+        }
+        _dump_json(self._index, os.path.join(self._dir, INDEX))
+        # Delete files after the index doesn't refer to them.
+        stale = [c["path"] for c in checkpoints] + self._stale
+        self._stale = []
+        for name in stale:
+            if name not in kept and os.path.exists(os.path.join(self._dir, name)):
+                os.remove(os.path.join(self._dir, name))
+        if self.verbose and self.chief:
+            print("\nEpoch %05d: saved checkpoint to %s%s" %
+                  (epoch + 1, path, " (best)" if is_best else ""))
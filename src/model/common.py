@@ -1,14 +1,68 @@
-from tensorflow.python.keras import layers, callbacks, optimizers
+from tensorflow.python.keras import layers, callbacks
+from tensorflow.python.keras.mixed_precision.experimental import policy as mixed_precision
+from tensorflow.python.keras.optimizer_v2.adam import Adam
 from tensorflow.python.keras.utils import plot_model
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
 import tensorflow as tf
+import numpy as np
+import contextlib
+import inspect
+import glob
+import time
 import os
 
 from ..wn import AdamWithWeightnorm
-from .utils import psnr_tf
+from ..accumulate import GradientAccumulation
+from ..data_utils import modcrop, rgb2ycbcr, merge_y
+from ..preprocess import degrade_image
+from .utils import psnr_tf, psnr_ssim_y
+from .inference import tiled_predict, bucketed_predict, self_ensemble
+from .stream import stream_upscale
+from .export import export_saved_model, export_tflite
+from .profiling import StepProfiler
+from .checkpoint import AsyncCheckpoint, latest_checkpoint, resume_checkpoint
 
 AUTOTUNE = tf.data.experimental.AUTOTUNE
 
 
+@contextlib.contextmanager
+def jit_scope(enabled=True):
+    '''XLA auto-clustering of graphs traced and instantiated inside, if `enabled`.
+
+        The process-wide setting is restored on exit, thus other functions and models
+        are not affected.
+    '''
+    if not enabled:
+        yield
+        return
+    previous = tf.config.optimizer.get_jit()
+    tf.config.optimizer.set_jit(True)
+    try:
+        yield
+    finally:
+        tf.config.optimizer.set_jit(previous)
+
+
+def compile_function(fn, jit_compile=False):
+    '''Wrap `fn` into `tf.function`, compiled with XLA if `jit_compile`.'''
+    if jit_compile:
+        for key in ("jit_compile", "experimental_compile"):
+            if key in inspect.signature(tf.function).parameters:
+                return tf.function(fn, experimental_relax_shapes=True,
+                                   **{key: True})
+        # XXX No per-function compilation before TF 2.1, auto-cluster the graphs
+        # of this function only (they are built at calls).
+        function = tf.function(fn, experimental_relax_shapes=True)
+
+        def jit_function(*args, **kwargs):
+            with jit_scope():
+                return function(*args, **kwargs)
+
+        return jit_function
+    return tf.function(fn, experimental_relax_shapes=True)
+
+
 class BaseSRModel(object):
     """Base model class of all models for SR.
 
@@ -19,25 +73,83 @@ class BaseSRModel(object):
             model_name: Name of this model.
             weights_path: Path to save this model, using "./weights/model_name.h5" by default.
             log_dir: Directory to save tensorboard log files.
+            ckpt_dir: Directory of checkpoints (weights and optimizer state) of `fit`, to resume from.
+            ckpt_monitor: (metric, "max" or "min") the best checkpoint is kept by, ("val_psnr_tf", "max")
+                by default.
             scale: Super-resolution ratio factor.
             inp_shape: Shape of input data in tuple, e.g. (None, None, 3).
             channel: Number of channels of both inputs and outputs.
-            model: keras Model object.
+            pre_upsample: Whether inputs of the model are lr-images upsampled to the hr-size (e.g. SRCNN).
+            strategy: `tf.distribute` strategy to create and train the model with, e.g.
+                `MultiWorkerMirroredStrategy` (XXX create it at the beginning of your program).
+                Default strategy (single device) by default.
+            precision: Name of mixed-precision policy, "float32" by default, or "mixed_bfloat16"
+                (bfloat16 computation with float32 variables, for CPUs supporting it).
+                `MeanShift`, outputs of the model and loss stay in float32.
+            jit_compile: Whether to compile training step and inference function with XLA.
+            model: keras Model object, setting it drops compiled inference functions of the previous one.
+            profiler: `StepProfiler` of the last `fit(profile=True)`.
+            nb_traces: Number of times the inference function was traced (a retrace per new
+                input shape, until shapes are relaxed), see `predict_images`.
 
         Methods:
             create_model(): XXX Generate the model, you need to complete this func.
+                Build the model under `with self.scope():`, and pass outputs through `self.float32_output`.
             lr_schedule(): Define the learning rate with respect to epoch.
             fit(): train the model with training dataset and hyperparameters.
                 - trdst: Tensorflow Dataset for training. (XXX Don't batch it!)
                 - valdst: Tensorflow Dataset for validation. (XXX Don't batch             it!)
                 - nb_epochs: Int, number of epochs to train.
                 - steps_per_epoch: Int, number of back propagations per epoch.
-                - batch_size: Int, batch size.
+                - batch_size: Int, global batch size, split over replicas of `strategy`.
                 - use_wn: Whether to use Adam with Weight-Normalization when              training. (Using Adam directly by default.)
+                - batch_preprocess: Function mapped on batched datasets, e.g. wrapping `preprocess.degrade_batch`.
+                  If given, `trdst` and `valdst` contain hr-patches only.
+                - histogram_freq: Int, epochs between weight histograms in TensorBoard. (Off by default,
+                  they are expensive for deep models.)
+                - profile: Whether to profile training steps (input wait vs compute, steps/sec, examples/sec
+                  and memory), see `profiling.StepProfiler`. The callback is kept as `self.profiler`.
+                - trace_steps: (first, last) global steps to capture a TF profiler trace of, if `profile`.
+                - prefetch: Int, number of batches prefetched. (AUTOTUNE by default)
+                - nb_parallel_calls: Int, number of batches `batch_preprocess` runs on in parallel.
+                  (AUTOTUNE by default)
+                - keep_last: Int, number of latest checkpoints kept in `ckpt_dir`, besides the best one by
+                  `ckpt_monitor`. Checkpoints are written in background, see `checkpoint.AsyncCheckpoint`.
+                  Weights of each epoch are also saved to `weights_path`, by the same background writer.
+                - resume: Whether to resume from the latest checkpoint in `ckpt_dir` (weights, optimizer
+                  state and epoch), thus `nb_epochs` is the total number of epochs. (Off by default, a new
+                  run replaces checkpoints of the previous one.)
+                - accumulation_steps: Int, number of micro-batches of `batch_size / accumulation_steps`
+                  each logical batch is split into, with one optimizer update per logical batch (see
+                  `accumulate.GradientAccumulation`). `steps_per_epoch` and `lr_schedule` stay per logical
+                  step, progress bars and profiling count micro-batches.
+            scope(): Context of creating model, with `strategy` and `precision` policy.
+            receptive_field(): Radius of receptive field of the model in input pixels.
+            predict_image(): super-resolve a whole normalized image (0--1) with tiled inference.
+                - lr: Numpy array or Tensor in shape of (H, W, C), model input.
+                - tile_size: Int, size of tiles in input pixels. (Derived from receptive field by default.)
+                - overlap: Int, overlap of adjacent tiles in input pixels. (Receptive field by default.)
+                - batch_size: Int, number of tiles per forward pass.
+                - ensemble: Int, number of flips / rotations averaged (1, 2, 4 or 8), in a batched
+                  forward pass.
+            predict_images(): super-resolve normalized images of different sizes in batches of
+                shape buckets, return sr-images and stats of padding and retracing.
+            upscale(): super-resolve a lr-image in range of (0, 255), return uint8 sr-image.
+            upscale_sequence(): super-resolve a stream of frames (video / image sequence) with decoding,
+                computing and encoding overlapped, see `stream.stream_upscale`.
+            export(): write SavedModel with batched `serve(lr_uint8) -> sr_uint8` signature,
+                and optionally a TFLite model.
+            evaluate(): PSNR/SSIM on Y channel of full-resolution test images, e.g. Image/set5.
             plot_model(): plot the model and save to ./
     """
 
-    def __init__(self, scale, model_name, channel=3):
+    def __init__(self,
+                 scale,
+                 model_name,
+                 channel=3,
+                 strategy=None,
+                 precision="float32",
+                 jit_compile=False):
         self.inp_shape = (None, None, channel)
         self.channel = channel
         self.scale = scale
@@ -45,7 +157,38 @@ class BaseSRModel(object):
         os.makedirs("./weights", exist_ok=True)
         self.weights_path = "./weights/%s_X%d.h5" % (model_name, scale)
         self.log_dir = "logs"
+        self.ckpt_dir = "./checkpoints/%s_X%d" % (model_name, scale)
+        self.ckpt_monitor = ("val_psnr_tf", "max")
+        self.pre_upsample = False
+        self.strategy = tf.distribute.get_strategy(
+        ) if strategy is None else strategy
+        self.precision = precision
+        self.jit_compile = jit_compile
         self.model = None
+        self.nb_traces = 0
+        self.profiler = None
+
+    @property
+    def model(self):
+        return self._model
+
+    @model.setter
+    def model(self, model):
+        # Inference functions capture variables of the model, retrace them for a new one.
+        self._model = model
+        self._predict_fns = {}
+
+    @contextlib.contextmanager
+    def scope(self):
+        with self.strategy.scope(), mixed_precision.policy_scope(
+                self.precision):
+            yield
+
+    def float32_output(self, x):
+        # Keep outputs (thus the loss and metrics) in float32 with mixed precision.
+        if self.precision == "float32":
+            return x
+        return layers.Activation("linear", dtype="float32")(x)
 
     def create_model(self, load_weights=False, weights_path=None, **kwargs):
         return layers.Input(self.inp_shape)
@@ -64,37 +207,355 @@ class BaseSRModel(object):
             nb_epochs,
             steps_per_epoch,
             batch_size=100,
-            use_wn=False):
+            use_wn=False,
+            batch_preprocess=None,
+            histogram_freq=0,
+            profile=False,
+            trace_steps=None,
+            prefetch=AUTOTUNE,
+            nb_parallel_calls=AUTOTUNE,
+            keep_last=3,
+            resume=False,
+            accumulation_steps=1):
+
+        if batch_size % accumulation_steps:
+            raise ValueError("Batch size (%d) should be divisible by accumulation steps (%d)." %
+                             (batch_size, accumulation_steps))
+        with self.strategy.scope():
+            opt = AdamWithWeightnorm() if use_wn else Adam()
+            if accumulation_steps > 1:
+                opt = GradientAccumulation(opt, accumulation_steps)
+            self.model.compile(optimizer=opt, loss='mse', metrics=[psnr_tf])
 
-        opt = AdamWithWeightnorm() if use_wn else optimizers.Adam()
-        self.model.compile(optimizer=opt, loss='mse', metrics=[psnr_tf])
+        initial_epoch = 0
+        # Read by the chief worker, and broadcast to others.
+        epoch = resume_checkpoint(self.model, self.ckpt_dir,
+                                  self.strategy) if resume else None
+        if epoch is not None:
+            initial_epoch = epoch + 1
+            print("resumed model %s from %s, at epoch %d of %d" %
+                  (self.model_name, self.ckpt_dir, initial_epoch + 1, nb_epochs))
+            if initial_epoch >= nb_epochs:
+                print("WARNING: %s was already trained for %d epochs, nothing left to train "
+                      "(pass resume=False to start a new run)." % (self.model_name, initial_epoch))
+        elif not resume and latest_checkpoint(self.ckpt_dir)[0] is not None:
+            print("starting a new run of %s, checkpoints of the previous run in %s will be "
+                  "replaced (pass resume=True to continue it)." % (self.model_name, self.ckpt_dir))
 
         log_dir = os.path.join(self.log_dir, self.model_name)
         callback_list = [
-            callbacks.ModelCheckpoint(self.weights_path,
-                                      save_best_only=False,
-                                      save_weights_only=True,
-                                      verbose=1),
+            AsyncCheckpoint(self.ckpt_dir,
+                            self.weights_path,
+                            keep_last=keep_last,
+                            monitor=self.ckpt_monitor[0],
+                            mode=self.ckpt_monitor[1],
+                            strategy=self.strategy,
+                            resume=resume),
             callbacks.LearningRateScheduler(lambda e: self.lr_schedule(
                 e, nb_epochs),
                                             verbose=0),
             callbacks.TensorBoard(log_dir=log_dir,
-                                  histogram_freq=1,
-                                  write_graph=True)
+                                  histogram_freq=histogram_freq,
+                                  write_graph=True,
+                                  profile_batch=0 if profile else 2)
         ]
+        if profile:
+            # Placed first, thus its step time excludes other callbacks.
+            self.profiler = StepProfiler(log_dir, trace_steps=trace_steps)
+            callback_list.insert(0, self.profiler)
 
-        print('Training model : %s' % (self.model_name))
+        print('Training model : %s on %d replica(s)' %
+              (self.model_name, self.strategy.num_replicas_in_sync))
 
-        self.model.fit(
-            x=trdst.batch(batch_size).prefetch(AUTOTUNE),
-            epochs=nb_epochs,
-            callbacks=callback_list,
-            validation_data=valdst.batch(batch_size).prefetch(AUTOTUNE),
-            steps_per_epoch=steps_per_epoch,
-            verbose=1)
+        # Datasets are batched globally, keras splits batches over replicas and
+        # auto-shards them over workers.
+        # With accumulation, keras steps run on micro-batches, `accumulation_steps` per update.
+        batch_size //= accumulation_steps
+        trdst, valdst = trdst.batch(batch_size), valdst.batch(batch_size)
+        if batch_preprocess is not None:
+            trdst = trdst.map(batch_preprocess,
+                              num_parallel_calls=nb_parallel_calls)
+            valdst = valdst.map(batch_preprocess,
+                                num_parallel_calls=nb_parallel_calls)
+
+        trdst = trdst.prefetch(prefetch)
+        if profile:
+            trdst = self.profiler.wrap_dataset(trdst)
+
+        # XLA auto-clustering of the keras training graph only.
+        with jit_scope(self.jit_compile):
+            self.model.fit(
+                x=trdst,
+                epochs=nb_epochs,
+                initial_epoch=initial_epoch,
+                callbacks=callback_list,
+                validation_data=valdst.prefetch(prefetch),
+                steps_per_epoch=steps_per_epoch * accumulation_steps,
+                verbose=1)
 
         return self
 
+    def receptive_field(self):
+        # Conservative default, override it with the exact radius of your model.
+        return 16
+
+    def _call_model(self, x):
+        return self.model(x, training=False)
+
+    def _forward(self, batch, ensemble=1):
+        # An inference function per ensemble size.
+        if ensemble not in self._predict_fns:
+
+            def fn(x):
+                # Python side effect, thus only counted when (re)tracing, once per
+                # trace whatever the number of model calls (e.g. of `self_ensemble`).
+                self.nb_traces += 1
+                if ensemble == 1:
+                    return self._call_model(x)
+                return self_ensemble(self._call_model, x, ensemble)
+
+            self._predict_fns[ensemble] = compile_function(
+                fn, self.jit_compile)
+        return self._predict_fns[ensemble](tf.convert_to_tensor(
+            batch, tf.float32)).numpy()
+
+    def predict_image(self,
+                      lr,
+                      tile_size=None,
+                      overlap=None,
+                      batch_size=4,
+                      ensemble=1):
+        '''Super-resolve a whole image with overlapping tiles.
+
+            Tiles are blended with feathered windows, thus there is no seam in
+            output and peak memory is bounded by `tile_size` instead of the
+            size of image.
+
+            Params:
+                lr: Numpy array or Tensor in shape of (H, W, C). Value in range (0, 1)
+                    Input of the model. (Upsampled lr-image if `pre_upsample`.)
+                tile_size: Int or None.
+                    Size of tiles in input pixels, four times of the
+                    receptive field (at least 64) by default.
+                overlap: Int or None.
+                    Overlap of adjacent tiles in input pixels, radius of the
+                    receptive field by default.
+                batch_size: Int.
+                    Number of tiles per forward pass.
+                ensemble: Int.
+                    Number of geometric transforms averaged per tile (1, 2, 4 or 8), see
+                    `inference.self_ensemble`. Transforms of a batch of tiles run in one
+                    forward pass of `batch_size * ensemble` tiles, thus reduce `batch_size`
+                    for the same memory.
+
+            Return:
+                Sr-image in Numpy array, float32 in range (0, 1).
+        '''
+        overlap = self.receptive_field() if overlap is None else overlap
+        tile_size = max(64, 4 * overlap) if tile_size is None else tile_size
+        if overlap >= tile_size:
+            raise ValueError("Overlap (%d) should be less than tile size (%d)." %
+                             (overlap, tile_size))
+
+        ratio = 1 if self.pre_upsample else self.scale
+        sr = tiled_predict(lambda batch: self._forward(batch, ensemble),
+                           np.asarray(lr, np.float32),
+                           ratio,
+                           tile_size,
+                           overlap,
+                           batch_size=batch_size)
+        return np.clip(sr, 0., 1.)
+
+    def predict_images(self, images, multiple=64, batch_size=4, **kwargs):
+        '''Super-resolve whole images of different sizes, batched by shape buckets.
+
+            Images are padded up to multiples of `multiple` and batched per padded shape,
+            thus the inference function is traced once per bucket instead of once per
+            image size. XXX Whole images are fed at once, use `predict_image` for images
+            too large for memory.
+
+            Params:
+                images: List of Numpy arrays in shape of (H, W, C). Value in range (0, 1)
+                    Inputs of the model. (Upsampled lr-images if `pre_upsample`.)
+                multiple, batch_size, **kwargs:
+                    See `inference.bucketed_predict`.
+
+            Return:
+                List of sr-images in Numpy array, float32 in range (0, 1), and Dict of
+                stats, with `nb_traces` (new traces of the inference function) and
+                `seconds` besides the ones of `bucketed_predict`.
+        '''
+        nb_traces, start = self.nb_traces, time.perf_counter()
+        ratio = 1 if self.pre_upsample else self.scale
+        outputs, stats = bucketed_predict(
+            self._forward, [np.asarray(x, np.float32) for x in images],
+            ratio,
+            multiple=multiple,
+            batch_size=batch_size,
+            **kwargs)
+        stats["nb_traces"] = self.nb_traces - nb_traces
+        stats["seconds"] = time.perf_counter() - start
+        return [np.clip(sr, 0., 1.) for sr in outputs], stats
+
+    def upscale(self, image, **kwargs):
+        '''Super-resolve a lr-image in range of (0, 255).
+
+            If `pre_upsample` is True, image is upsampled with `bicubic` kernel
+            first. Models of one channel super-resolve Y of RGB images, and CbCr
+            are upsampled with `bicubic` kernel (see `data_utils.merge_y`), thus
+            outputs are RGB as inputs. See `predict_image` for other params.
+
+            Return:
+                Sr-image in Numpy array, uint8.
+        '''
+        lr = tf.cast(image, tf.float32) / 255.
+        if len(lr.shape) == 2:
+            lr = lr[..., tf.newaxis]
+        cbcr = None
+        if self.channel == 1 and lr.shape[-1] == 3:
+            ycbcr = rgb2ycbcr(lr)
+            lr, cbcr = ycbcr[..., :1], ycbcr[..., 1:]
+        if self.pre_upsample:
+            H, W = lr.shape[:2]
+            lr = tf.clip_by_value(
+                tf.image.resize(lr, [H * self.scale, W * self.scale],
+                                method=tf.image.ResizeMethod.BICUBIC), 0., 1.)
+        sr = self.predict_image(lr.numpy(), **kwargs)
+        if cbcr is not None:
+            sr = merge_y(sr, cbcr)
+        return np.round(sr * 255.).astype(np.uint8)
+
+    def upscale_sequence(self, frames, sink, **kwargs):
+        '''Super-resolve a sequence of frames in range of (0, 255), with bounded memory.
+
+            See `stream.stream_upscale` for params.
+
+            Return:
+                Number of frames written to `sink`.
+        '''
+        return stream_upscale(self, frames, sink, **kwargs)
+
+    def _prepare_eval(self, path, method, restore_shape, degrade_kwargs):
+        hr = modcrop(np.asarray(Image.open(path).convert("RGB")), self.scale)
+        lr, hr = degrade_image(hr,
+                               self.scale,
+                               method=method,
+                               restore_shape=restore_shape,
+                               **degrade_kwargs)
+        if self.channel == 1:
+            lr = rgb2ycbcr(lr)[..., :1]
+        return lr.numpy(), hr
+
+    def evaluate(self,
+                 images,
+                 method=2,
+                 nb_workers=4,
+                 tile_size=None,
+                 batch_size=4,
+                 ensemble=1,
+                 predict_fn=None,
+                 **degrade_kwargs):
+        '''Evaluate the model on full-resolution images.
+
+            Hr-images are modcropped and degraded with `degrade_image`, lr-images are
+            super-resolved by tiled `predict_image` (thus large images don't OOM), then
+            PSNR and SSIM are computed on Y channel with borders of `scale` pixels shaved.
+            Images are loaded and degraded by `nb_workers` threads, concurrently with
+            super-resolving.
+
+            Params:
+                images: String or List of string.
+                    Directory of test images, or paths of them.
+                method: Int.
+                    Downsampling method, see `degrade_image`. (bicubic by default)
+                nb_workers: Int.
+                    Number of threads to prepare images.
+                tile_size, batch_size, ensemble:
+                    See `predict_image`.
+                predict_fn: Callable or None.
+                    Maps lr-image (not upsampled even if `pre_upsample`) in 0--1 to sr-image in 0--1,
+                    e.g. exported or quantized models, see `quantize.tflite_predict_fn`.
+                    Tiled `predict_image` of this model by default.
+                **degrade_kwargs: Dict.
+                    Other params of `degrade_image`, e.g. `kernel_sigma`.
+
+            Return:
+                Dict of mean `psnr`, `ssim` and per-image metrics.
+        '''
+        paths = sorted(glob.glob(os.path.join(images, "*"))) if isinstance(
+            images, str) else list(images)
+
+        if predict_fn is None:
+            restore_shape = self.pre_upsample
+            predict_fn = lambda lr: self.predict_image(
+                lr, tile_size=tile_size, batch_size=batch_size,
+                ensemble=ensemble)
+        else:
+            restore_shape = False
+
+        results = {}
+        with ThreadPoolExecutor(nb_workers) as pool:
+            # Keep at most `nb_workers` images prepared ahead.
+            futures = [
+                pool.submit(self._prepare_eval, p, method, restore_shape,
+                            degrade_kwargs) for p in paths[:nb_workers]
+            ]
+            for i, path in enumerate(paths):
+                lr, hr = futures[i].result()
+                futures[i] = None
+                if i + nb_workers < len(paths):
+                    futures.append(
+                        pool.submit(self._prepare_eval, paths[i + nb_workers],
+                                    method, restore_shape, degrade_kwargs))
+                sr = predict_fn(lr)
+                psnr, ssim = psnr_ssim_y(sr, hr, self.scale)
+                results[os.path.basename(path)] = {
+                    "psnr": float(psnr),
+                    "ssim": float(ssim)
+                }
+                print("%s: PSNR %.4f dB, SSIM %.4f" %
+                      (os.path.basename(path), psnr, ssim))
+
+        return {
+            "psnr": float(np.mean([r["psnr"] for r in results.values()])),
+            "ssim": float(np.mean([r["ssim"] for r in results.values()])),
+            "images": results
+        }
+
+    def export(self,
+               export_dir=None,
+               tflite=None,
+               representative_dataset=None,
+               tflite_shape=None):
+        '''Export the model for serving, without any python class of models.
+
+            Params:
+                export_dir: String or None.
+                    Directory of SavedModel, "./export/model_name" by default.
+                tflite: String or None.
+                    If given, also convert to TFLite model `export_dir_<tflite>.tflite`.
+                    One of "float32", "float16", "int8", see `export.export_tflite`.
+                representative_dataset: Callable or None.
+                    Calibration data for full int8 quantization, see `quantize.representative_dataset`.
+                tflite_shape: Tuple of integers or None.
+                    Fixed input (H, W) of TFLite model, e.g. tile size. (Dynamic by default.)
+
+            Return:
+                Directory of SavedModel, (and path to TFLite model).
+        '''
+        export_dir = os.path.join(
+            "./export", self.model_name) if export_dir is None else export_dir
+        export_saved_model(self, export_dir)
+        print("exported model %s to %s" % (self.model_name, export_dir))
+        if tflite is None:
+            return export_dir
+
+        tflite_path = "%s_%s.tflite" % (export_dir.rstrip("/\\"), tflite)
+        export_tflite(self, tflite_path, tflite, representative_dataset,
+                      tflite_shape)
+        print("exported model %s to %s" % (self.model_name, tflite_path))
+        return export_dir, tflite_path
+
     def plot_model(self, ):
         plot_model(self.model,
                    to_file="./%s.png" % self.model_name,
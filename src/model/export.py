@@ -0,0 +1,122 @@
+import tensorflow as tf
+
+TFLITE_MODES = ["float32", "float16", "int8"]
+
+
+def serving_function(sr_model, shape=None, uint8=True):
+    '''Batched serving function `serve(lr_uint8) -> sr_uint8` of a `BaseSRModel`.
+
+        Batch size is dynamic, so are height and width unless `shape` (H, W) is given.
+        Normalization (0--255 <-> 0--1), and bicubic upsampling for `pre_upsample`
+        models, are folded into the graph. If not `uint8`, inputs and outputs are
+        float32 in 0--1 instead (for full int8 quantization, see `export_tflite`).
+    '''
+    model, scale = sr_model.model, sr_model.scale
+    H, W = (None, None) if shape is None else shape
+    dtype, max_val = (tf.uint8, 255.) if uint8 else (tf.float32, 1.)
+
+    @tf.function(input_signature=[
+        tf.TensorSpec([None, H, W, sr_model.channel], dtype, name="lr")
+    ])
+    def serve(lr):
+        x = tf.cast(lr, tf.float32)
+        if sr_model.pre_upsample:
+            shape = tf.shape(x)
+            x = tf.clip_by_value(
+                tf.image.resize(x, [shape[1] * scale, shape[2] * scale],
+                                method=tf.image.ResizeMethod.BICUBIC), 0.,
+                max_val)
+        sr = tf.cast(model(x / max_val, training=False), tf.float32)
+        sr = tf.clip_by_value(sr, 0., 1.)
+        if not uint8:
+            return {"sr": sr}
+        return {"sr": tf.cast(tf.round(sr * 255.), tf.uint8)}
+
+    return serve
+
+
+def export_saved_model(sr_model, export_dir):
+    '''Write SavedModel with `serving_default` signature, see `serving_function`.'''
+    module = tf.Module()
+    # Track variables only (not keras layers), thus loading is just restoring
+    # weights and the traced graph.
+    module.weights = list(sr_model.model.weights)
+    module.serve = serving_function(sr_model)
+    tf.saved_model.save(module,
+                        export_dir,
+                        signatures={"serving_default": module.serve})
+    return export_dir
+
+
+def export_tflite(sr_model,
+                  tflite_path,
+                  mode="float32",
+                  representative_dataset=None,
+                  shape=None):
+    '''Convert serving function of `sr_model` to TFLite model.
+
+        Params:
+            sr_model: `BaseSRModel` with model created.
+            tflite_path: String.
+                Path to TFLite file.
+            mode: String.
+                One of "float32", "float16" (float16 weights) and "int8" (int8 weights,
+                and activations as well if `representative_dataset` is given).
+                XXX With int8 activations, inputs and outputs are quantized uint8 with
+                the calibrated scale and zero point (instead of raw 0--255 pixels), and
+                inputs of `pre_upsample` models stay float32 in 0--1, as bicubic resizing
+                runs as TF op. See `quantize.tflite_predict_fn`. This needs TF 2.3 or later.
+            representative_dataset: Callable or None.
+                Generator of lists of float32 inputs in 0--1 for calibration, see
+                `quantize.representative_dataset`.
+            shape: Tuple of integers or None.
+                Input (H, W) of TFLite model, e.g. tile size of tiled inference.
+                XXX Dynamic height and width need TFLite of TF 2.3 or later.
+
+        Return:
+            Path to TFLite file.
+    '''
+    assert mode in TFLITE_MODES, "Only %s modes are supported" % TFLITE_MODES
+
+    full_int8 = mode == "int8" and representative_dataset is not None
+    # Casts between uint8 and float break calibration, thus fully quantized
+    # models use float serving function and the converter quantizes its io.
+    serve = serving_function(sr_model, shape, uint8=not full_int8)
+    converter = tf.lite.TFLiteConverter.from_concrete_functions(
+        [serve.get_concrete_function()])
+    # MLIR converter, the legacy one can't take uint8 inputs of float models.
+    converter.experimental_new_converter = True
+    if mode == "float16":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif mode == "int8":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if full_int8:
+        converter.representative_dataset = tf.lite.RepresentativeDataset(
+            representative_dataset)
+        converter.inference_input_type = tf.uint8
+        converter.inference_output_type = tf.uint8
+    if sr_model.pre_upsample:
+        # No builtin bicubic resizing in TFLite, fall back to TF kernel.
+        converter.target_spec.supported_ops = [
+            tf.lite.OpsSet.TFLITE_BUILTINS_INT8
+            if full_int8 else tf.lite.OpsSet.TFLITE_BUILTINS,
+            tf.lite.OpsSet.SELECT_TF_OPS
+        ]
+
+    with open(tflite_path, "wb") as f:
+        f.write(converter.convert())
+    return tflite_path
+
+
+def load_saved_model(export_dir):
+    '''Load exported model, return the `serve(lr_uint8) -> sr_uint8` function.'''
+    loaded = tf.saved_model.load(export_dir)
+    signature = loaded.signatures["serving_default"]
+
+    def serve(lr):
+        # `loaded` is referenced here, thus variables are kept alive.
+        return signature(lr=tf.convert_to_tensor(lr, tf.uint8))["sr"]
+
+    serve.loaded = loaded
+    return serve
@@ -0,0 +1,244 @@
+import tensorflow as tf
+import itertools
+import numpy as np
+
+# Number of geometric transforms of `self_ensemble`.
+ENSEMBLE_SIZES = (1, 2, 4, 8)
+
+
+def tile_positions(length, tile, overlap):
+    '''Start offsets of tiles covering `length` pixels.
+
+        Adjacent tiles share at least `overlap` pixels, the last tile is
+        shifted back so that every tile has exactly the size `tile`.
+
+        Params:
+            length: Int.
+                Length of the image along one axis.
+            tile: Int.
+                Length of tiles along the same axis.
+            overlap: Int.
+                Minimum number of pixels shared by adjacent tiles.
+
+        Return:
+            List of integers.
+    '''
+    if length <= tile:
+        return [0]
+    stride = max(tile - overlap, 1)
+    nb_tiles = -(-(length - overlap) // stride)
+    return sorted(set(min(i * stride, length - tile) for i in range(nb_tiles)))
+
+
+def blend_window(size, overlap, head, tail):
+    '''1-D feathering window of a tile.
+
+        Weights ramp linearly from ~0 to 1 over `overlap` pixels on the sides
+        shared with a neighbouring tile (`head` / `tail`), and stay 1 on the
+        sides touching the border of the image.
+    '''
+    window = np.ones(size, np.float32)
+    overlap = min(overlap, size)
+    if overlap > 0:
+        ramp = (np.arange(overlap, dtype=np.float32) + 0.5) / overlap
+        if head:
+            window[:overlap] = np.minimum(window[:overlap], ramp)
+        if tail:
+            window[-overlap:] = np.minimum(window[-overlap:], ramp[::-1])
+    return window
+
+
+def tiled_predict(forward, image, ratio, tile_size, overlap, batch_size=4):
+    '''Super-resolve `image` tile by tile and stitch the outputs.
+
+        The image is split into overlapping tiles of `tile_size`, tiles are
+        fed to `forward` in batches and the outputs are blended with feathered
+        windows, thus peak memory of the model only depends on the tile size.
+
+        Params:
+            forward: Callable.
+                Maps a batch of tiles (N, h, w, C) to a batch of outputs
+                (N, h * ratio, w * ratio, C') in Numpy.
+            image: Numpy array in shape of (H, W, C).
+                Input image of the model.
+            ratio: Int.
+                Ratio between output size and input size of `forward`.
+            tile_size: Int.
+                Size of (square) tiles in input pixels.
+            overlap: Int.
+                Minimum overlap of adjacent tiles in input pixels.
+            batch_size: Int.
+                Number of tiles per forward pass.
+
+        Return:
+            Numpy array in shape of (H * ratio, W * ratio, C'), float32.
+    '''
+    H, W = image.shape[:2]
+    th, tw = min(tile_size, H), min(tile_size, W)
+    boxes = list(
+        itertools.product(tile_positions(H, th, overlap),
+                          tile_positions(W, tw, overlap)))
+
+    out, weight = None, np.zeros((H * ratio, W * ratio, 1), np.float32)
+    for i in range(0, len(boxes), batch_size):
+        chunk = boxes[i:i + batch_size]
+        batch = np.stack([image[y:y + th, x:x + tw] for y, x in chunk])
+        sr = np.asarray(forward(batch), np.float32)
+        if sr.shape[1:3] != (th * ratio, tw * ratio):
+            raise ValueError(
+                "Expect outputs of tiles in shape of %s, got %s." %
+                ((th * ratio, tw * ratio), sr.shape[1:3]))
+        if out is None:
+            out = np.zeros((H * ratio, W * ratio, sr.shape[-1]), np.float32)
+
+        for (y, x), patch in zip(chunk, sr):
+            window = np.outer(
+                blend_window(th * ratio, overlap * ratio, y > 0, y + th < H),
+                blend_window(tw * ratio, overlap * ratio, x > 0,
+                             x + tw < W))[..., np.newaxis]
+            ys = slice(y * ratio, (y + th) * ratio)
+            xs = slice(x * ratio, (x + tw) * ratio)
+            out[ys, xs] += patch * window
+            weight[ys, xs] += window
+
+    return out / weight
+
+
+def bucket_shape(height, width, multiple):
+    '''Shape of the bucket of an image, i.e. its size rounded up to `multiple`.'''
+    return (-(-height // multiple) * multiple, -(-width // multiple) * multiple)
+
+
+def bucketed_predict(forward,
+                     images,
+                     ratio,
+                     multiple=64,
+                     batch_size=4,
+                     pad_mode="reflect"):
+    '''Super-resolve images of different sizes in batches, grouped by shape buckets.
+
+        Each image is padded (bottom and right) up to a multiple of `multiple`, images
+        of the same padded shape are batched into `forward`, and outputs are cropped
+        back. Thus `forward` only sees a few shapes (no retracing for every new size),
+        while padding waste is bounded by `multiple`.
+
+        Params:
+            forward: Callable.
+                Maps a batch (N, h, w, C) to a batch (N, h * ratio, w * ratio, C') in Numpy.
+            images: List of Numpy arrays in shape of (H, W, C).
+                Inputs of the model.
+            ratio: Int.
+                Ratio between output size and input size of `forward`.
+            multiple: Int.
+                Granularity of buckets in input pixels, larger for fewer buckets
+                (shapes) but more padding.
+            batch_size: Int.
+                Max number of images per forward pass.
+            pad_mode: String.
+                Mode of `np.pad`. Padded borders affect outputs within the receptive
+                field of the bottom and right edges, "reflect" keeps them natural.
+
+        Return:
+            List of outputs in order of `images`, float32, and Dict of stats:
+            `buckets` (number of images per bucket "HxW"), `nb_batches`, and
+            `padding_overhead` (padded pixels / image pixels - 1).
+    '''
+    buckets = {}
+    for i, image in enumerate(images):
+        buckets.setdefault(bucket_shape(*image.shape[:2], multiple), []).append(i)
+
+    outputs, padded_pixels, nb_batches = [None] * len(images), 0, 0
+    for (bh, bw), indices in sorted(buckets.items()):
+        for i in range(0, len(indices), batch_size):
+            chunk = indices[i:i + batch_size]
+            batch = []
+            for j in chunk:
+                h, w = images[j].shape[:2]
+                # XXX "reflect" needs padding smaller than the image.
+                mode = pad_mode if bh < 2 * h and bw < 2 * w else "edge"
+                batch.append(
+                    np.pad(images[j], [(0, bh - h), (0, bw - w), (0, 0)],
+                           mode=mode))
+            sr = np.asarray(forward(np.stack(batch)), np.float32)
+            for j, patch in zip(chunk, sr):
+                h, w = images[j].shape[:2]
+                outputs[j] = patch[:h * ratio, :w * ratio]
+            padded_pixels += len(chunk) * bh * bw
+            nb_batches += 1
+
+    pixels = sum(image.shape[0] * image.shape[1] for image in images)
+    stats = {
+        "buckets": {
+            "%dx%d" % shape: len(indices)
+            for shape, indices in sorted(buckets.items())
+        },
+        "nb_batches": nb_batches,
+        "padding_overhead": padded_pixels / float(max(pixels, 1)) - 1.,
+    }
+    return outputs, stats
+
+
+def _flip(x, flip):
+    # Bit 0 of `flip` for horizontal flip, bit 1 for vertical flip.
+    if flip & 1:
+        x = x[:, :, ::-1]
+    if flip & 2:
+        x = x[:, ::-1]
+    return x
+
+
+def _transpose(x):
+    return tf.transpose(x, [0, 2, 1, 3])
+
+
+def self_ensemble(model_fn, x, nb_transforms=8):
+    '''Geometric self-ensemble of `model_fn`, in graph.
+
+        The batch is flipped / rotated, variants are stacked along the batch axis and
+        run by a single call of `model_fn`, then outputs are transformed back and
+        averaged. Subsets trade quality for latency (cost grows linearly):
+            - 2: identity and horizontal flip.
+            - 4: all flips (i.e. with rotation of 180 degrees), shape preserving.
+            - 8: the 4 above and their transposes (rotations of 90 / 270 degrees).
+        XXX Transposed variants of non-square inputs are of another shape, they are
+        run by a second call of `model_fn`.
+
+        Params:
+            model_fn: Callable.
+                Maps a batch (N, h, w, C) to a batch (N, h * ratio, w * ratio, C'), Tensor.
+            x: Tensor in shape of (N, h, w, C).
+            nb_transforms: Int.
+                One of `ENSEMBLE_SIZES`.
+
+        Return:
+            Tensor in shape of (N, h * ratio, w * ratio, C').
+    '''
+    if nb_transforms not in ENSEMBLE_SIZES:
+        raise ValueError("Expect number of transforms in %s, got %s." %
+                         (ENSEMBLE_SIZES, nb_transforms))
+    flips = range(min(nb_transforms, 4))
+
+    def run(variants):
+        # `variants` of (transposed, flip), undone in reverse order on outputs.
+        inputs = [_flip(_transpose(x) if t else x, f) for t, f in variants]
+        outputs = tf.split(model_fn(tf.concat(inputs, 0)), len(variants))
+        outputs = [_flip(y, f) for y, (_, f) in zip(outputs, variants)]
+        return tf.add_n([
+            _transpose(y) if t else y for y, (t, _) in zip(outputs, variants)
+        ])
+
+    plain = [(False, f) for f in flips]
+    if nb_transforms < 8:
+        return run(plain) / float(nb_transforms)
+
+    transposed = [(True, f) for f in flips]
+    single = lambda: run(plain + transposed)
+    separate = lambda: run(plain) + run(transposed)
+    H, W = x.shape[1], x.shape[2]
+    if H is not None and W is not None:
+        total = single() if H == W else separate()
+    else:
+        # Unknown (relaxed) shape, decide at runtime.
+        shape = tf.shape(x)
+        total = tf.cond(tf.equal(shape[1], shape[2]), single, separate)
+    return total / float(nb_transforms)
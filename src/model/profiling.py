@@ -0,0 +1,180 @@
+from tensorflow.python.keras import callbacks
+import tensorflow as tf
+import numpy as np
+import collections
+import resource
+import time
+import os
+
+
+def rss_mb():
+    '''Current resident memory of this process in MB. (Peak memory if not on linux.)'''
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 2.**20
+    except (IOError, OSError, ValueError):
+        # ru_maxrss is in kilobytes on linux.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+def start_trace(log_dir):
+    '''Start TF profiler, the trace is written to `log_dir` by `stop_trace`.'''
+    if hasattr(tf, "profiler") and hasattr(tf.profiler, "experimental"):
+        tf.profiler.experimental.start(log_dir)
+    else:
+        # XXX TF 2.0 / 2.1, the same as `profile_batch` of `TensorBoard`.
+        from tensorflow.python.eager import profiler
+        profiler.start()
+
+
+def stop_trace(log_dir):
+    if hasattr(tf, "profiler") and hasattr(tf.profiler, "experimental"):
+        tf.profiler.experimental.stop()
+    else:
+        from tensorflow.python.eager import profiler
+        profiler.save(log_dir, profiler.stop())
+
+
+class StepProfiler(callbacks.Callback):
+    '''Per-step profiling of training, to tell if the input pipeline or the model is the bottleneck.
+
+        The training dataset has to be wrapped with `wrap_dataset` (after `prefetch`),
+        which stamps the time each batch leaves the pipeline. Time of a step is split
+        into input wait (from the beginning of the step until its batch is ready) and
+        compute (the rest, i.e. forward, backward and update).
+
+        Per-step input wait, compute time, steps/sec, examples/sec and memory are written
+        to TensorBoard every `log_freq` steps (under `profile/`), and summarized per epoch
+        in `epochs` (and printed if `verbose`). A TF profiler trace of steps `trace_steps`
+        is captured in `log_dir` (see Profile tab of TensorBoard).
+
+        Attributes:
+            epochs: List of Dict, summary of each epoch.
+                - steps_per_sec, examples_per_sec: Throughput of training steps.
+                - input_wait_ms, compute_ms: Median time per step.
+                - input_wait_fraction: Fraction of step time spent waiting for input.
+                - rss_mb, peak_rss_mb: Memory of this process at the end of epoch.
+    '''
+
+    def __init__(self, log_dir=None, log_freq=10, trace_steps=None, verbose=1):
+        '''
+            Params:
+                log_dir: String or None.
+                    Directory of TensorBoard logs, nothing is written if None.
+                log_freq: Int.
+                    Write per-step scalars every `log_freq` steps.
+                trace_steps: Tuple of integers or None.
+                    (first, last) global step of the TF profiler trace, e.g. (10, 15).
+                    Skip the first steps, which include tracing of the model.
+                verbose: Int.
+                    Print the summary of each epoch if 1.
+        '''
+        super(StepProfiler, self).__init__()
+        if trace_steps is not None and log_dir is None:
+            raise ValueError("`log_dir` is required to save profiler traces.")
+        self.log_dir = log_dir
+        self.log_freq = log_freq
+        self.trace_steps = trace_steps
+        self.verbose = verbose
+        self.epochs = []
+        # (time, batch size) of batches taken from the pipeline, appended by
+        # the dataset and consumed by the step running on it.
+        self._ready = collections.deque()
+        self._writer = None
+        self._step = 0
+
+    def wrap_dataset(self, dataset):
+        '''Stamp batches of `dataset` when they are taken by training steps.
+
+            XXX Map it after `prefetch`, thus stamps are not taken ahead of steps.
+        '''
+        return dataset.map(self._stamp)
+
+    def _stamp(self, *batch):
+        size = tf.shape(tf.nest.flatten(batch)[0])[0]
+        stamp = tf.py_function(self._record, [size], tf.int32)
+        with tf.control_dependencies([stamp]):
+            batch = tf.nest.map_structure(tf.identity, batch)
+        return batch if len(batch) > 1 else batch[0]
+
+    def _record(self, size):
+        self._ready.append((time.perf_counter(), int(size)))
+        return 0
+
+    def on_train_begin(self, logs=None):
+        self._step = 0
+        if self.log_dir is not None:
+            self._writer = tf.summary.create_file_writer(
+                os.path.join(self.log_dir, "profile"))
+
+    def on_train_end(self, logs=None):
+        if self.trace_steps is not None:
+            first, last = self.trace_steps
+            if first < self._step <= last:
+                # Training stopped within the trace window.
+                stop_trace(self.log_dir)
+        if self._writer is not None:
+            self._writer.close()
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._waits, self._computes, self._examples = [], [], 0
+        self._epoch_start = self._last_end = time.perf_counter()
+        self._ready.clear()
+
+    def on_train_batch_begin(self, batch, logs=None):
+        if self.trace_steps is not None and self._step == self.trace_steps[0]:
+            start_trace(self.log_dir)
+        self._begin = time.perf_counter()
+
+    def on_train_batch_end(self, batch, logs=None):
+        end = time.perf_counter()
+        stamps = [self._ready.popleft() for _ in range(len(self._ready))]
+        ready, size = stamps[-1] if stamps else (self._begin,
+                                                 (logs or {}).get("size", 0))
+        wait = min(max(ready - self._begin, 0.), end - self._begin)
+        self._waits.append(wait)
+        self._computes.append(end - self._begin - wait)
+        self._examples += size
+        self._last_end = end
+
+        if self.trace_steps is not None and self._step == self.trace_steps[1]:
+            stop_trace(self.log_dir)
+        if self._writer is not None and self._step % self.log_freq == 0:
+            duration = end - self._begin
+            scalars = {
+                "input_wait_ms": wait * 1e3,
+                "compute_ms": (duration - wait) * 1e3,
+                "steps_per_sec": 1. / duration,
+                "examples_per_sec": size / duration,
+                "rss_mb": rss_mb(),
+            }
+            with self._writer.as_default():
+                for name, value in scalars.items():
+                    tf.summary.scalar("profile/" + name, value, step=self._step)
+        self._step += 1
+
+    def on_epoch_end(self, epoch, logs=None):
+        if not self._waits:
+            return
+        elapsed = self._last_end - self._epoch_start
+        total_wait = sum(self._waits)
+        summary = {
+            "steps_per_sec": len(self._waits) / elapsed,
+            "examples_per_sec": self._examples / elapsed,
+            "input_wait_ms": float(np.median(self._waits)) * 1e3,
+            "compute_ms": float(np.median(self._computes)) * 1e3,
+            "input_wait_fraction":
+            total_wait / (total_wait + sum(self._computes)),
+            "rss_mb": rss_mb(),
+            # ru_maxrss is in kilobytes on linux.
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.,
+        }
+        self.epochs.append(summary)
+        if self.verbose:
+            print("Profile: %.2f steps/s, %.1f examples/s, input wait %.1f ms "
+                  "(%.0f%%), compute %.1f ms, RSS %.0f MB" %
+                  (summary["steps_per_sec"], summary["examples_per_sec"],
+                   summary["input_wait_ms"],
+                   summary["input_wait_fraction"] * 100,
+                   summary["compute_ms"], summary["rss_mb"]))
@@ -0,0 +1,139 @@
+import tensorflow as tf
+import numpy as np
+
+from ..write2tfrec import load_tfrecord
+from ..data_utils import rgb2ycbcr
+from ..preprocess import degrade_image
+from .inference import tiled_predict
+from .export import export_tflite
+
+
+def representative_dataset(sr_model,
+                           tfrec_file,
+                           patch_size,
+                           nb_samples=200,
+                           method=2,
+                           **degrade_kwargs):
+    '''Calibration data of int8 quantization, from patches of `load_tfrecord`.
+
+        Hr-patches are degraded exactly like training data, thus activation ranges
+        are calibrated on the distribution the model is used on.
+
+        Params:
+            sr_model: `BaseSRModel`.
+            tfrec_file: String or List of string.
+                See `load_tfrecord`.
+            patch_size: Int or Tuple of integers.
+                Size of saved patches.
+                XXX If the model is converted with fixed `shape`, lr-patches must be of the
+                same shape, i.e. `patch_size` should be `shape * scale`.
+            nb_samples: Int.
+                Number of patches for calibration. (100--500 is usually enough)
+            method, **degrade_kwargs:
+                See `degrade_image`.
+
+        Return:
+            Callable, generator of `[lr]` in shape of (1, h, w, C), float32 in 0--1
+            rounded to 8-bit levels, as the input of the float serving function (not
+            upsampled even if `pre_upsample`).
+    '''
+
+    def _degrade(hr):
+        lr, _ = degrade_image(hr, sr_model.scale, method=method, **degrade_kwargs)
+        if sr_model.channel == 1:
+            lr = rgb2ycbcr(lr)[..., :1]
+        return tf.round(tf.clip_by_value(lr, 0., 1.) * 255.) / 255.
+
+    dst = load_tfrecord(patch_size, tfrec_file).take(nb_samples).map(_degrade)
+
+    def gen():
+        for lr in dst:
+            yield [lr[tf.newaxis]]
+
+    return gen
+
+
+def quantize_int8(sr_model, tflite_path, representative_dataset, shape=None):
+    '''Full int8 quantization (weights and activations) of `sr_model`.
+
+        Every layer of the graph is quantized, including `MeanShift` and
+        `SubpixelLayer` (depth-to-space only moves int8 values). See `export_tflite`.
+    '''
+    return export_tflite(sr_model,
+                         tflite_path,
+                         mode="int8",
+                         representative_dataset=representative_dataset,
+                         shape=shape)
+
+
+def tflite_predict_fn(tflite_path,
+                      scale,
+                      tile_size=64,
+                      overlap=8,
+                      batch_size=4,
+                      nb_threads=None):
+    '''Tiled CPU inference with a TFLite model of `export_tflite`.
+
+        Params:
+            tflite_path: String.
+                Path to TFLite file.
+            scale: Int.
+                Scale factor of the model.
+            tile_size: Int.
+                Size of tiles, should equal `shape` the model was converted with.
+                Images smaller than tiles are padded.
+            overlap, batch_size:
+                See `tiled_predict`.
+            nb_threads: Int or None.
+                Number of threads of TFLite interpreter.
+
+        Return:
+            Callable maps lr-image (H, W, C) in 0--1 to sr-image in 0--1, which
+            can be passed to `BaseSRModel.evaluate`.
+    '''
+    # XXX `num_threads` is only available since TF 2.1.
+    kwargs = {} if nb_threads is None else {"num_threads": nb_threads}
+    interpreter = tf.lite.Interpreter(model_path=tflite_path, **kwargs)
+    inp = interpreter.get_input_details()[0]
+    out = interpreter.get_output_details()[0]
+    # Allocate once, delegates can't be re-allocated for new shapes.
+    nb, th, tw = batch_size, tile_size, tile_size
+    interpreter.resize_tensor_input(inp["index"],
+                                    [nb, th, tw, inp["shape"][-1]])
+    interpreter.allocate_tensors()
+
+    def forward(batch):
+        # Pad the last batch and tiles of small images to the allocated shape.
+        n, h, w = batch.shape[:3]
+        batch = np.pad(batch, [(0, nb - n), (0, th - h), (0, tw - w), (0, 0)],
+                       mode="edge")
+        interpreter.set_tensor(inp["index"], _quantize(batch, inp))
+        interpreter.invoke()
+        sr = _dequantize(interpreter.get_tensor(out["index"]), out)
+        return sr[:n, :h * scale, :w * scale]
+
+    def predict(lr):
+        sr = tiled_predict(forward, lr, scale, tile_size, overlap, batch_size)
+        return np.clip(sr, 0., 1.)
+
+    return predict
+
+
+def _uint8_scale(details):
+    # Raw 0--255 pixels, unless quantized with calibrated (scale, zero_point).
+    scale, zero_point = details["quantization"]
+    return (scale, zero_point) if scale else (1. / 255., 0)
+
+
+def _quantize(x, details):
+    if details["dtype"] != np.uint8:
+        return x.astype(details["dtype"])
+    scale, zero_point = _uint8_scale(details)
+    return np.clip(np.round(x / scale + zero_point), 0., 255.).astype(np.uint8)
+
+
+def _dequantize(y, details):
+    if details["dtype"] != np.uint8:
+        return y.astype(np.float32)
+    scale, zero_point = _uint8_scale(details)
+    return (y.astype(np.float32) - zero_point) * scale
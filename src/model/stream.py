@@ -0,0 +1,221 @@
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+import tensorflow as tf
+import numpy as np
+import threading
+import queue
+import glob
+import os
+
+from ..data_utils import rgb2ycbcr, merge_y
+
+_END = object()
+
+
+def frames_from_dir(frame_dir, pattern="*"):
+    '''Sorted paths of frames in `frame_dir`, decoded lazily by `stream_upscale`.'''
+    return sorted(glob.glob(os.path.join(frame_dir, pattern)))
+
+
+def read_raw_frames(stream, height, width, channel=3):
+    '''Read frames of raw uint8 video from a binary stream.
+
+        E.g. stdout of `ffmpeg -i video.mp4 -f rawvideo -pix_fmt rgb24 -`.
+
+        Params:
+            stream: File-like object.
+            height, width, channel: Int.
+                Shape of frames.
+
+        Return:
+            Generator of Numpy arrays in shape of (height, width, channel), uint8.
+    '''
+    size = height * width * channel
+    while True:
+        data = stream.read(size)
+        if len(data) < size:
+            return
+        yield np.frombuffer(data, np.uint8).reshape(height, width, channel)
+
+
+def frames_to_dir(out_dir, fmt="%06d.png"):
+    '''Sink of `stream_upscale` writing the `i`-th frame to `out_dir/fmt % i`.'''
+    os.makedirs(out_dir, exist_ok=True)
+
+    def sink(index, frame):
+        Image.fromarray(np.squeeze(frame, -1) if frame.shape[-1] == 1 else
+                        frame).save(os.path.join(out_dir, fmt % index))
+
+    return sink
+
+
+def write_raw_frames(stream):
+    '''Sink of `stream_upscale` writing raw uint8 frames to a binary stream.
+
+        E.g. stdin of `ffmpeg -f rawvideo -pix_fmt rgb24 -s WxH -i - out.mp4`.
+    '''
+
+    def sink(index, frame):
+        stream.write(np.ascontiguousarray(frame).tobytes())
+
+    return sink
+
+
+def _decode(frame, channel):
+    # Path or uint8 array in (0, 255) -> float32 in 0--1, as `preprocess` does, and
+    # CbCr of RGB frames for models of one channel (None otherwise).
+    if isinstance(frame, str):
+        frame = Image.open(frame).convert("RGB")
+    frame = np.asarray(frame, np.float32) / 255.
+    if frame.ndim == 2:
+        frame = frame[..., np.newaxis]
+    if channel == 1 and frame.shape[-1] == 3:
+        ycbcr = rgb2ycbcr(frame).numpy()
+        return ycbcr[..., :1], ycbcr[..., 1:]
+    return frame, None
+
+
+def _put(q, item, stop):
+    # Blocking put, which gives up once another stage failed.
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _get(q, stop):
+    # Blocking get, which returns `_END` once another stage failed.
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    return _END
+
+
+def stream_upscale(sr_model,
+                   frames,
+                   sink,
+                   batch_size=4,
+                   nb_workers=4,
+                   queue_size=8,
+                   tile_size=None,
+                   ensemble=1):
+    '''Super-resolve a sequence of frames with overlapped decode, compute and encode.
+
+        Frames are decoded by `nb_workers` threads, batched into `sr_model.model` in
+        this thread, and outputs are converted and passed to `sink` by a writer thread.
+        Stages are connected by queues of `queue_size` frames, thus memory is bounded
+        no matter how long the sequence is.
+
+        Params:
+            sr_model: `BaseSRModel` with model created.
+            frames: Iterable.
+                Paths of frames (see `frames_from_dir`), or uint8 arrays in (0, 255) of
+                shape (H, W, C) (see `read_raw_frames`). Models of one channel
+                super-resolve Y of RGB frames, and CbCr are upsampled with `bicubic`
+                kernel (see `data_utils.merge_y`), thus outputs are RGB as inputs.
+            sink: Callable.
+                Called as `sink(index, sr_uint8)` in order of frames, see `frames_to_dir`
+                and `write_raw_frames`.
+            batch_size: Int.
+                Number of frames per forward pass. Frames are batched as long as their
+                shapes match.
+            nb_workers: Int.
+                Number of decoding threads.
+            queue_size: Int.
+                Max number of frames waiting between stages.
+            tile_size: Int or None.
+                If given, frames are super-resolved one by one with tiled `predict_image`
+                (`batch_size` tiles per forward pass), for frames too large for the model.
+            ensemble: Int.
+                Number of geometric transforms averaged, see `BaseSRModel.predict_image`.
+
+        Return:
+            Number of frames written.
+    '''
+    stop = threading.Event()
+    errors = []
+    decoded, encoded = queue.Queue(queue_size), queue.Queue(queue_size)
+
+    def read():
+        try:
+            with ThreadPoolExecutor(nb_workers) as pool:
+                for frame in frames:
+                    future = pool.submit(_decode, frame, sr_model.channel)
+                    if not _put(decoded, future, stop):
+                        return
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        _put(decoded, _END, stop)
+
+    def write():
+        while True:
+            item = _get(encoded, stop)
+            if item is _END:
+                return
+            index, sr, cbcr = item
+            try:
+                if cbcr is not None:
+                    sr = merge_y(sr, cbcr)
+                sink(index, np.round(sr * 255.).astype(np.uint8))
+            except Exception as e:
+                errors.append(e)
+                stop.set()
+                return
+
+    def upscale(batch):
+        lr = tf.convert_to_tensor(np.stack(batch))
+        if sr_model.pre_upsample:
+            H, W = batch[0].shape[:2]
+            lr = tf.clip_by_value(
+                tf.image.resize(lr, [H * sr_model.scale, W * sr_model.scale],
+                                method=tf.image.ResizeMethod.BICUBIC), 0., 1.)
+        if tile_size is None:
+            return np.clip(sr_model._forward(lr, ensemble), 0., 1.)
+        return [
+            sr_model.predict_image(x,
+                                   tile_size=tile_size,
+                                   batch_size=batch_size,
+                                   ensemble=ensemble)
+            for x in lr.numpy()
+        ]
+
+    reader = threading.Thread(target=read, daemon=True)
+    writer = threading.Thread(target=write, daemon=True)
+    reader.start()
+    writer.start()
+
+    nb_frames, batch, colors = 0, [], []
+    try:
+        while True:
+            item = _get(decoded, stop)
+            frame, cbcr = (None, None) if item is _END else item.result()
+            # Flush at the end, when the batch is full, or when shape changes.
+            if batch and (frame is None or len(batch) == batch_size
+                          or frame.shape != batch[0].shape):
+                for sr, color in zip(upscale(batch), colors):
+                    if not _put(encoded, (nb_frames, sr, color), stop):
+                        break
+                    nb_frames += 1
+                batch, colors = [], []
+            if frame is None:
+                break
+            batch.append(frame)
+            colors.append(cbcr)
+        _put(encoded, _END, stop)
+    except BaseException:
+        stop.set()
+        raise
+    finally:
+        writer.join()
+        stop.set()
+        reader.join()
+
+    if errors:
+        raise errors[0]
+    return nb_frames
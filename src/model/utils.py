@@ -2,6 +2,8 @@ from tensorflow.python import keras
 from tensorflow.python.keras import layers, callbacks, optimizers
 import tensorflow as tf
 
+from ..data_utils import rgb2ycbcr
+
 class SubpixelLayer(keras.Model):
     '''
     '''
@@ -15,15 +17,16 @@ class SubpixelLayer(keras.Model):
                  **kwargs):
         super(SubpixelLayer, self).__init__(*args, **kwargs)
 
+        self.scale = scale
         self.conv = layers.Conv2D(
             out_channel * scale**2,
             kernel_size,
             padding='same',
             activation=activation)
-        self.subpixel = layers.Lambda(lambda x: tf.nn.depth_to_space(x, scale))
 
     def call(self, inputs):
-        return self.subpixel(self.conv(inputs))
+        # No `Lambda` here, thus the layer can be traced and serialized.
+        return tf.nn.depth_to_space(self.conv(inputs), self.scale)
 
 
 class MeanShift(keras.layers.Layer):
@@ -32,18 +35,25 @@ class MeanShift(keras.layers.Layer):
     Meanshift layer for EDSR, add or substract the mean RGB value of
     DIV2K dataset. (Normalized to 0 -- 1)
 
+    XXX The mean is of RGB images, Y images (1 channel) are not shifted. Other
+    numbers of channels raise `ValueError`.
+
     Attribute:
         sign: 1 or -1, positive for adding and negative for substracting.
-        rgb_mean: Tensor, mean value of RGB channel.
+        rgb_mean: Tensor, mean value of RGB channel (zero for Y).
     '''
 
-    def __init__(self, sign=-1):
-        super(MeanShift, self).__init__()
+    def __init__(self, sign=-1, **kwargs):
+        super(MeanShift, self).__init__(**kwargs)
         self.sign = sign
 
     def build(self, input_shape):
-        self.rgb_mean = tf.convert_to_tensor([0.4488, 0.4371, 0.4040],
-                                             dtype=tf.float32)
+        channel = int(input_shape[-1])
+        if channel not in (1, 3):
+            raise ValueError("MeanShift expects RGB or Y images, got %d channels." %
+                             channel)
+        self.rgb_mean = tf.convert_to_tensor(
+            [0.4488, 0.4371, 0.4040] if channel == 3 else [0.], dtype=self.dtype)
 
     def call(self, input):
         if self.sign == -1:
@@ -60,3 +70,22 @@ def identity(y_true, y_pred):
 def psnr_tf(a, b):
     # return the psnr of normalized tensors
     return tf.image.psnr(a, b, 1.0)
+
+
+@tf.function(experimental_relax_shapes=True)
+def psnr_ssim_y(sr, hr, shave=0):
+    '''PSNR and SSIM on Y channel of normalized (0--1) images.
+
+        Params:
+            sr, hr: Tensors in shape of (..., H, W, C), RGB (C=3) or Y channel (C=1).
+            shave: Int, number of border pixels to ignore, usually the scale factor.
+
+        Return:
+            PSNR and SSIM of each image.
+    '''
+    sr, hr = [
+        x if x.shape[-1] == 1 else rgb2ycbcr(x)[..., :1] for x in (sr, hr)
+    ]
+    if shave > 0:
+        sr, hr = [x[..., shave:-shave, shave:-shave, :] for x in (sr, hr)]
+    return tf.image.psnr(sr, hr, 1.0), tf.image.ssim(sr, hr, 1.0)
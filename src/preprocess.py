@@ -1,5 +1,6 @@
 import tensorflow as tf
 import numpy as np
+import functools
 from .data_utils import modcrop
 
 TF_INTERP = {
@@ -9,10 +10,29 @@ TF_INTERP = {
 }
 
 
+@functools.lru_cache(maxsize=None)
+def _gaussian_kernel_np(sigma):
+    # Cached in Numpy, thus the kernel can be reused by any graph.
+    size = int(sigma * 6) + 1
+    size = size + 1 if size % 2 == 0 else size
+
+    x_points = np.arange(-(size - 1) // 2, (size - 1) // 2 + 1, 1)
+    y_points = x_points[::-1]
+    xs, ys = np.meshgrid(x_points, y_points)
+
+    kernel = np.exp(-(xs**2 + ys**2) / (2 * sigma**2)) / (2 * np.pi * sigma**2)
+    kernel = (kernel / np.sum(kernel)).astype(np.float32)
+    # The cached array itself is returned, freeze it against in-place edits.
+    kernel.setflags(write=False)
+
+    return kernel
+
+
 def gaussian_kernel(sigma=2.):
     ''' Get a gaussian kernel. 
         
         Size of kernel (odd) is greater than six times the sigma.
+        Kernels are cached per sigma.
 
         Param:
             sigma: float 
@@ -21,17 +41,7 @@ def gaussian_kernel(sigma=2.):
         return: 
             (normalized) Gaussian kernel，in shape of (size, size)
     '''
-    size = int(sigma * 6) + 1
-    size = size + 1 if size % 2 == 0 else size
-
-    x_points = np.arange(-(size - 1) // 2, (size - 1) // 2 + 1, 1)
-    y_points = x_points[::-1]
-    xs, ys = np.meshgrid(x_points, y_points)
-
-    kernel = tf.exp(-(xs**2 + ys**2) / (2 * sigma**2)) / (2 * np.pi * sigma**2)
-    kernel = kernel / tf.reduce_sum(kernel)
-
-    return tf.cast(kernel, tf.float32)
+    return tf.constant(_gaussian_kernel_np(float(sigma)))
 
 
 def downsample_gaussian(Hr, scale, kernel_sigma):
@@ -140,14 +150,176 @@ def degrade_image(Hr,
 
         lr, hr = downsample_interp(Hr, scale, method)
 
+    return degrade_lr(lr, hr, restore_shape, noise_level), hr
+
+
+def degrade_lr(lr, hr, restore_shape=False, noise_level=None):
+    '''Random and reshaping part of `degrade_image`, applied on downsampled lr.
+
+        Thus downsampled lr can be precomputed (see `write_dst_tfrec`), while noise is
+        still sampled on the fly.
+
+        Params:
+            lr: Tensor in shape of (h, w, C) or (N, h, w, C). Value in range (0, 1)
+                Downsampled lr-image(s).
+            hr: Tensor in shape of (H, W, C) or (N, H, W, C).
+                Modcropped hr-image(s), the target shape of `restore_shape`.
+            restore_shape, noise_level:
+                See `degrade_image`.
+
+        Return:
+            Degraded lr, in float32.
+    '''
     if noise_level is not None:
-        noise = tf.random.normal(lr.shape, stddev=1.0,
+        noise = tf.random.normal(tf.shape(lr), stddev=1.0,
                                  dtype=tf.float32) * noise_level / 255.
         lr = tf.clip_by_value(lr + noise, 0., 1.)
 
     if restore_shape:
-        lr = tf.image.resize(lr * 255., hr.shape[:2],
+        lr = tf.image.resize(lr * 255., tf.shape(hr)[-3:-1],
                              method=TF_INTERP[2]) / 255.
         lr = tf.clip_by_value(lr, 0., 1.)
 
-    return lr, hr
+    return lr
+
+
+def modcrop_batch(images, scale):
+    '''Crop batch of images wrt super-resolution scale factor, in graph.
+
+        Param:
+            images: Tensor in shape of (N, H, W, C).
+            scale: Int.
+        Return:
+            Cropped images.
+    '''
+    shape = tf.shape(images)
+    H, W = shape[1] - shape[1] % scale, shape[2] - shape[2] % scale
+    return images[:, :H, :W, :]
+
+
+def downsample_gaussian_batch(Hr, scale, kernel_sigma):
+    '''Batched version of `downsample_gaussian`.
+
+        Params:
+            Hr: Tensor in shape of (N, H, W, C). Value in (0, 255)
+                Batch of hr images to be downsampled.
+            scale: Int.
+                Scale factor of downsampling ratio.
+            kernel_sigma: Float.
+                Blur factor of Gaussian kernel.
+
+        Return:
+            Downsampled lr and Modcropped hr, normalized into 0--1 in float32. 
+    '''
+    kernel = _gaussian_kernel_np(float(kernel_sigma))
+    kernel_size = kernel.shape[0]
+    channel = Hr.shape[-1] if Hr.shape[-1] is not None else 3
+    kernel = np.tile(kernel[:, :, np.newaxis, np.newaxis], (1, 1, channel, 1))
+
+    Hr = modcrop_batch(tf.cast(Hr, tf.float32), scale)
+    Hr_p = tf.pad(Hr, [[0, 0]] + [[kernel_size // 2, kernel_size // 2]] * 2 +
+                  [[0, 0]], "SYMMETRIC")
+
+    downsampled_Lr = tf.nn.depthwise_conv2d(Hr_p,
+                                            kernel,
+                                            strides=[1, scale, scale, 1],
+                                            padding='VALID')
+    Lr = tf.clip_by_value(downsampled_Lr, 0., 255.)
+
+    return Lr / 255., Hr / 255.
+
+
+def downsample_interp_batch(Hr, scale, interp=2):
+    '''Batched version of `downsample_interp`.
+
+        Params:
+            Hr: Tensor in shape of (N, H, W, C). Value in range (0, 255)
+                Batch of hr images to be downsampled.
+            scale: Int.
+                Scale factor of downsampling ratio.
+            interp: Int. 
+                Interpolation method. One of 0: bilinear, 1: nearest-neighbor, 2: bicubic.
+
+        Return:
+            Downsampled lr and Modcropped hr, normalized into 0--1 in float32. 
+    '''
+    Hr = modcrop_batch(tf.cast(Hr, tf.float32), scale)
+    shape = tf.shape(Hr)
+
+    downsampled_Lr = tf.image.resize(Hr,
+                                     [shape[1] // scale, shape[2] // scale],
+                                     method=TF_INTERP[interp],
+                                     antialias=False)
+
+    Lr = tf.clip_by_value(downsampled_Lr, 0., 255.)
+
+    return Lr / 255., Hr / 255.
+
+
+@tf.function
+def degrade_batch(Hr,
+                  scale,
+                  method=-1,
+                  restore_shape=False,
+                  noise_level=None,
+                  **kwargs):
+    '''Batched version of `degrade_image`, traced into one graph.
+
+        Map it on batched dataset (i.e. after `.batch()`), so that the degradation runs
+        as vectorized ops on whole batch instead of per-sample map calls.
+        See `degrade_image` for details of params.
+
+        Params:
+            Hr: Tensor in shape of (N, H, W, C). Value in range (0, 255)
+                Batch of hr-images to be downsampled.
+
+        Return:
+            Degraded lr and Modcropped hr, normalized into 0--1 in float32. 
+    '''
+
+    if method == -1:
+        assert 'kernel_sigma' in kwargs.keys(
+        ), "With Gaussian method, sigma of kernel should be given."
+
+        lr, hr = downsample_gaussian_batch(Hr, scale, kwargs['kernel_sigma'])
+
+    else:
+        assert method in [
+            0, 1, 2
+        ], "Only -1: gaussian, 0: bilinear, 1: nearest-neighbor, 2: bicubic are supported"
+
+        lr, hr = downsample_interp_batch(Hr, scale, method)
+
+    return degrade_lr(lr, hr, restore_shape, noise_level), hr
+
+
+def degrade_multiscale(Hr,
+                       scales,
+                       method=-1,
+                       restore_shape=False,
+                       noise_level=None,
+                       **kwargs):
+    '''`degrade_batch` for several scales at once, e.g. for `EDSR_multiscale`.
+
+        Each batch of hr-patches is read once and degraded for every scale, instead of
+        once per scale in separate runs. Size of hr-patches should be divisible by all
+        of `scales` (e.g. 96 for 2, 3 and 4), so that all scales share the same hr.
+
+        Params:
+            Hr: Tensor in shape of (N, H, W, C). Value in range (0, 255)
+                Batch of hr-images to be downsampled.
+            scales: List of int.
+                Super-resolution ratio factors.
+            method, restore_shape, noise_level, **kwargs:
+                See `degrade_image`.
+
+        Return:
+            Dict of degraded lr, and dict of modcropped hr, keyed by "lr_x%d" and
+            "sr_x%d" of each scale (names of inputs and outputs of `EDSR_multiscale`).
+    '''
+    lrs, hrs = {}, {}
+    for scale in scales:
+        lr, hr = degrade_batch(Hr, scale, method, restore_shape, noise_level,
+                               **kwargs)
+        lrs["lr_x%d" % scale], hrs["sr_x%d" % scale] = lr, hr
+    return lrs, hrs
@@ -1,7 +1,6 @@
 
 import tensorflow as tf
-from tensorflow.python import keras
-from tqdm import tqdm
+from tensorflow.python.keras.optimizer_v2 import adam
 
 
 # -----------------------------------------------------------------------
@@ -11,94 +10,90 @@ from tqdm import tqdm
 # -----------------------------------------------------------------------
 
 
-class AdamWithWeightnorm(keras.optimizers.Adam):
-    def get_updates(self, loss, params):
-        grads = self.get_gradients(loss, params)
-        self.updates = [keras.backend.update_add(self.iterations, 1)]
-
-        lr = self.lr
-        if self.initial_decay > 0:
-            lr *= (1. / (1. + self.decay *
-                         keras.backend.cast(self.iterations, keras.backend.floatx())))
-
-        t = keras.backend.cast(self.iterations + 1, keras.backend.floatx())
-        lr_t = lr * keras.backend.sqrt(1. - keras.backend.pow(
-            self.beta_2, t)) / (1. - keras.backend.pow(self.beta_1, t))
-        shapes = [keras.backend.int_shape(p) for p in params]
-        ms = [keras.backend.zeros(shape) for shape in shapes]
-        vs = [keras.backend.zeros(shape) for shape in shapes]
-        self.weights = [self.iterations] + ms + vs
-
-        for p, g, m, v in zip(params, grads, ms, vs):
-
-            # if a weight tensor (len > 1) use weight normalized parameterization
-            # this is the only part changed w.r.t. keras.optimizers.Adam
-            ps = keras.backend.int_shape(p)
-            if len(ps) > 1:
-
-                # get weight normalization parameters
-                V, V_norm, V_scaler, g_param, grad_g, grad_V = get_weightnorm_params_and_grads(
-                    p, g)
-
-                # Adam containers for the 'g' parameter
-                V_scaler_shape = keras.backend.int_shape(V_scaler)
-                m_g = keras.backend.zeros(V_scaler_shape)
-                v_g = keras.backend.zeros(V_scaler_shape)
-
-                # update g parameters
-                m_g_t = (self.beta_1 * m_g) + (1. - self.beta_1) * grad_g
-                v_g_t = (self.beta_2 * v_g) + (1. - self.beta_2) * \
-                    keras.backend.square(grad_g)
-                new_g_param = g_param - lr_t * m_g_t / \
-                    (keras.backend.sqrt(v_g_t) + self.epsilon)
-                self.updates.append(keras.backend.update(m_g, m_g_t))
-                self.updates.append(keras.backend.update(v_g, v_g_t))
-
-                # update V parameters
-                m_t = (self.beta_1 * m) + (1. - self.beta_1) * grad_V
-                v_t = (self.beta_2 * v) + (1. - self.beta_2) * \
-                    keras.backend.square(grad_V)
-                new_V_param = V - lr_t * m_t / \
-                    (keras.backend.sqrt(v_t) + self.epsilon)
-                self.updates.append(keras.backend.update(m, m_t))
-                self.updates.append(keras.backend.update(v, v_t))
-
-                # if there are constraints we apply them to V, not W
-                if getattr(p, 'constraint', None) is not None:
-                    new_V_param = p.constraint(new_V_param)
-
-                # wn param updates --> W updates
-                add_weightnorm_param_updates(
-                    self.updates, new_V_param, new_g_param, p, V_scaler)
-
-            else:  # do optimization normally
-                m_t = (self.beta_1 * m) + (1. - self.beta_1) * g
-                v_t = (self.beta_2 * v) + (1. - self.beta_2) * \
-                    keras.backend.square(g)
-                p_t = p - lr_t * m_t / (keras.backend.sqrt(v_t) + self.epsilon)
-
-                self.updates.append(keras.backend.update(m, m_t))
-                self.updates.append(keras.backend.update(v, v_t))
-
-                new_p = p_t
-                # apply constraints
-                if getattr(p, 'constraint', None) is not None:
-                    new_p = p.constraint(new_p)
-                self.updates.append(keras.backend.update(p, new_p))
-        return self.updates
-
-
-def get_weightnorm_params_and_grads(p, g):
-    ps = keras.backend.int_shape(p)
-
-    # construct weight scaler: V_scaler = g/||V||
-    V_scaler_shape = (ps[-1],)  # assumes we're using tensorflow!
-    # init to ones, so effective parameters don't change
-    V_scaler = keras.backend.ones(V_scaler_shape)
+class AdamWithWeightnorm(adam.Adam):
+    '''Adam optimizer with weight-normalized parameterization, W = g * V / ||V||.
+
+        Each weight tensor (len > 1) is optimized in terms of direction V and norm g,
+        while keras only sees W. The parameterization is stored as a per-output scaler
+        V_scaler = g / ||V||, so V = W / V_scaler. All state lives in slot variables,
+        which are created once, thus it works in eager, `tf.function` and XLA-compiled
+        training. Biases are optimized by plain Adam.
+    '''
+
+    def _create_slots(self, var_list):
+        super(AdamWithWeightnorm, self)._create_slots(var_list)
+        for var in var_list:
+            if len(var.shape) > 1:
+                # init V_scaler to ones, so effective parameters don't change
+                self.add_slot(var, 'V_scaler', _ones_per_output)
+                self.add_slot(var, 'm_g', _zeros_per_output)
+                self.add_slot(var, 'v_g', _zeros_per_output)
+
+    def _resource_apply_dense(self, grad, var, *args, **kwargs):
+        if len(var.shape) <= 1:  # do optimization normally
+            return super(AdamWithWeightnorm,
+                         self)._resource_apply_dense(grad, var, *args,
+                                                     **kwargs)
+
+        var_dtype = var.dtype.base_dtype
+        beta_1 = self._get_hyper('beta_1', var_dtype)
+        beta_2 = self._get_hyper('beta_2', var_dtype)
+        epsilon = tf.convert_to_tensor(self.epsilon, var_dtype)
+        t = tf.cast(self.iterations + 1, var_dtype)
+        lr_t = self._decayed_lr(var_dtype) * tf.sqrt(
+            1. - tf.pow(beta_2, t)) / (1. - tf.pow(beta_1, t))
+
+        m, v = self.get_slot(var, 'm'), self.get_slot(var, 'v')
+        m_g, v_g = self.get_slot(var, 'm_g'), self.get_slot(var, 'v_g')
+        V_scaler = self.get_slot(var, 'V_scaler')
+
+        # get weight normalization parameters
+        V, g_param, grad_g, grad_V = get_weightnorm_params_and_grads(
+            var, grad, V_scaler)
+
+        # update g parameters
+        m_g_t = beta_1 * m_g + (1. - beta_1) * grad_g
+        v_g_t = beta_2 * v_g + (1. - beta_2) * tf.square(grad_g)
+        new_g_param = g_param - lr_t * m_g_t / (tf.sqrt(v_g_t) + epsilon)
+
+        # update V parameters
+        m_t = beta_1 * m + (1. - beta_1) * grad_V
+        v_t = beta_2 * v + (1. - beta_2) * tf.square(grad_V)
+        new_V_param = V - lr_t * m_t / (tf.sqrt(v_t) + epsilon)
+
+        # wn param updates --> W updates
+        new_W, new_V_scaler = get_weightnorm_updates(new_V_param, new_g_param)
+        return tf.group(m_g.assign(m_g_t), v_g.assign(v_g_t), m.assign(m_t),
+                        v.assign(v_t), V_scaler.assign(new_V_scaler),
+                        var.assign(new_W))
+
+    def _resource_apply_sparse(self, grad, var, indices, *args, **kwargs):
+        if len(var.shape) <= 1:
+            return super(AdamWithWeightnorm,
+                         self)._resource_apply_sparse(grad, var, indices,
+                                                      *args, **kwargs)
+        # norms couple all rows of V, thus weight tensors are updated densely
+        dense_grad = tf.math.unsorted_segment_sum(grad, indices,
+                                                  tf.shape(var)[0])
+        return self._resource_apply_dense(dense_grad, var, *args, **kwargs)
+
+
+def _ones_per_output(shape, dtype=None):
+    # assumes we're using tensorflow! (output channels last)
+    return tf.ones(shape[-1:], dtype)
+
+
+def _zeros_per_output(shape, dtype=None):
+    return tf.zeros(shape[-1:], dtype)
+
+
+def get_weightnorm_params_and_grads(p, g, V_scaler):
+    ps = p.shape
+    norm_axes = [i for i in range(len(ps) - 1)]
+    scaler = tf.reshape(V_scaler, [1] * len(norm_axes) + [-1])
 
     # get V parameters = ||V||/g * W
-    norm_axes = [i for i in range(len(ps) - 1)]
-    V = p / tf.reshape(V_scaler, [1] * len(norm_axes) + [-1])
+    V = p / scaler
 
     # split V_scaler into ||V|| and g parameters
     V_norm = tf.sqrt(tf.reduce_sum(tf.square(V), norm_axes))
@@ -106,20 +101,18 @@ def get_weightnorm_params_and_grads(p, g):
 
     # get grad in V,g parameters
     grad_g = tf.reduce_sum(g * V, norm_axes) / V_norm
-    grad_V = tf.reshape(V_scaler, [1] * len(norm_axes) + [-1]) * \
-        (g - tf.reshape(grad_g / V_norm, [1] * len(norm_axes) + [-1]) * V)
+    grad_V = scaler * (g - tf.reshape(grad_g / V_norm, [1] * len(norm_axes) +
+                                      [-1]) * V)
 
-    return V, V_norm, V_scaler, g_param, grad_g, grad_V
+    return V, g_param, grad_g, grad_V
 
 
-def add_weightnorm_param_updates(updates, new_V_param, new_g_param, W, V_scaler):
-    ps = keras.backend.int_shape(new_V_param)
+def get_weightnorm_updates(new_V_param, new_g_param):
+    ps = new_V_param.shape
     norm_axes = [i for i in range(len(ps) - 1)]
 
-    # update W and V_scaler
+    # new W and V_scaler
     new_V_norm = tf.sqrt(tf.reduce_sum(tf.square(new_V_param), norm_axes))
     new_V_scaler = new_g_param / new_V_norm
     new_W = tf.reshape(new_V_scaler, [1] * len(norm_axes) + [-1]) * new_V_param
-    updates.append(keras.backend.update(W, new_W))
-    updates.append(keras.backend.update(V_scaler, new_V_scaler))
-
+    return new_W, new_V_scaler
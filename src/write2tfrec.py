@@ -1,14 +1,22 @@
 from tensorflow.data import Dataset
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
 import tensorflow as tf
 from tqdm import tqdm
 from PIL import Image
 import numpy as np
 import itertools
+import hashlib
 import random
+import json
 import glob
 import os
 
+from .preprocess import degrade_batch, degrade_lr
+
 feature_name = "data"
+FORMATS = {"example": ".tfrec", "raw": ".raw"}
+AUTOTUNE = tf.data.experimental.AUTOTUNE
 
 
 def _bytes_feature(value):
@@ -19,10 +27,106 @@ def _bytes_feature(value):
     return tf.train.Feature(bytes_list=tf.train.BytesList(value=[value]))
 
 
-def write_dst_tfrec(paths, patch_per_image, patch_size, tfrec_path):
-    ''' Write patches of hr image into tfrecord file.
+def shard_path(tfrec_path, index, nb_shards, fmt="example"):
+    '''Path of the `index`-th shard, e.g. `prefix-00000-of-00004.tfrec`.'''
+    return "%s-%05d-of-%05d%s" % (tfrec_path, index, nb_shards, FORMATS[fmt])
+
+
+def degradation_config(scale, method=-1, **kwargs):
+    '''Deterministic part of `degrade_image` params, which can be precomputed.
+
+        Noise and `restore_shape` are applied at load time, thus not part of it.
+    '''
+    unknown = set(kwargs) - {"kernel_sigma"}
+    assert not unknown, "%s are applied at load time, not precomputed" % unknown
+    config = {"scale": int(scale), "method": int(method)}
+    if method == -1:
+        assert 'kernel_sigma' in kwargs.keys(
+        ), "With Gaussian method, sigma of kernel should be given."
+        config["kernel_sigma"] = float(kwargs["kernel_sigma"])
+    return config
+
+
+def degradation_key(scale, method=-1, **kwargs):
+    '''Feature name of lr-patches of a degradation, i.e. hash of the sorted config.'''
+    config = degradation_config(scale, method, **kwargs)
+    digest = hashlib.sha1(json.dumps(config, sort_keys=True).encode()).hexdigest()
+    return "lr_" + digest[:16]
+
+
+def _serialize_patch(patch, pairs=None):
+    # Same bytes as `tf.io.serialize_tensor`, without running any op.
+    data_str = tf.make_tensor_proto(patch).SerializeToString()
+    # Create a dictionary mapping the feature name to the tf.Example-compatible
+    # data type.
+    feature = {feature_name: _bytes_feature(data_str)}
+    for key, lr in (pairs or {}).items():
+        feature[key] = _bytes_feature(tf.make_tensor_proto(lr).SerializeToString())
+    # Create a Features message using tf.train.Example.
+    example_proto = tf.train.Example(features=tf.train.Features(
+        feature=feature))
+    return example_proto.SerializeToString()
+
+
+def _crop_image(path, patch_per_image, patch_size, seed=None, fmt="example",
+                degradations=None):
+    '''Crop patches from the image of `path` and serialize them into records.
+
+        Runs in worker processes, thus only pure python / numpy code is used
+        to decode and crop images. (Precomputed degradations run `degrade_batch`
+        on patches of the image.)
+
+        Return:
+            List of serialized records (bytes).
+    '''
+    H, W = patch_size
+    rng = np.random.RandomState(seed)
+    img = np.asarray(Image.open(path).convert("RGB"))
+    h, w = img.shape[:2]
+    if h < H or w < W:
+        raise ValueError("Image %s in shape of %s is smaller than patch." %
+                         (path, (h, w)))
+    patches = []
+    for _ in range(patch_per_image):
+        y, x = rng.randint(0, h - H + 1), rng.randint(0, w - W + 1)
+        patches.append(np.ascontiguousarray(img[y:y + H, x:x + W]))
+    if fmt == "raw":
+        # Fixed-length records, bytes of patches are simply concatenated.
+        return [patch.tobytes() for patch in patches]
+    if not degradations:
+        return [_serialize_patch(patch) for patch in patches]
+    # Lr-patches are stored in uint8, as lr-images on disk usually are.
+    pairs = {}
+    for config in degradations:
+        lr, _ = degrade_batch(np.stack(patches), **config)
+        pairs[degradation_key(**config)] = np.round(
+            lr.numpy() * 255.).astype(np.uint8)
+    return [
+        _serialize_patch(patch, {k: v[i]
+                                 for k, v in pairs.items()})
+        for i, patch in enumerate(patches)
+    ]
+
+
+def _open_writer(path, fmt):
+    return open(path, "wb") if fmt == "raw" else tf.io.TFRecordWriter(path)
+
+
+def write_dst_tfrec(paths,
+                    patch_per_image,
+                    patch_size,
+                    tfrec_path,
+                    nb_shards=1,
+                    nb_workers=1,
+                    seed=None,
+                    fmt="example",
+                    degradations=None):
+    ''' Write patches of hr image into tfrecord file(s).
 
         We save all patches in dtype of Uint8, which cropped from Hr-image in RGB color space.
+        Images are decoded and cropped by a pool of `nb_workers` processes in parallel
+        (independently of `nb_shards`), and their patches are distributed over `nb_shards`
+        shards (round-robin by image).
 
         Params:
 
@@ -33,45 +137,115 @@ def write_dst_tfrec(paths, patch_per_image, patch_size, tfrec_path):
             patch_size: Int or Tuple of integers.
                 Size of patch, e.g. (48, 48).
             tfrec_path: String.
-                Path to tfrecord file.
+                Path to tfrecord file. If `nb_shards` > 1, it is used as prefix of shards
+                (`tfrec_path-00000-of-000NN.tfrec`). A manifest `tfrec_path.manifest.json`
+                is written, which lists shards and their number of patches.
+            nb_shards: Int.
+                Number of tfrecord files to write.
+            nb_workers: Int.
+                Number of worker processes.
+                XXX Workers are spawned, guard your script with `if __name__ == '__main__'`.
+            seed: Int or None.
+                Random seed of cropping. (Image `i` uses `seed + i`, thus patches don't
+                depend on `nb_workers` and `nb_shards`.)
+            fmt: String.
+                On-disk format of patches. One of
+                "example": `tf.train.Example` with serialized tensor, load it by `load_tfrecord`.
+                "raw": fixed-length records of raw uint8 bytes (`.raw` shards), load it by `load_raw`.
+            degradations: List of Dict or None.
+                Deterministic degradations to precompute, e.g. `[{"scale": 2, "method": 2},
+                {"scale": 4, "method": -1, "kernel_sigma": 1.6}]` (see `degrade_image`).
+                Lr-patches of each degradation are stored (in uint8) in the same record as
+                hr-patch, keyed by `degradation_key`, load pairs by `load_paired_tfrecord`.
+                XXX Only for "example" format. Patch size should be divisible by scales.
+
+        Return:
+            List of paths of written tfrecord files.
     '''
 
     print('WRITING TO TFRECORD'.center(100, '='))
 
+    assert fmt in FORMATS, "Only %s formats are supported" % list(FORMATS)
+    degradations = [degradation_config(**d) for d in degradations or []]
+    assert not degradations or fmt == "example", \
+        "Precomputed degradations are only stored in example format"
+
     H, W = patch_size if isinstance(patch_size, tuple) else (patch_size, ) * 2
+    paths = list(paths)
+
+    if nb_shards == 1:
+        shards = [tfrec_path]
+    else:
+        shards = [
+            shard_path(tfrec_path, i, nb_shards, fmt) for i in range(nb_shards)
+        ]
+    jobs = [(p, patch_per_image, (H, W), None if seed is None else seed + i,
+             fmt, degradations) for i, p in enumerate(paths)]
+
+    counts = [0] * nb_shards
+    writers = [_open_writer(path, fmt) for path in shards]
+    try:
+        if nb_workers > 1:
+            # `spawn` avoids forking the (multi-threaded) tensorflow runtime.
+            pool = ProcessPoolExecutor(
+                nb_workers, mp_context=multiprocessing.get_context("spawn"))
+            with pool:
+                records = pool.map(_crop_image, *zip(*jobs))
+                _write_records(records, writers, counts, len(jobs))
+        else:
+            records = (_crop_image(*job) for job in jobs)
+            _write_records(records, writers, counts, len(jobs))
+    finally:
+        for writer in writers:
+            writer.close()
+
+    manifest = {
+        "format": fmt,
+        "patch_size": [H, W],
+        "patch_per_image": patch_per_image,
+        "nb_patches": sum(counts),
+        "degradations": {degradation_key(**d): d
+                         for d in degradations},
+        "shards": [{
+            "path": os.path.basename(p),
+            "nb_patches": c
+        } for p, c in zip(shards, counts)]
+    }
+    with open(tfrec_path + ".manifest.json", "w") as f:
+        json.dump(manifest, f, indent=2)
 
-    def _serialize_generator_():
-        '''
-        Python generator, yield patch randomly cropped from Hr-image.
-        '''
-        for _, p in tqdm(enumerate(paths)):
-            img = tf.image.decode_image(tf.io.read_file(p))
-            for _ in range(patch_per_image):
-                patch = tf.image.random_crop(img, (H, W, 3))
-                data_str = tf.io.serialize_tensor(patch)
-                # Create a dictionary mapping the feature name to the tf.Example-compatible
-                # data type.
-                feature = {feature_name: _bytes_feature(data_str)}
-                # Create a Features message using tf.train.Example.
-                example_proto = tf.train.Example(features=tf.train.Features(
-                    feature=feature))
-                yield example_proto.SerializeToString()
-
-    serialize_dst = tf.data.Dataset.from_generator(_serialize_generator_,
-                                                   output_types=tf.string)
-
-    writer = tf.data.experimental.TFRecordWriter(tfrec_path)
-    writer.write(serialize_dst)
-
-
-def load_tfrecord(patch_size, tfrec_file):
+    return shards
+
+
+def _write_records(records, writers, counts, nb_images):
+    # Records of image `i` go to shard `i % nb_shards`, in order of images.
+    for i, image_records in enumerate(tqdm(records, total=nb_images)):
+        writer = writers[i % len(writers)]
+        for record in image_records:
+            writer.write(record)
+        counts[i % len(writers)] += len(image_records)
+
+
+def load_tfrecord(patch_size, tfrec_file, shuffle_files=False, cycle_length=4,
+                  seed=None):
     '''Load patches from tfrecord wroten by `write_dst_tfrec`
 
+        Shards are read in parallel and interleaved.
+
         Params:
             patch_size: Int or Tuple of integers.
                 Size of saved patches.
-            tfrec_file: String.
-                Path to tfrecord file.
+            tfrec_file: String or List of string.
+                Path to tfrecord file, or glob pattern of shards, e.g. `prefix-*-of-*.tfrec`.
+            shuffle_files: Bool.
+                Whether to shuffle the order of shards.
+            cycle_length: Int.
+                Number of shards read concurrently.
+            seed: Int or None.
+                Random seed of the order of shards. XXX With multiple workers,
+                auto-sharding may split shards (or patches) over workers after they
+                are shuffled, thus the seed should be the same on all workers,
+                otherwise some are read by several workers and others by none.
 
         Return: 
             TF-Dataset contains Hr-patches.
@@ -91,6 +265,118 @@ def load_tfrecord(patch_size, tfrec_file):
                                         tuple) else (patch_size, ) * 2
         return tf.reshape(img, [H, W, 3])
 
-    raw_dataset = tf.data.TFRecordDataset(tfrec_file)
-    parsed_dataset = raw_dataset.map(_parse_function)
+    files = tf.data.Dataset.list_files(tfrec_file,
+                                       shuffle=shuffle_files,
+                                       seed=seed)
+    raw_dataset = files.interleave(tf.data.TFRecordDataset,
+                                   cycle_length=cycle_length,
+                                   num_parallel_calls=AUTOTUNE)
+    parsed_dataset = raw_dataset.map(_parse_function,
+                                     num_parallel_calls=AUTOTUNE)
     return parsed_dataset
+
+
+def load_paired_tfrecord(patch_size,
+                         tfrec_file,
+                         scale,
+                         method=-1,
+                         restore_shape=False,
+                         noise_level=None,
+                         shuffle_files=False,
+                         cycle_length=4,
+                         seed=None,
+                         **kwargs):
+    '''Load precomputed (lr, hr) pairs from tfrecord wroten by `write_dst_tfrec` with `degradations`.
+
+        Lr-patches of the degradation (`scale`, `method`, `kernel_sigma`) are picked by
+        `degradation_key`, thus noise-free degradations cost nothing at training time.
+        Noise and `restore_shape` are still applied on the fly, see `degrade_lr`.
+
+        Params:
+            patch_size: Int or Tuple of integers.
+                Size of saved (hr) patches.
+            tfrec_file: String or List of string.
+                Path to tfrecord file, or glob pattern of shards.
+            scale, method, restore_shape, noise_level, **kwargs:
+                See `degrade_image`.
+            shuffle_files, cycle_length, seed:
+                See `load_tfrecord`.
+
+        Return:
+            TF-Dataset contains (lr, hr) pairs, the same as mapping `degrade_image` on
+            `load_tfrecord`, except that lr-patches are rounded to 8-bit.
+    '''
+    key = degradation_key(scale, method, **kwargs)
+    H, W = patch_size if isinstance(patch_size, tuple) else (patch_size, ) * 2
+    # Hr-patches are modcropped, as `degrade_image` does.
+    h, w = H // scale, W // scale
+
+    def _parse_function(example_proto):
+        feature_description = {
+            feature_name: tf.io.FixedLenFeature([], tf.string,
+                                                default_value=''),
+            key: tf.io.FixedLenFeature([], tf.string, default_value='')
+        }
+        features = tf.io.parse_single_example(example_proto,
+                                              feature_description)
+        check = tf.debugging.assert_greater(
+            tf.strings.length(features[key]), 0,
+            message="No precomputed lr-patches of %s (%s) in records." %
+            (degradation_config(scale, method, **kwargs), key))
+        with tf.control_dependencies([check]):
+            lr = tf.io.parse_tensor(features[key], out_type=tf.uint8)
+        hr = tf.io.parse_tensor(features[feature_name], out_type=tf.uint8)
+        hr = tf.reshape(hr, [H, W, 3])[:h * scale, :w * scale]
+        lr = tf.reshape(lr, [h, w, 3])
+        lr, hr = tf.cast(lr, tf.float32) / 255., tf.cast(hr, tf.float32) / 255.
+        return degrade_lr(lr, hr, restore_shape, noise_level), hr
+
+    files = tf.data.Dataset.list_files(tfrec_file,
+                                       shuffle=shuffle_files,
+                                       seed=seed)
+    raw_dataset = files.interleave(tf.data.TFRecordDataset,
+                                   cycle_length=cycle_length,
+                                   num_parallel_calls=AUTOTUNE)
+    return raw_dataset.map(_parse_function, num_parallel_calls=AUTOTUNE)
+
+
+def load_raw(patch_size, raw_file, shuffle_files=False, cycle_length=4,
+             block_size=256, seed=None):
+    '''Load patches from raw files wroten by `write_dst_tfrec` with `fmt="raw"`.
+
+        Records are read in blocks of `block_size` patches, and each block is decoded
+        with a single `decode_raw` and reshape, there is no proto parsing at all.
+
+        Params:
+            patch_size: Int or Tuple of integers.
+                Size of saved patches.
+            raw_file: String or List of string.
+                Path to raw file, or glob pattern of shards, e.g. `prefix-*-of-*.raw`.
+            shuffle_files: Bool.
+                Whether to shuffle the order of shards.
+            cycle_length: Int.
+                Number of shards read concurrently.
+            block_size: Int.
+                Number of patches decoded at one time.
+            seed: Int or None.
+                Random seed of the order of shards, see `load_tfrecord`.
+
+        Return: 
+            TF-Dataset contains Hr-patches.
+    '''
+    H, W = patch_size if isinstance(patch_size, tuple) else (patch_size, ) * 2
+
+    def _read_blocks(filename):
+        return tf.data.FixedLengthRecordDataset(filename,
+                                                H * W * 3).batch(block_size)
+
+    def _decode_block(block):
+        return tf.reshape(tf.io.decode_raw(block, tf.uint8), [-1, H, W, 3])
+
+    files = tf.data.Dataset.list_files(raw_file,
+                                       shuffle=shuffle_files,
+                                       seed=seed)
+    blocks = files.interleave(_read_blocks,
+                              cycle_length=cycle_length,
+                              num_parallel_calls=AUTOTUNE)
+    return blocks.map(_decode_block, num_parallel_calls=AUTOTUNE).unbatch()
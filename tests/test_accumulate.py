@@ -0,0 +1,114 @@
+import numpy as np
+import tensorflow as tf
+from tensorflow.python.keras.optimizer_v2.adam import Adam
+
+from src.accumulate import GradientAccumulation
+from src.wn import AdamWithWeightnorm
+
+
+def setUpModule():
+    # Two replicas on CPU for the strategy test, only possible before TF is initialized
+    # (e.g. if other tests ran first in the same process, it runs on one replica).
+    cpu = tf.config.experimental.list_physical_devices("CPU")[0]
+    try:
+        tf.config.experimental.set_virtual_device_configuration(
+            cpu, [tf.config.experimental.VirtualDeviceConfiguration()] * 2)
+    except RuntimeError:
+        pass
+
+
+class GradientAccumulationTest(tf.test.TestCase):
+    '''Parity of `GradientAccumulation` over micro-batches with one update per large batch.'''
+
+    nb_steps = 4
+    batch_size = 8
+
+    def setUp(self):
+        super(GradientAccumulationTest, self).setUp()
+        rng = np.random.RandomState(0)
+        # Magnitude of initialized conv kernels, the tolerance below is a few float32 ulps of it.
+        self.kernel = 0.1 * rng.randn(3, 3, 4, 8).astype(np.float32)
+        self.bias = 0.1 * rng.randn(8).astype(np.float32)
+        self.x = rng.rand(3 * self.batch_size, 6, 6, 4).astype(np.float32)
+        self.y = rng.rand(3 * self.batch_size, 6, 6, 8).astype(np.float32)
+
+    def _loss(self, w, b, x, y):
+        return tf.reduce_mean(tf.square(tf.nn.conv2d(x, w, 1, "SAME") + b - y))
+
+    def _reference(self, optimizer):
+        w, b = tf.Variable(self.kernel), tf.Variable(self.bias)
+        for i in range(0, len(self.x), self.batch_size):
+            x, y = self.x[i:i + self.batch_size], self.y[i:i + self.batch_size]
+            with tf.GradientTape() as tape:
+                loss = self._loss(w, b, x, y)
+            optimizer.apply_gradients(zip(tape.gradient(loss, [w, b]), [w, b]))
+        return w.numpy(), b.numpy(), optimizer.iterations.numpy()
+
+    def _accumulated(self, optimizer):
+        w, b = tf.Variable(self.kernel), tf.Variable(self.bias)
+        optimizer = GradientAccumulation(optimizer, self.nb_steps)
+        micro = self.batch_size // self.nb_steps
+        for i in range(0, len(self.x), micro):
+            x, y = self.x[i:i + micro], self.y[i:i + micro]
+            with tf.GradientTape() as tape:
+                loss = self._loss(w, b, x, y)
+            optimizer.apply_gradients(zip(tape.gradient(loss, [w, b]), [w, b]))
+        return w.numpy(), b.numpy(), optimizer.iterations.numpy()
+
+    def _check(self, make_optimizer, accumulated):
+        w, b, iterations = accumulated(make_optimizer())
+        w_ref, b_ref, iterations_ref = self._reference(make_optimizer())
+        # One update of the wrapped optimizer per large batch.
+        self.assertEqual(iterations, iterations_ref)
+        self.assertAllClose(w, w_ref, rtol=0, atol=2e-7)
+        self.assertAllClose(b, b_ref, rtol=0, atol=2e-7)
+        # Weights did move, thus the parity is not trivial.
+        self.assertGreater(np.abs(w - self.kernel).max(), 1e-3)
+
+    def test_adam(self):
+        self._check(lambda: Adam(learning_rate=1e-3), self._accumulated)
+
+    def test_adam_with_weightnorm(self):
+        self._check(lambda: AdamWithWeightnorm(learning_rate=1e-3),
+                    self._accumulated)
+
+    def _accumulated_in_strategy(self, optimizer):
+        # Accumulation in `merge_call`, with micro-batches split over replicas.
+        devices = [
+            d.name for d in tf.config.experimental.list_logical_devices("CPU")
+        ]
+        strategy = tf.distribute.MirroredStrategy(devices)
+        micro = self.batch_size // self.nb_steps
+        with strategy.scope():
+            w, b = tf.Variable(self.kernel), tf.Variable(self.bias)
+            optimizer = GradientAccumulation(optimizer, self.nb_steps)
+        dst = strategy.experimental_distribute_dataset(
+            tf.data.Dataset.from_tensor_slices((self.x, self.y)).batch(micro))
+
+        def replica_step(x, y):
+            with tf.GradientTape() as tape:
+                # Scaled as keras does, thus the sum over replicas is the mean.
+                loss = self._loss(w, b, x, y) / strategy.num_replicas_in_sync
+            optimizer.apply_gradients(zip(tape.gradient(loss, [w, b]), [w, b]))
+
+        @tf.function
+        def step(x, y):
+            # XXX `run` is named `experimental_run_v2` before TF 2.2.
+            run = getattr(strategy, "run", None) or strategy.experimental_run_v2
+            run(replica_step, args=(x, y))
+
+        for x, y in dst:
+            step(x, y)
+        return w.numpy(), b.numpy(), optimizer.iterations.numpy()
+
+    def test_adam_in_strategy(self):
+        self._check(lambda: Adam(learning_rate=1e-3),
+                    self._accumulated_in_strategy)
+
+    def test_adam_with_weightnorm_in_strategy(self):
+        self._check(lambda: AdamWithWeightnorm(learning_rate=1e-3),
+                    self._accumulated_in_strategy)
+
+
+if __name__ == "__main__":
+    tf.test.main()
@@ -0,0 +1,88 @@
+import os
+import tempfile
+
+import numpy as np
+import tensorflow as tf
+
+from src.model.EDSR import EDSR, ResidualStack, _is_fused_h5
+
+
+def _edsr(fused, name="edsr", **kwargs):
+    # Small EDSR, same wiring as the full one.
+    sr = EDSR(2, name, fused=fused, **kwargs)
+    sr.F, sr.nb_resblock = 16, 3
+    return sr
+
+
+class FusedEDSRTest(tf.test.TestCase):
+    '''Parity of EDSR with residual blocks fused in a `ResidualStack`, and its weights.'''
+
+    def setUp(self):
+        super(FusedEDSRTest, self).setUp()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.x = np.random.RandomState(0).rand(2, 12, 12, 3).astype(np.float32)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+        super(FusedEDSRTest, self).tearDown()
+
+    def test_fused_matches_unfused(self):
+        plain = _edsr(False).create_model().model
+        fused = _edsr(True).create_model().model
+        fused.set_weights(plain.get_weights())
+
+        # res_scale is folded into conv2 at inference only.
+        for training in (False, True):
+            self.assertAllClose(fused(self.x, training=training).numpy(),
+                                plain(self.x, training=training).numpy(),
+                                atol=1e-5)
+
+    def test_h5_round_trip(self):
+        for fused in (False, True):
+            src = _edsr(fused).create_model()
+            path = os.path.join(self.tmp.name, "fused_%s.h5" % fused)
+            src.model.save_weights(path)
+            self.assertEqual(_is_fused_h5(path), fused)
+            expected = src.model.predict(self.x)
+
+            # Into the same variant, and converted into the other one.
+            for load_fused in (fused, not fused):
+                dst = _edsr(load_fused, name="dst").create_model(
+                    load_weights=True, weights_path=path)
+                self.assertAllClose(dst.model.predict(self.x), expected,
+                                    atol=1e-5)
+
+
+class RecomputeTest(tf.test.TestCase):
+    '''Gradients of `ResidualStack` with `checkpoint_every` (recomputation) match plain ones.'''
+
+    def _gradients(self, stack, x, y, eager):
+        def step():
+            with tf.GradientTape() as tape:
+                tape.watch(x)
+                loss = tf.reduce_sum(tf.square(stack(x, training=True) - y))
+            return tape.gradient(loss, [x] + stack.trainable_weights)
+
+        return [g.numpy() for g in (step() if eager else tf.function(step)())]
+
+    def test_gradients_match(self):
+        rng = np.random.RandomState(0)
+        x = tf.constant(rng.rand(2, 8, 8, 16).astype(np.float32))
+        y = tf.constant(rng.rand(2, 8, 8, 16).astype(np.float32))
+        plain = ResidualStack(16, 4, 0.1)
+        plain.build(x.shape)
+
+        for k in (1, 3):
+            stack = ResidualStack(16, 4, 0.1, checkpoint_every=k)
+            stack.build(x.shape)
+            stack.set_weights(plain.get_weights())
+            for eager in (True, False):
+                expected = self._gradients(plain, x, y, eager)
+                grads = self._gradients(stack, x, y, eager)
+                self.assertEqual(len(grads), len(expected))
+                for g, e in zip(grads, expected):
+                    self.assertAllClose(g, e, rtol=1e-5, atol=1e-5)
+
+
+if __name__ == "__main__":
+    tf.test.main()
@@ -0,0 +1,43 @@
+import numpy as np
+import tensorflow as tf
+
+from src.model import CARN, EDSR_baseline, EDSR_multiscale
+from src.model.utils import MeanShift
+
+
+class ChannelTest(tf.test.TestCase):
+    '''Models with `MeanShift` work on Y images (1 channel) as well as RGB ones.'''
+
+    def _small(self, sr):
+        # Fewer features and blocks, same wiring.
+        sr.F = 8
+        for name in ("nb_resblock", "nb_blocks", "nb_res"):
+            if hasattr(sr, name):
+                setattr(sr, name, 1)
+        return sr.create_model()
+
+    def test_outputs_have_input_channels(self):
+        for channel in (1, 3):
+            lr = np.random.RandomState(0).rand(2, 6, 6, channel).astype(np.float32)
+            for sr in (CARN(2, "carn", channel=channel),
+                       EDSR_baseline(2, "edsr", channel=channel)):
+                model = self._small(sr).model
+                self.assertEqual(model.predict(lr).shape, (2, 12, 12, channel))
+                model.compile(optimizer="adam", loss="mse")
+                model.train_on_batch(lr, np.zeros((2, 12, 12, channel), np.float32))
+
+            sr = self._small(EDSR_multiscale([2, 3], "mdsr", channel=channel))
+            for scale, out in zip((2, 3), sr.model.predict([lr, lr])):
+                self.assertEqual(out.shape, (2, 6 * scale, 6 * scale, channel))
+
+    def test_mean_shift(self):
+        rgb = tf.zeros((1, 2, 2, 3))
+        self.assertAllClose(MeanShift(1)(rgb)[0, 0, 0], [0.4488, 0.4371, 0.4040])
+        # Y is not shifted.
+        self.assertAllClose(MeanShift(-1)(tf.ones((1, 2, 2, 1))), tf.ones((1, 2, 2, 1)))
+        with self.assertRaises(ValueError):
+            MeanShift(-1)(tf.zeros((1, 2, 2, 2)))
+
+
+if __name__ == "__main__":
+    tf.test.main()
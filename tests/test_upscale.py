@@ -0,0 +1,61 @@
+import numpy as np
+import tensorflow as tf
+
+from src.data_utils import rgb2ycbcr, ycbcr2rgb, merge_y
+from src.model import ESPCN, SRCNN_915
+
+
+class UpscaleTest(tf.test.TestCase):
+    '''Models of one channel upscale RGB images to RGB, Y super-resolved and CbCr by bicubic.'''
+
+    def setUp(self):
+        super(UpscaleTest, self).setUp()
+        rng = np.random.RandomState(0)
+        self.images = [rng.randint(0, 256, (10, 12, 3)).astype(np.uint8)] * 2
+
+    def _check(self, sr, outputs):
+        for image, out in zip(self.images, outputs):
+            self.assertEqual(out.shape, (20, 24, 3))
+            self.assertEqual(out.dtype, np.uint8)
+            # Y super-resolved by the model, with CbCr of the image.
+            ycbcr = rgb2ycbcr(image / 255.)
+            lr = ycbcr[..., :1]
+            if sr.pre_upsample:
+                lr = tf.image.resize(lr, [20, 24],
+                                     method=tf.image.ResizeMethod.BICUBIC)
+            y = np.clip(sr.model.predict(lr[tf.newaxis].numpy())[0], 0., 1.)
+            expected = np.round(merge_y(y, ycbcr[..., 1:]) * 255.)
+            # Up to rounding to 8-bit.
+            self.assertAllClose(out, expected, atol=1)
+
+    def test_ycbcr2rgb(self):
+        rgb = np.random.RandomState(1).rand(4, 5, 3).astype(np.float32)
+        self.assertAllClose(ycbcr2rgb(rgb2ycbcr(rgb)), rgb, atol=1e-6)
+
+    def test_upscale(self):
+        for sr in (ESPCN(2, "espcn"), SRCNN_915(2, "srcnn")):
+            sr.create_model()
+            self._check(sr, [sr.upscale(image) for image in self.images])
+
+    def test_nb_traces(self):
+        sr = ESPCN(2, "espcn").create_model()
+        lr = np.zeros((1, 8, 8, 1), np.float32)
+        for ensemble in (1, 8):
+            nb_traces = sr.nb_traces
+            sr._forward(lr, ensemble)
+            sr._forward(lr, ensemble)
+            # One trace, whatever the number of model calls of the ensemble.
+            self.assertEqual(sr.nb_traces - nb_traces, 1)
+
+    def test_upscale_sequence(self):
+        for sr in (ESPCN(2, "espcn"), SRCNN_915(2, "srcnn")):
+            sr.create_model()
+            outputs = {}
+            nb_frames = sr.upscale_sequence(
+                self.images, lambda i, out: outputs.__setitem__(i, out))
+            self.assertEqual(nb_frames, len(self.images))
+            self._check(sr, [outputs[i] for i in range(nb_frames)])
+
+
+if __name__ == "__main__":
+    tf.test.main()
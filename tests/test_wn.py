@@ -0,0 +1,52 @@
+import numpy as np
+import tensorflow as tf
+from tensorflow.python.keras.optimizer_v2.adam import Adam
+
+from src.wn import AdamWithWeightnorm
+
+
+class AdamWithWeightnormTest(tf.test.TestCase):
+    '''Parity of `AdamWithWeightnorm` on W with plain Adam on explicit (V, g), g = ||V||.'''
+
+    def test_parity_with_adam_on_v_and_g(self):
+        rng = np.random.RandomState(0)
+        kernel = rng.randn(3, 3, 4, 8).astype(np.float32)
+        bias = rng.randn(8).astype(np.float32)
+        x = tf.constant(rng.rand(2, 6, 6, 4).astype(np.float32))
+        y = tf.constant(rng.rand(2, 6, 6, 8).astype(np.float32))
+
+        def loss_fn(w, b):
+            return tf.reduce_mean(
+                tf.square(tf.nn.conv2d(x, w, 1, "SAME") + b - y))
+
+        # Weight-normalized parameterization seen by keras as W.
+        W, b = tf.Variable(kernel), tf.Variable(bias)
+        wn_opt = AdamWithWeightnorm(learning_rate=1e-2)
+
+        # Reference: plain Adam on direction V and norm g.
+        V = tf.Variable(kernel)
+        g = tf.Variable(np.sqrt((kernel**2).sum(axis=(0, 1, 2))))
+        b_ref = tf.Variable(bias)
+        ref_opt = Adam(learning_rate=1e-2)
+
+        def ref_kernel():
+            return g * V / tf.sqrt(tf.reduce_sum(tf.square(V), [0, 1, 2]))
+
+        for _ in range(20):
+            with tf.GradientTape() as tape:
+                loss = loss_fn(W, b)
+            wn_opt.apply_gradients(zip(tape.gradient(loss, [W, b]), [W, b]))
+
+            with tf.GradientTape() as tape:
+                loss = loss_fn(ref_kernel(), b_ref)
+            ref_opt.apply_gradients(
+                zip(tape.gradient(loss, [V, g, b_ref]), [V, g, b_ref]))
+
+        self.assertAllClose(W.numpy(), ref_kernel().numpy(), atol=1e-5)
+        self.assertAllClose(b.numpy(), b_ref.numpy(), atol=1e-6)
+        # Weights did move, thus the parity is not trivial.
+        self.assertGreater(np.abs(W.numpy() - kernel).max(), 1e-2)
+
+
+if __name__ == "__main__":
+    tf.test.main()
@@ -0,0 +1,74 @@
+import os
+import tempfile
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.python.distribute import input_ops
+
+from src.write2tfrec import feature_name, load_tfrecord
+
+
+class ShardedLoadTest(tf.test.TestCase):
+    '''Shuffled shards split over workers by FILE auto-sharding, as `MultiWorkerMirroredStrategy` does.'''
+
+    nb_files = 8
+    nb_records = 3
+    nb_workers = 2
+
+    def setUp(self):
+        super(ShardedLoadTest, self).setUp()
+        self.tmp = tempfile.TemporaryDirectory()
+        # Patches of shard `i` are filled with `i`.
+        for i in range(self.nb_files):
+            path = os.path.join(self.tmp.name, "shard-%d.tfrec" % i)
+            with tf.io.TFRecordWriter(path) as writer:
+                patch = tf.io.serialize_tensor(np.full((2, 2, 3), i, np.uint8))
+                example = tf.train.Example(features=tf.train.Features(
+                    feature={
+                        feature_name:
+                        tf.train.Feature(bytes_list=tf.train.BytesList(
+                            value=[patch.numpy()]))
+                    }))
+                for _ in range(self.nb_records):
+                    writer.write(example.SerializeToString())
+
+    def tearDown(self):
+        self.tmp.cleanup()
+        super(ShardedLoadTest, self).tearDown()
+
+    def _read_worker(self, index, nb_epochs, seed, by_data=False):
+        # Pipeline of one worker, built on its own as in its own process.
+        dst = load_tfrecord(2, os.path.join(self.tmp.name, "shard-*.tfrec"),
+                            shuffle_files=True, seed=seed).repeat(nb_epochs)
+        if by_data:
+            # Fallback of auto-sharding if files can't be split over workers, after
+            # shuffling, thus only right if all workers read in the same order.
+            dst = dst.shard(self.nb_workers, index)
+        else:
+            dst = input_ops.auto_shard_dataset(dst, self.nb_workers, index)
+        shards = [int(patch[0, 0, 0]) for patch in dst]
+        return np.split(np.array(shards), nb_epochs)
+
+    def _check_each_shard_read_once_per_epoch(self, by_data):
+        nb_epochs = 3
+        epochs = [
+            self._read_worker(i, nb_epochs, seed=7, by_data=by_data)
+            for i in range(self.nb_workers)
+        ]
+        for epoch in range(nb_epochs):
+            shards = np.concatenate([worker[epoch] for worker in epochs])
+            self.assertAllEqual(
+                np.bincount(shards, minlength=self.nb_files),
+                [self.nb_records] * self.nb_files)
+        # Shards are shuffled, not read in the same order every epoch.
+        self.assertNotAllEqual(epochs[0][0], epochs[0][1])
+
+    def test_each_shard_read_once_per_epoch(self):
+        self._check_each_shard_read_once_per_epoch(by_data=False)
+
+    def test_each_shard_read_once_per_epoch_by_data(self):
+        self._check_each_shard_read_once_per_epoch(by_data=True)
+
+
+if __name__ == "__main__":
+    tf.test.main()